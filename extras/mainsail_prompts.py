@@ -2,6 +2,13 @@
 from __future__ import annotations
 
 from enum import Enum
+from typing import TYPE_CHECKING, Callable
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
+# the prefix RESPOND TYPE=command adds to the message
+RESPOND_PREFIX = "// "
 
 
 class Color(Enum):
@@ -33,32 +40,107 @@ class Color(Enum):
         Returns:
             Color: The enum.
         """
-        if not isinstance(color, (str, Color)):
+        if isinstance(color, Color):
+            return color
+        if not isinstance(color, str):
             raise TypeError(
                 "color should be a Color enum value or one of {}, not {}: '{}'".format(
-                    [c.name.title() for c in cls] + [c.value for c in cls],
-                    color.__class__.__name__,
-                    color,
+                    cls._valid_names, color.__class__.__name__, color
                 )
             )
-        if isinstance(color, str):
-            color_name_lut = dict([(c.name.lower(), c.name) for c in cls])
-            color_name_lut.update(dict([(c.value.lower(), c.name) for c in cls]))
-            color_lower_case = color.lower()
-            if color_lower_case not in color_name_lut:
-                raise ValueError(
-                    "color should be a Color enum value or one of {}, not '{}'".format(
-                        [c.name.title() for c in cls] + [c.value for c in cls], color
-                    )
+        try:
+            return cls._lookup[color.lower()]
+        except KeyError:
+            raise ValueError(
+                "color should be a Color enum value or one of {}, not '{}'".format(
+                    cls._valid_names, color
                 )
+            ) from None
 
-            return cls.__members__[color_name_lut[color_lower_case]]
 
-        return color
+# the lookup tables are built once, Enum members can't be defined in the body
+Color._valid_names = [c.name.title() for c in Color] + [c.value for c in Color]
+Color._lookup = {c.name.lower(): c for c in Color}
+Color._lookup.update({c.value.lower(): c for c in Color})
 
 
 class MainsailPromptBase:
-    """The base class for all prompt related classes."""
+    """The base class for all prompt related classes.
+
+    The instances are immutable, so their rendered output is memoized, and
+    equal instances can be used as dict keys or cached.
+    """
+
+    __slots__ = ("_actions", "_gcode", "_hash")
+
+    def __setattr__(self, name: str, value: object) -> None:
+        """Prevent changing the attributes.
+
+        Raises:
+            AttributeError: Always.
+        """
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        """Prevent deleting the attributes.
+
+        Raises:
+            AttributeError: Always.
+        """
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def _key(self) -> tuple:
+        """Return the values that define this instance.
+
+        Returns:
+            tuple: The values.
+        """
+        return ()
+
+    def __eq__(self, other: object) -> bool:
+        """Check the equality.
+
+        Args:
+            other (object): The other object.
+
+        Returns:
+            bool: True if the other object is of the same type with the same
+                values.
+        """
+        return type(self) is type(other) and self._key() == other._key()
+
+    def __hash__(self) -> int:
+        """Return the hash value.
+
+        Returns:
+            int: The hash value.
+        """
+        try:
+            return self._hash
+        except AttributeError:
+            object.__setattr__(self, "_hash", hash((type(self), self._key())))
+            return self._hash
+
+    def iter_actions(self) -> Iterator[str]:
+        """Stream the action:prompt_* payloads of this instance.
+
+        Yields:
+            str: The action payloads, one per line.
+        """
+        raise NotImplementedError("This needs to be implemented in the derived class")
+
+    def to_actions(self) -> list[str]:
+        """Return the action:prompt_* payloads of this instance.
+
+        Returns:
+            list[str]: The action payloads, one per line.
+        """
+        try:
+            actions = self._actions
+        except AttributeError:
+            actions = tuple(self.iter_actions())
+            object.__setattr__(self, "_actions", actions)
+        return list(actions)
 
     def to_gcode(self) -> str:
         """Return the GCode command representation of this instance.
@@ -66,17 +148,47 @@ class MainsailPromptBase:
         Returns:
             str: The GCode command representation of this instance.
         """
-        raise NotImplementedError("This needs to be implemented in the derived class")
+        try:
+            return self._gcode
+        except AttributeError:
+            gcode = "\n".join(
+                f'RESPOND TYPE=command MSG="{action}"' for action in self.to_actions()
+            )
+            object.__setattr__(self, "_gcode", gcode)
+            return gcode
+
+    def respond(self, respond_raw: Callable[[str], None]) -> None:
+        """Send the action payloads directly, without running RESPOND commands.
+
+        This produces the same output as running the to_gcode() commands,
+        without parsing and dispatching a G-code command per line.
+
+        Args:
+            respond_raw (Callable[[str], None]): The function to send the raw
+                responses with, i.e. GCodeDispatch.respond_raw.
+        """
+        for action in self.to_actions():
+            respond_raw(f"{RESPOND_PREFIX}{action}")
 
 
 class Text(MainsailPromptBase):
     """Implements the Mainsail prompt texts."""
 
+    __slots__ = ("text",)
+
     def __init__(self, text: str) -> None:
-        self.text = text
+        object.__setattr__(self, "text", text)
 
-    def to_gcode(self) -> str:
-        return f'RESPOND TYPE=command MSG="action:prompt_text {self.text}"'
+    def _key(self) -> tuple:
+        return (self.text,)
+
+    def iter_actions(self) -> Iterator[str]:
+        """Stream the action payloads.
+
+        Yields:
+            str: The action payloads of the text.
+        """
+        yield f"action:prompt_text {self.text}"
 
 
 class Button(MainsailPromptBase):
@@ -89,20 +201,28 @@ class Button(MainsailPromptBase):
         color (None | Color): The color of the button. Default is None.
     """
 
+    __slots__ = ("label", "gcode", "color")
+
+    # the prompt action of the button
+    ACTION = "prompt_button"
+
     def __init__(
         self, label: str, gcode: None | str, color: None | Color = None
     ) -> None:
-        self.label = label
-        self.gcode = gcode if gcode else ""
-        self.color = color if color else ""
+        object.__setattr__(self, "label", label)
+        object.__setattr__(self, "gcode", gcode if gcode else "")
+        object.__setattr__(self, "color", color if color else "")
 
-    def to_gcode(self) -> str:
-        """Return the GCode representation.
+    def _key(self) -> tuple:
+        return (self.label, self.gcode, self.color)
 
-        Returns:
-            str: The string representation of the button.
+    def iter_actions(self) -> Iterator[str]:
+        """Stream the action payloads.
+
+        Yields:
+            str: The action payloads of the button.
         """
-        return f'RESPOND TYPE=command MSG="action:prompt_button {self.label}|{self.gcode}|{self.color}"'
+        yield f"action:{self.ACTION} {self.label}|{self.gcode}|{self.color}"
 
 
 class FooterButton(Button):
@@ -115,34 +235,33 @@ class FooterButton(Button):
         color (None | Color): The color of the button. Default is None.
     """
 
-    def to_gcode(self) -> str:
-        """Return the GCode representation.
+    __slots__ = ()
 
-        Returns:
-            str: The string representation of the button.
-        """
-        return (
-            super()
-            .to_gcode()
-            .replace("action:prompt_button", "action:prompt_footer_button")
-        )
+    ACTION = "prompt_footer_button"
 
 
 class ButtonGroup(MainsailPromptBase):
     """ButtonGroup implements Mainsail button groups."""
 
-    def __init__(self, buttons: None | list[Button] = None) -> None:
-        self.buttons = buttons if buttons else []
+    __slots__ = ("buttons",)
+
+    def __init__(self, buttons: None | Iterable[Button] = None) -> None:
+        object.__setattr__(self, "buttons", tuple(buttons) if buttons else ())
 
-    def to_gcode(self):
-        gcode_buffer = [f'RESPOND TYPE=command MSG="action:prompt_button_group_start"']
+    def _key(self) -> tuple:
+        return self.buttons
+
+    def iter_actions(self) -> Iterator[str]:
+        """Stream the action payloads.
+
+        Yields:
+            str: The action payloads of the group and its buttons.
+        """
+        yield "action:prompt_button_group_start"
         # process buttons
         for button in self.buttons:
-            gcode_buffer.append(button.to_gcode())
-        gcode_buffer.append(
-            f'RESPOND TYPE=command MSG="action:prompt_button_group_end"'
-        )
-        return "\n".join(gcode_buffer)
+            yield from button.iter_actions()
+        yield "action:prompt_button_group_end"
 
 
 class Prompt(MainsailPromptBase):
@@ -151,24 +270,26 @@ class Prompt(MainsailPromptBase):
     This shows a prompt in Mainsail UI for the user to interact with.
     """
 
+    __slots__ = ("headline", "widgets")
+
     def __init__(
         self,
         headline: str = "",
-        widgets: None | list[Text | Button | ButtonGroup] = None,
+        widgets: None | Iterable[Text | Button | ButtonGroup] = None,
     ):
-        self.headline = headline
-        self.widgets = widgets if widgets else []
+        object.__setattr__(self, "headline", headline)
+        object.__setattr__(self, "widgets", tuple(widgets) if widgets else ())
 
-    def to_gcode(self) -> str:
-        """Render the gcode version of this Prompt.
+    def _key(self) -> tuple:
+        return (self.headline, self.widgets)
 
-        Returns:
-            str: The GCode string that corresponds to this Prompt instance.
+    def iter_actions(self) -> Iterator[str]:
+        """Stream the action payloads of this Prompt.
+
+        Yields:
+            str: The action payloads that correspond to this Prompt instance.
         """
-        gcode_buffer = [
-            f'RESPOND TYPE=command MSG="action:prompt_begin {self.headline}"'
-        ]
+        yield f"action:prompt_begin {self.headline}"
         for widget in self.widgets:
-            gcode_buffer.append(widget.to_gcode())
-        gcode_buffer.append('RESPOND TYPE=command MSG="action:prompt_show"')
-        return "\n".join(gcode_buffer)
+            yield from widget.iter_actions()
+        yield "action:prompt_show"
@@ -3,12 +3,18 @@
 # Standard Library Imports
 from __future__ import annotations
 
+import collections
 import configparser
 import contextlib
 import enum
+import json
+import logging
+import math
+import os
 import re
+import statistics
 import time
-from functools import partial, wraps
+from functools import lru_cache, partial, wraps
 from typing import TYPE_CHECKING, Callable
 
 # Local Imports
@@ -31,23 +37,25 @@ if TYPE_CHECKING:
     else:
         from typing_extensions import Self
 
+    from collections.abc import Iterator
     from types import TracebackType
 
     from configfile import ConfigWrapper
     from gcode import GCodeCommand, GCodeDispatch
     from kinematics.extruder import PrinterExtruder
     from klippy import Printer
-    from mcu import MCU_endstop
+    from mcu import MCU, MCU_endstop
     from reactor import PollReactor as Reactor
     from toolhead import ToolHead
     from extras.motion_queuing import PrinterMotionQueuing
 
     from extras.display_status import DisplayStatus
     from extras.filament_motion_sensor import EncoderSensor
-    from extras.filament_switch_sensor import SwitchSensor
+    from extras.filament_switch_sensor import RunoutHelper, SwitchSensor
     from extras.gcode_move import GCodeMove
     from extras.heaters import Heater, PrinterHeaters
     from extras.query_endstops import QueryEndstops
+    from extras.virtual_sdcard import VirtualSD
 
 
 IDLER_STEPPER_NAME = "manual_stepper idler_stepper"
@@ -62,8 +70,87 @@ STEPPER_NAME_MAP = {
 IS_DIGIT = re.compile("[0-9\-.]+")
 
 
+def get_move_duration(distance: float, speed: float, accel: float) -> float:
+    """Return the duration of a trapezoidal move that starts and ends at rest.
+
+    Args:
+        distance (float): The move distance.
+        speed (float): The maximum speed.
+        accel (float): The acceleration.
+
+    Returns:
+        float: The duration in seconds.
+    """
+    distance = abs(distance)
+    if not distance:
+        return 0.0
+    speed = min(speed, math.sqrt(distance * accel))
+    return distance / speed + speed / accel
+
+
+def get_homing_duration(distance: float, speed: float, accel: float) -> float:
+    """Return the time a homing move takes to trigger after the given distance.
+
+    The homing move is stopped when it triggers, so it doesn't decelerate.
+
+    Args:
+        distance (float): The distance to the trigger point.
+        speed (float): The maximum speed.
+        accel (float): The acceleration.
+
+    Returns:
+        float: The duration in seconds.
+    """
+    distance = abs(distance)
+    if not distance:
+        return 0.0
+    speed = min(speed, math.sqrt(2 * distance * accel))
+    return distance / speed + speed / (2 * accel)
+
+
+@lru_cache(maxsize=None)
+def get_tool_change_error_prompt(error_message: str, tool_id: int) -> Prompt:
+    """Return the Mainsail prompt shown when a tool change fails.
+
+    The prompts are immutable, so each one is only built and rendered once.
+
+    Args:
+        error_message (str): The error message.
+        tool_id (int): The tool id of the failed tool change.
+
+    Returns:
+        Prompt: The prompt.
+    """
+    return Prompt(
+        headline="MMU Error",
+        widgets=[
+            Text(text=error_message),
+            # Add possible commands,
+            ButtonGroup(
+                buttons=[
+                    Button(label="Unlock MMU", gcode="UNLOCK_MMU"),
+                    Button(label="Unload Tool", gcode="UT"),
+                ],
+            ),
+            ButtonGroup(
+                buttons=[
+                    Button(label="Home MMU", gcode="HOME_MMU"),
+                    Button(
+                        label=f"Retry T{tool_id}",
+                        gcode=f"PROMPT_CLOSE_AND_RUN_COMMAND COMMAND=T{tool_id}",
+                    ),
+                ],
+            ),
+            FooterButton(
+                label="Resume",
+                gcode="PROMPT_CLOSE_AND_RUN_COMMAND COMMAND=RESUME",
+            ),
+        ],
+    )
+
+
 def measure_duration(f: Callable) -> Callable:
-    """Report command duration.
+    """Report command duration and trace it as a top level span.
 
     Args:
         f (Callable): The function to decorate.
@@ -74,9 +161,6 @@ def measure_duration(f: Callable) -> Callable:
 
     @wraps(f)
     def wrapped_f(self: MMU3, gcmd: GCodeCommand, *args, **kwargs) -> None:
-        start_time = time.time()
-        result = f(self, gcmd, *args, **kwargs)
-        duration = time.time() - start_time
         # condition the function name
         f_name = {
             "cmd_tx": "T",
@@ -86,6 +170,7 @@ def measure_duration(f: Callable) -> Callable:
             "cmd_unselect_tool": "UNSELECT_TOOL",
             "cmd_pulley_calibrate": "PULLEY_CALIBRATE",
             "cmd_home_mmu": "HOME_MMU",
+            "cmd_preload_filament_to_finda": "PRE_LOAD_FILAMENT_TO_FINDA",
         }.get(f.__name__, f.__name__)
         if f_name in ["T"]:
             # replace with the proper command
@@ -93,7 +178,10 @@ def measure_duration(f: Callable) -> Callable:
         elif f_name in ["LT", "SELECT_TOOL"]:
             tool_id = gcmd.get_int("VALUE", None)
             f_name = f"{f_name} {tool_id}"
-        self.display_status_msg(f"{f_name} took {duration:0.1f} seconds")
+        with self.tracer.span(f_name) as span:
+            result = f(self, gcmd, *args, **kwargs)
+            span.ok = bool(result)
+        self.display_status_msg(f"{f_name} took {span.duration:0.1f} seconds")
         return result
 
     return wrapped_f
@@ -102,8 +190,8 @@ def measure_duration(f: Callable) -> Callable:
 def auto_pause(f: Callable) -> Callable:
     """Decorator to automatically pause the MMU3 on command failure.
 
-    If any of the decorated commands fail (return False), the MMU3 instance is
-    paused automatically.
+    If any of the decorated commands fail (return False), the debug log is
+    dumped to the Klipper log and the MMU3 instance is paused automatically.
 
     Args:
         f (Callable): The function to wrap.
@@ -116,6 +204,7 @@ def auto_pause(f: Callable) -> Callable:
     def wrapped_f(self: MMU3, gcmd: GCodeCommand, *args, **kwargs) -> None:
         result = f(self, gcmd, *args, **kwargs)
         if not result and not self.is_paused:
+            self.dump_log()
             self.pause()
         return result
 
@@ -126,7 +215,9 @@ def auto_disable_steppers(f: Callable) -> Callable:
     """Decorator to automatically disable steppers after command execution.
 
     If any of the decorated commands are executed, the MMU3 instance will
-    automatically disable the steppers after the command.
+    automatically disable the steppers after the command. The disable is
+    deferred by stepper_disable_delay seconds, and cancelled if another
+    decorated command starts in the meantime.
 
     Args:
         f (Callable): The function to wrap.
@@ -137,8 +228,12 @@ def auto_disable_steppers(f: Callable) -> Callable:
 
     @wraps(f)
     def wrapped_f(self: MMU3, gcmd: GCodeCommand, *args, **kwargs) -> None:
+        if self.cancel_disable_steppers():
+            # the steppers are still energized
+            self.number_of_avoided_enable_cycles += 1
+        self.steppers_enabled = True
         result = f(self, gcmd, *args, **kwargs)
-        self.disable_steppers()
+        self.schedule_disable_steppers()
         return result
 
     return wrapped_f
@@ -198,12 +293,196 @@ class SwitchSensorPosition(enum.Enum):
         return position
 
 
+class EndstopStateCache:
+    """Cache the state of an endstop to avoid blocking MCU queries.
+
+    If the endstop pin is registered, the state is updated by the MCU button
+    events of the pin and stamped with the estimated print time of the event.
+    The cached state is used if the steppers that can change it have finished
+    their moves, and it is not older than the optional freshness bound.
+    Otherwise the endstop is queried synchronously, which also refreshes the
+    cache.
+
+    Args:
+        mmu3 (MMU3): The MMU3 instance.
+        name (str): The name of the endstop.
+    """
+
+    # the time for a pin change to be reported by the MCU
+    REPORT_DELAY = 0.050
+
+    def __init__(self, mmu3: MMU3, name: str) -> None:
+        self.mmu3 = mmu3
+        self.name = name
+        self.endstop: None | MCU_endstop = None
+        self.event_driven = False
+        self.state: None | bool = None
+        self.print_time = 0.0
+        self.number_of_events = 0
+        self.number_of_cached_reads = 0
+        self.number_of_queries = 0
+
+    def register_pin(self, config: ConfigWrapper, pin: str) -> None:
+        """Update the state from the MCU button events of the given pin.
+
+        Args:
+            config (ConfigWrapper): The configuration wrapper.
+            pin (str): The endstop pin, shared with the endstop.
+        """
+        printer = config.get_printer()
+        printer.lookup_object("pins").allow_multi_use_pin(pin)
+        printer.load_object(config, "buttons").register_buttons(
+            [pin], self._handle_button
+        )
+        self.event_driven = True
+
+    def _handle_button(self, eventtime: float, state: int) -> None:
+        """Handle the button event of the endstop pin.
+
+        Args:
+            eventtime (float): The reactor time of the event.
+            state (int): The new state of the pin.
+        """
+        self.state = bool(state)
+        self.print_time = self.mmu3.mcu.estimated_print_time(eventtime)
+        self.number_of_events += 1
+
+    def query(
+        self, steppers: list[ManualStepper], max_age: None | float = None
+    ) -> bool:
+        """Return the endstop state, from the cache if it is fresh enough.
+
+        Args:
+            steppers (list[ManualStepper]): The steppers whose moves can
+                change the endstop state.
+            max_age (None | float): The maximum age of the cached state in
+                seconds, no limit if None.
+
+        Returns:
+            bool: True if the endstop is triggered, False otherwise.
+        """
+        if self.event_driven and self.state is not None:
+            print_time = self.mmu3.mcu.estimated_print_time(
+                self.mmu3.reactor.monotonic()
+            )
+            end_time = max(
+                [self.mmu3.toolhead.print_time]
+                + [stepper.next_cmd_time for stepper in steppers]
+            )
+            if print_time >= end_time + self.REPORT_DELAY and (
+                max_age is None or print_time - self.print_time <= max_age
+            ):
+                self.number_of_cached_reads += 1
+                return self.state
+
+        print_time = self.mmu3.toolhead.get_last_move_time()
+        self.state = bool(self.endstop.query_endstop(print_time))
+        self.print_time = print_time
+        self.number_of_queries += 1
+        return self.state
+
+
+class PrintTimeScheduler:
+    """Run callbacks when the queued moves reach the current print time.
+
+    The callbacks are registered as toolhead lookahead callbacks, so they are
+    called with the print time at which the currently queued moves end, and
+    are then run by a reactor timer at the system time that corresponds to that
+    print time. This avoids draining the motion queue with wait_moves().
+
+    Args:
+        reactor (Reactor): The reactor.
+        toolhead (ToolHead): The toolhead.
+        mcu (MCU): The MCU used to convert print times to system times.
+    """
+
+    def __init__(self, reactor: Reactor, toolhead: ToolHead, mcu: MCU) -> None:
+        self.reactor = reactor
+        self.toolhead = toolhead
+        self.mcu = mcu
+        self.pending_sensor_states = {}
+        self._sequence = 0
+
+    def schedule(self, callback: Callable[[float], None]) -> None:
+        """Call the callback when the currently queued moves are finished.
+
+        Args:
+            callback (Callable[[float], None]): The callback, called with the
+                system time corresponding to the print time of the end of the
+                queued moves.
+        """
+        self.toolhead.register_lookahead_callback(
+            partial(self._handle_print_time, callback)
+        )
+
+    def _handle_print_time(
+        self, callback: Callable[[float], None], print_time: float
+    ) -> None:
+        """Convert the print time to system time and register the callback.
+
+        Args:
+            callback (Callable[[float], None]): The callback.
+            print_time (float): The print time to run the callback at.
+        """
+        curtime = self.reactor.monotonic()
+        waketime = curtime + max(
+            0.0, print_time - self.mcu.estimated_print_time(curtime)
+        )
+        self.reactor.register_callback(lambda e: callback(waketime), waketime)
+
+    def get_sensor_state(self, runout_helper: RunoutHelper) -> bool:
+        """Return the sensor_enabled state including the scheduled changes.
+
+        Args:
+            runout_helper (RunoutHelper): The runout helper of the sensor.
+
+        Returns:
+            bool: The last scheduled state or the current state if there is
+                no pending state change.
+        """
+        if runout_helper in self.pending_sensor_states:
+            return self.pending_sensor_states[runout_helper][1]
+        return runout_helper.sensor_enabled
+
+    def set_sensor_state(
+        self,
+        runout_helper: RunoutHelper,
+        state: bool,
+        callback: None | Callable[[float], None] = None,
+    ) -> None:
+        """Set the sensor_enabled state when the queued moves are finished.
+
+        Args:
+            runout_helper (RunoutHelper): The runout helper of the sensor.
+            state (bool): The sensor_enabled state to set.
+            callback (None | Callable[[float], None]): An optional callback to
+                call with the same system time right before the state is set.
+        """
+        self._sequence += 1
+        sequence = self._sequence
+        self.pending_sensor_states[runout_helper] = (sequence, state)
+
+        def apply_state(eventtime: float) -> None:
+            if callback is not None:
+                callback(eventtime)
+            runout_helper.sensor_enabled = state
+            if self.pending_sensor_states.get(runout_helper, (None,))[0] == sequence:
+                del self.pending_sensor_states[runout_helper]
+
+        self.schedule(apply_state)
+
+
 class FilamentSwitchSensorManager:
     """This is a context manager to safely enable/disable filament switch sensors.
 
+    If a scheduler is given, the state changes are scheduled at the print time
+    of the end of the queued moves, otherwise the motion queue is drained
+    before changing the state.
+
     Args:
         filament_switch_sensor (SwitchSensor): The filament switch sensor.
         state (bool): The desired state of the sensor inside the context.
+        scheduler (None | PrintTimeScheduler): The scheduler.
     """
 
     def __init__(
@@ -213,6 +492,7 @@ class FilamentSwitchSensorManager:
         respond_debug: None | Callable = None,
         reactor: None | Reactor = None,  # noqa: UP037
         toolhead: None | ToolHead = None,
+        scheduler: None | PrintTimeScheduler = None,
     ) -> None:
         self.filament_switch_sensor = filament_switch_sensor
         self.initial_state = False
@@ -222,28 +502,41 @@ class FilamentSwitchSensorManager:
         self.respond_debug = respond_debug
         self.reactor = reactor
         self.toolhead = toolhead
+        self.scheduler = scheduler
+
+    def set_state(self, state: bool) -> None:
+        """Set the sensor state after the queued moves.
+
+        Args:
+            state (bool): The sensor_enabled state.
+        """
+        runout_helper = self.filament_switch_sensor.runout_helper
+        if self.scheduler:
+            self.scheduler.set_sensor_state(runout_helper, state)
+            return
+
+        # Synchronize: Wait for all queued moves to finish
+        # physically before we turn the sensor back on/off.
+        if self.toolhead:
+            self.toolhead.wait_moves()
+        runout_helper.sensor_enabled = state
 
     def __enter__(self) -> Self:
         """Enter to the context."""
         if self.filament_switch_sensor:
-            # Synchronize: Wait for all queued moves to finish
-            # physically before we turn the sensor back on/off.
-            if self.toolhead:
-                self.toolhead.wait_moves()
-
             # store the state
+            runout_helper = self.filament_switch_sensor.runout_helper
             self.initial_state = (
-                self.filament_switch_sensor.runout_helper.sensor_enabled
+                self.scheduler.get_sensor_state(runout_helper)
+                if self.scheduler
+                else runout_helper.sensor_enabled
             )
             self.respond_debug(
-                "{} filament runout sensor!".format(
-                    "Enabling" if self.desired_state else "Disabling"
-                )
+                "%s filament runout sensor!",
+                "Enabling" if self.desired_state else "Disabling",
             )
             # set the desired state
-            self.filament_switch_sensor.runout_helper.sensor_enabled = (
-                self.desired_state
-            )
+            self.set_state(self.desired_state)
         return self
 
     def __exit__(
@@ -259,27 +552,26 @@ class FilamentSwitchSensorManager:
         if not self.filament_switch_sensor:
             return
 
-        # Synchronize: Wait for all queued moves to finish
-        # physically before we turn the sensor back on/off.
-        if self.toolhead:
-            self.toolhead.wait_moves()
-
         # restore the initial state
         self.respond_debug(
-            "Re-{} filament runout sensor!".format(
-                "Enabling" if self.initial_state else "Disabling"
-            )
+            "Re-%s filament runout sensor!",
+            "Enabling" if self.initial_state else "Disabling",
         )
-        self.filament_switch_sensor.runout_helper.sensor_enabled = self.initial_state
+        self.set_state(self.initial_state)
         return
 
 
 class FilamentMotionSensorManager:
     """This is a context manager to safely enable/disable filament motion sensors.
 
+    If a scheduler is given, the state changes and the encoder event refreshes
+    are scheduled at the print time of the end of the queued moves, otherwise
+    the motion queue is drained before changing the state.
+
     Args:
         filament_motion_sensor (EncoderSensor): The filament motion sensor.
         state (bool): The desired state of the sensor inside the context.
+        scheduler (None | PrintTimeScheduler): The scheduler.
     """
 
     def __init__(
@@ -289,6 +581,7 @@ class FilamentMotionSensorManager:
         respond_debug: None | Callable = None,
         reactor: None | Reactor = None,  # noqa: UP037
         toolhead: None | ToolHead = None,
+        scheduler: None | PrintTimeScheduler = None,
     ) -> None:
         self.filament_motion_sensor = filament_motion_sensor
         self.initial_state = None
@@ -298,32 +591,55 @@ class FilamentMotionSensorManager:
         self.respond_debug = respond_debug
         self.reactor = reactor
         self.toolhead = toolhead
+        self.scheduler = scheduler
 
-    def __enter__(self) -> Self:
-        """Enter to the context."""
-        if not self.filament_motion_sensor:
-            return self
+    def refresh_encoder_event(self, eventtime: float) -> None:
+        """Update the event time, so that the runout doesn't trigger.
+
+        Args:
+            eventtime (float): The event time.
+        """
+        self.filament_motion_sensor.encoder_event(eventtime, None)
+
+    def set_state(self, state: bool) -> None:
+        """Set the sensor state after the queued moves.
+
+        Args:
+            state (bool): The sensor_enabled state.
+        """
+        runout_helper = self.filament_motion_sensor.runout_helper
+        if self.scheduler:
+            self.scheduler.set_sensor_state(
+                runout_helper, state, self.refresh_encoder_event
+            )
+            return
 
         # Synchronize: Wait for all queued moves to finish
         # physically before we turn the sensor back on/off.
         if self.toolhead:
             self.toolhead.wait_moves()
+        event_time = self.reactor.monotonic() or self.toolhead.get_last_move_time()
+        self.refresh_encoder_event(event_time)
+        runout_helper.sensor_enabled = state
+
+    def __enter__(self) -> Self:
+        """Enter to the context."""
+        if not self.filament_motion_sensor:
+            return self
 
         # store the state
-        self.initial_state = self.filament_motion_sensor.runout_helper.sensor_enabled
+        runout_helper = self.filament_motion_sensor.runout_helper
+        self.initial_state = (
+            self.scheduler.get_sensor_state(runout_helper)
+            if self.scheduler
+            else runout_helper.sensor_enabled
+        )
         self.respond_debug(
-            "{} filament motion sensor!".format(
-                "Enabling" if self.desired_state else "Disabling"
-            )
+            "%s filament motion sensor!",
+            "Enabling" if self.desired_state else "Disabling",
         )
         # set the desired state
-        self.filament_motion_sensor.runout_helper.sensor_enabled = self.desired_state
-
-        # also update the event time
-        # so that the runout doesn't trigger as soon as it is enabled again
-        event_time = self.reactor.monotonic() or self.toolhead.get_last_move_time()
-        self.filament_motion_sensor.encoder_event(event_time, None)
-
+        self.set_state(self.desired_state)
         return self
 
     def __exit__(
@@ -339,21 +655,12 @@ class FilamentMotionSensorManager:
         if not self.filament_motion_sensor:
             return
 
-        # Synchronize: Wait for all queued moves to finish
-        # physically before we turn the sensor back on/off.
-        if self.toolhead:
-            self.toolhead.wait_moves()
-
         # restore the initial state
         self.respond_debug(
-            "Re-{} filament motion sensor!".format(
-                "Enabling" if self.initial_state else "Disabling"
-            )
+            "Re-%s filament motion sensor!",
+            "Enabling" if self.initial_state else "Disabling",
         )
-        # also update the event time so that the runout doesn't trigger
-        event_time = self.reactor.monotonic() or self.toolhead.get_last_move_time()
-        self.filament_motion_sensor.encoder_event(event_time, None)
-        self.filament_motion_sensor.runout_helper.sensor_enabled = self.initial_state
+        self.set_state(self.initial_state)
         return
 
 
@@ -390,73 +697,1020 @@ class ExtruderSynchronizer:
         return
 
 
-class MMU3:
-    """MMU3 class to manage the MMU3 multi-material unit.
+class DebugLog:
+    """Keep the recent log records in a fixed size ring buffer.
+
+    The records are stored unformatted, the messages are only formatted when
+    the buffer is dumped, so adding a record costs a tuple and a deque append.
 
     Args:
-        config (ConfigWrapper): The configuration wrapper.
+        reactor (Reactor): The reactor, used to time stamp the records.
+        size (int): The number of records to keep.
     """
 
-    def __init__(self, config: ConfigWrapper) -> None:
-        self._last_command_failed = None
-        self._last_command_failed_args = None
-        self._last_command_failed_kwargs = None
-
-        self.printer: Printer = config.get_printer()
-        self.gcode: GCodeDispatch = self.printer.lookup_object("gcode")
-        self.gcode_move: None | GCodeMove = None
-        self.query_endstops: QueryEndstops = self.printer.load_object(
-            config, "query_endstops"
+    def __init__(self, reactor: Reactor, size: int) -> None:
+        self.reactor = reactor
+        self.records: collections.deque[tuple[float, int, str, tuple]] = (
+            collections.deque(maxlen=size)
         )
-        self.reactor: Reactor = self.printer.get_reactor()
 
-        self.mcu: None | MCU_endstop = None
-        self.toolhead: None | ToolHead = None
-        self.motion_queuing : None | PrinterMotionQueuing = None
-        self.extruder: None | PrinterExtruder = None
-        self.extruder_heater: None | Heater = None
-        self.heaters: None | PrinterHeaters = None
-        self.idler_stepper: None | ManualStepper = None
-        self._idler_stepper_endstop = None
-        self.pulley_stepper: None | ManualStepper = None
-        self.pulley_stepper_endstop: None | MCU_endstop = None
-        self.selector_stepper: None | ManualStepper = None
-        self.selector_stepper_endstop: None | MCU_endstop = None
-        self.display_status: None | DisplayStatus = None
-        self.filament_switch_sensor: None | SwitchSensor = None
-        self.filament_switch_sensor_position: None | SwitchSensorPosition = None
-        self.filament_motion_sensor: None | EncoderSensor = None
+    def add(self, level: int, msg: str, args: tuple) -> None:
+        """Add a record.
 
-        # state variables
-        self.debug = False
+        Args:
+            level (int): The logging level, i.e. logging.DEBUG.
+            msg (str): The %-style message.
+            args (tuple): The message arguments.
+        """
+        self.records.append((self.reactor.monotonic(), level, msg, args))
 
-        self.is_paused = False
-        self.is_homed = False
-        self.extruder_temp = None
-        self.current_tool = None
-        self.current_filament = None
+    def iter_lines(self) -> Iterator[str]:
+        """Format the records.
 
-        # statistics variables
-        self.number_of_material_changes = 0
-        self.number_of_successful_material_changes = 0
-        self.number_of_fails = 0
+        Yields:
+            str: The formatted records, oldest first.
+        """
+        for eventtime, level, msg, args in self.records:
+            yield (
+                f"{eventtime:0.3f} {logging.getLevelName(level)} "
+                f"{msg % args if args else msg}"
+            )
 
-        # load config values
-        # are we in debug mode
-        self.debug = config.getboolean("debug", False)
-        self.number_of_tools = config.getint("number_of_tools", 5)
-        self.tool_mapping = config.getintlist(
-            "tool_mapping",
-            list(range(self.number_of_tools)),
+
+class MotionCoordinator:
+    """Schedule manual stepper moves on the same print time window.
+
+    Each ``ManualStepper.do_move()`` call with ``sync=True`` dwells the
+    toolhead until that move finishes, so chaining idler and selector moves
+    costs the sum of their durations. The coordinator starts all the given
+    moves at the same print time and only blocks until the latest one ends.
+    The idler and selector moves of the tool selection and the idler homing
+    and parking all go through it.
+
+    Args:
+        mmu3 (MMU3): The MMU3 instance.
+    """
+
+    def __init__(self, mmu3: MMU3) -> None:
+        self.mmu3 = mmu3
+        self.number_of_coordinated_moves = 0
+        self.total_time_saved = 0.0
+
+    def move(
+        self,
+        moves: list[tuple[ManualStepper, float, float, float]],
+        sync: bool = True,
+    ) -> float:
+        """Move the given steppers concurrently.
+
+        Args:
+            moves (list[tuple[ManualStepper, float, float, float]]): A list of
+                (manual_stepper, position, speed, accel) tuples.
+            sync (bool): If True, the toolhead waits until the latest of the
+                moves is finished. Defaults to True.
+
+        Returns:
+            float: The time saved in seconds compared to running the moves one
+                after another.
+        """
+        if not moves:
+            return 0.0
+
+        # bring the toolhead after any pending move of the involved steppers,
+        # so that all the moves start at the same print time.
+        for manual_stepper, *_ in moves:
+            manual_stepper.sync_print_time()
+        start_time = self.mmu3.toolhead.get_last_move_time()
+
+        durations = []
+        for manual_stepper, position, speed, accel in moves:
+            manual_stepper.do_move(position, speed, accel, sync=False)
+            durations.append(max(0.0, manual_stepper.next_cmd_time - start_time))
+
+        latest_stepper = max(moves, key=lambda m: m[0].next_cmd_time)[0]
+        if sync:
+            latest_stepper.sync_print_time()
+
+        time_saved = sum(durations) - max(durations)
+        self.number_of_coordinated_moves += 1
+        self.total_time_saved += time_saved
+        return time_saved
+
+
+class TraceSpan:
+    """A timed span of a trace, with nested child spans.
+
+    Args:
+        name (str): The name of the span.
+        start (float): The reactor monotonic start time.
+        print_start (float): The estimated print time at the start.
+    """
+
+    def __init__(self, name: str, start: float, print_start: float) -> None:
+        self.name = name
+        self.start = start
+        self.print_start = print_start
+        self.end = None
+        self.print_end = None
+        self.ok = True
+        self.children: list[TraceSpan] = []
+
+    def __repr__(self) -> str:
+        """Return the string representation.
+
+        Returns:
+            str: The string representation.
+        """
+        return f"<TraceSpan {self.name}: {self.duration:0.3f}s>"
+
+    @property
+    def duration(self) -> float:
+        """Return the duration of the span in host time.
+
+        Returns:
+            float: The duration in seconds, 0 if the span is still open.
+        """
+        return 0.0 if self.end is None else self.end - self.start
+
+    @property
+    def print_duration(self) -> float:
+        """Return the duration of the span in print time.
+
+        Returns:
+            float: The duration in seconds, 0 if the span is still open.
+        """
+        return 0.0 if self.print_end is None else self.print_end - self.print_start
+
+    def format(self, origin: None | float = None, depth: int = 0) -> list[str]:
+        """Format the span and its children as indented lines.
+
+        Args:
+            origin (None | float): The start time of the root span, the span
+                offsets are reported relative to it. Defaults to the start of
+                this span.
+            depth (int): The indentation depth.
+
+        Returns:
+            list[str]: The formatted lines.
+        """
+        origin = self.start if origin is None else origin
+        lines = [
+            f"{'  ' * depth}{self.name}: +{self.start - origin:0.3f}s "
+            f"{self.duration:0.3f}s (print {self.print_duration:0.3f}s)"
+            + ("" if self.ok else " FAILED")
+        ]
+        for child in self.children:
+            lines += child.format(origin, depth + 1)
+        return lines
+
+
+class ToolChangeTracer:
+    """Record nested spans of the MMU3 commands and their phases.
+
+    The spans are timed with the reactor monotonic clock and carry the
+    estimated MCU print time. Finished top level spans are kept in a bounded
+    buffer.
+
+    Args:
+        mmu3 (MMU3): The MMU3 instance.
+        max_traces (int): The number of traces to keep.
+    """
+
+    def __init__(self, mmu3: MMU3, max_traces: int) -> None:
+        self.mmu3 = mmu3
+        self.traces: collections.deque[TraceSpan] = collections.deque(
+            maxlen=max_traces
         )
+        self.stack: list[TraceSpan] = []
 
-        # timeouts
-        self.timeout_pause = config.getint("timeout_pause", 36000)
-        self.disable_heater = config.getint("disable_heater", 600)
-        # bowden load
-        self.bowden_load_length1 = config.getint("bowden_load_length1", 450)
-        self.bowden_load_length2 = config.getint("bowden_load_length2", 20)
-        self.bowden_load_length3 = config.getint("bowden_load_length3", 20)
+    def get_times(self) -> tuple[float, float]:
+        """Return the current reactor monotonic and estimated print times.
+
+        Returns:
+            tuple[float, float]: The monotonic and print times.
+        """
+        eventtime = self.mmu3.reactor.monotonic()
+        return eventtime, self.mmu3.mcu.estimated_print_time(eventtime)
+
+    @contextlib.contextmanager
+    def span(self, name: str) -> Iterator[TraceSpan]:
+        """Record a span around the enclosed code.
+
+        Args:
+            name (str): The name of the span.
+
+        Yields:
+            TraceSpan: The span, set its ok attribute to flag a failure.
+        """
+        span = TraceSpan(name, *self.get_times())
+        if self.stack:
+            self.stack[-1].children.append(span)
+        self.stack.append(span)
+        try:
+            yield span
+        finally:
+            span.end, span.print_end = self.get_times()
+            self.stack.pop()
+            if not self.stack:
+                self.traces.append(span)
+
+
+class ToolChangeResource(enum.Enum):
+    Extruder = "extruder"
+    Pulley = "pulley"
+    Idler = "idler"
+    Selector = "selector"
+    Heater = "heater"
+
+    def __repr__(self) -> str:
+        """Return the enum name for str().
+
+        Returns:
+            str: The name as the string representation.
+        """
+        return self.name
+
+    __str__ = __repr__
+
+
+class ToolChangePhase:
+    """A single phase of a tool change.
+
+    Args:
+        name (str): The name of the phase.
+        resources (set[ToolChangeResource]): The resources used by the phase.
+        func (Callable): The function that runs the phase, returns True on
+            success and False on failure.
+        depends_on (None | list[str]): The names of the phases that need to be
+            run before this phase. Defaults to None.
+        blocking (bool): True if the phase waits for its moves to physically
+            finish before returning, False if it only queues its moves.
+            Defaults to True.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        resources: set[ToolChangeResource],
+        func: Callable[[], bool],
+        depends_on: None | list[str] = None,
+        blocking: bool = True,
+    ) -> None:
+        self.name = name
+        self.resources = frozenset(resources)
+        self.func = func
+        self.depends_on = list(depends_on) if depends_on else []
+        self.blocking = blocking
+
+    def __repr__(self) -> str:
+        """Return the string representation.
+
+        Returns:
+            str: The string representation.
+        """
+        return f"<ToolChangePhase {self.name}>"
+
+
+class ToolChangeExecutor:
+    """Run tool change phases, overlapping the ones that don't conflict.
+
+    A non-blocking phase only queues its moves, so the resources it uses are
+    kept locked until the motion queue is drained. The next phase is picked
+    among the phases whose dependencies are met, preferring the ones that
+    don't use any locked resource, and the motion queue is only drained when
+    a phase needs a locked resource.
+
+    Args:
+        mmu3 (MMU3): The MMU3 instance.
+    """
+
+    def __init__(self, mmu3: MMU3) -> None:
+        self.mmu3 = mmu3
+        self.locked_resources: dict[ToolChangeResource, str] = {}
+        self.number_of_drains = 0
+        self.number_of_overlapped_phases = 0
+
+    def drain(self) -> None:
+        """Wait for all the queued moves and release all the resources."""
+        if self.locked_resources:
+            with self.mmu3.tracer.span("drain"):
+                self.mmu3.toolhead.wait_moves()
+            self.number_of_drains += 1
+        self.locked_resources.clear()
+
+    def run(self, phases: list[ToolChangePhase]) -> bool:
+        """Run the given phases.
+
+        Args:
+            phases (list[ToolChangePhase]): The phases to run.
+
+        Returns:
+            bool: True if all the phases completed successfully, False
+                otherwise.
+        """
+        pending = list(phases)
+        names = {phase.name for phase in pending}
+        done = set()
+        while pending:
+            ready = [
+                phase
+                for phase in pending
+                if all(d in done or d not in names for d in phase.depends_on)
+            ]
+            if not ready:
+                self.mmu3.respond_info(
+                    f"Unresolvable tool change phase dependencies: {pending}"
+                )
+                return False
+
+            phase = next(
+                (p for p in ready if not p.resources & self.locked_resources.keys()),
+                ready[0],
+            )
+            conflicts = phase.resources & self.locked_resources.keys()
+            if conflicts:
+                self.mmu3.respond_debug(
+                    "Phase %s waits for %s",
+                    phase.name,
+                    sorted({self.locked_resources[r] for r in conflicts}),
+                )
+                self.drain()
+            elif self.locked_resources:
+                self.number_of_overlapped_phases += 1
+
+            pending.remove(phase)
+            self.mmu3.respond_debug("Running phase %s", phase.name)
+            with self.mmu3.tracer.span(phase.name) as span:
+                span.ok = phase.func()
+            if not span.ok:
+                self.mmu3.respond_debug("Phase %s failed!", phase.name)
+                self.drain()
+                return False
+            done.add(phase.name)
+
+            if phase.blocking:
+                self.locked_resources.clear()
+            else:
+                for resource in phase.resources:
+                    self.locked_resources[resource] = phase.name
+        return True
+
+
+class StatusAttribute:
+    """An attribute reported by get_status.
+
+    Setting the attribute sets the status_dirty flag of the instance, so that
+    the cached status is only rebuilt after a reported value is set.
+    """
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.private_name = f"_{name}"
+
+    def __get__(self, instance: object, owner: None | type = None) -> object:
+        if instance is None:
+            return self
+        return getattr(instance, self.private_name)
+
+    def __set__(self, instance: object, value: object) -> None:
+        setattr(instance, self.private_name, value)
+        instance.status_dirty = True
+
+
+class ToolChangeLookahead:
+    """Find the next tool change in the file printed by virtual_sdcard.
+
+    The file is scanned ahead of the current file position for the next
+    ``T<n>`` line. The scan result is cached until the print passes the found
+    tool change, so most updates only recalculate the distance and the
+    estimated time to the next tool change.
+
+    Args:
+        mmu3 (MMU3): The MMU3 instance.
+        window (int): The number of bytes to scan ahead of the current file
+            position.
+    """
+
+    TOOL_CHANGE_REGEX = re.compile(rb"^[ \t]*T(\d+)[ \t]*(?:;[^\n]*)?\r?$", re.M)
+
+    next_tool = StatusAttribute()
+    next_tool_eta = StatusAttribute()
+
+    def __init__(self, mmu3: MMU3, window: int) -> None:
+        self.mmu3 = mmu3
+        self.status_dirty = True
+        self.window = window
+        self.staging_callbacks: list[Callable[[int, None | float], None]] = []
+        self.file_path = None
+        self.next_tool = None
+        self.next_tool_position = None
+        self.next_tool_distance = None
+        self.next_tool_eta = None
+        self.byte_rate = 0.0
+        self._scan_start = None
+        self._last_file_position = None
+        self._last_eventtime = None
+
+    def reset(self) -> None:
+        """Forget everything about the previously printed file."""
+        self.file_path = None
+        self.next_tool = None
+        self.next_tool_position = None
+        self.next_tool_distance = None
+        self.next_tool_eta = None
+        self.byte_rate = 0.0
+        self._scan_start = None
+        self._last_file_position = None
+        self._last_eventtime = None
+
+    def scan(self, file_position: int) -> None:
+        """Scan the file for the next tool change starting from file_position.
+
+        Args:
+            file_position (int): The byte offset to start scanning from.
+        """
+        self._scan_start = file_position
+        self.next_tool = None
+        self.next_tool_position = None
+        try:
+            with open(self.file_path, "rb") as f:
+                f.seek(file_position)
+                data = f.read(self.window)
+        except OSError:
+            return
+        # only look at complete lines
+        if len(data) == self.window:
+            data = data[: data.rfind(b"\n") + 1]
+        match = self.TOOL_CHANGE_REGEX.search(data)
+        if match:
+            self.next_tool = int(match.group(1))
+            self.next_tool_position = file_position + match.start()
+
+    def update(
+        self, file_path: None | str, file_position: int, eventtime: float
+    ) -> None:
+        """Update the next tool change for the given file position.
+
+        Args:
+            file_path (None | str): The path of the printed file.
+            file_position (int): The current file position.
+            eventtime (float): The reactor time of the update.
+        """
+        if file_path != self.file_path:
+            self.reset()
+            self.file_path = file_path
+        if file_path is None:
+            return
+
+        # estimate the rate the file is consumed with
+        if self._last_eventtime is not None and eventtime > self._last_eventtime:
+            rate = (file_position - self._last_file_position) / (
+                eventtime - self._last_eventtime
+            )
+            if rate >= 0:
+                self.byte_rate = (
+                    rate if not self.byte_rate else 0.7 * self.byte_rate + 0.3 * rate
+                )
+        self._last_file_position = file_position
+        self._last_eventtime = eventtime
+
+        if (
+            self._scan_start is None
+            or (
+                self.next_tool_position is not None
+                and file_position > self.next_tool_position
+            )
+            or (
+                self.next_tool_position is None
+                and file_position - self._scan_start >= self.window // 2
+            )
+        ):
+            self.scan(file_position)
+
+        if self.next_tool is None:
+            self.next_tool_distance = None
+            self.next_tool_eta = None
+            return
+
+        self.next_tool_distance = self.next_tool_position - file_position
+        self.next_tool_eta = (
+            self.next_tool_distance / self.byte_rate if self.byte_rate else None
+        )
+        for callback in self.staging_callbacks:
+            callback(self.next_tool, self.next_tool_eta)
+
+
+class BowdenCalibration:
+    """Learn per slot filament path lengths from sensor trigger positions.
+
+    The pulley positions at which FINDA and the filament switch sensor change
+    state are stored per slot in bounded sample windows, and the median and
+    the spread (scaled median absolute deviation) of the samples are used as
+    robust estimates of the lengths.
+
+    Args:
+        number_of_slots (int): The number of slots.
+        max_samples (int): The number of samples to keep per slot and kind.
+        min_samples (int): The minimum number of samples required before the
+            learned values are used.
+    """
+
+    KINDS = ("finda_load", "sensor_load", "finda_unload")
+
+    def __init__(
+        self, number_of_slots: int, max_samples: int = 15, min_samples: int = 3
+    ) -> None:
+        self.number_of_slots = number_of_slots
+        self.max_samples = max_samples
+        self.min_samples = min_samples
+        self.frozen = False
+        self.samples: dict[str, list[collections.deque]] = {}
+        self.reset()
+
+    def reset(self, slot: None | int = None) -> None:
+        """Forget the learned samples.
+
+        Args:
+            slot (None | int): The slot to reset, all slots if None.
+        """
+        for kind in self.KINDS:
+            if slot is None or kind not in self.samples:
+                self.samples[kind] = [
+                    collections.deque(maxlen=self.max_samples)
+                    for _ in range(self.number_of_slots)
+                ]
+            else:
+                self.samples[kind][slot].clear()
+
+    def add_sample(self, kind: str, slot: None | int, length: float) -> None:
+        """Record a new sample.
+
+        Args:
+            kind (str): One of KINDS.
+            slot (None | int): The slot the sample belongs to. Ignored if None.
+            length (float): The measured length in mm.
+        """
+        if self.frozen or slot is None or not 0 <= slot < self.number_of_slots:
+            return
+        self.samples[kind][slot].append(abs(length))
+
+    def get_stats(self, kind: str, slot: None | int) -> None | tuple[float, float]:
+        """Return the median and the spread of the samples.
+
+        Args:
+            kind (str): One of KINDS.
+            slot (None | int): The slot.
+
+        Returns:
+            None | tuple[float, float]: The median and the spread, None if there
+                are not enough samples.
+        """
+        if slot is None or not 0 <= slot < self.number_of_slots:
+            return None
+        samples = self.samples[kind][slot]
+        if len(samples) < self.min_samples:
+            return None
+        median = statistics.median(samples)
+        spread = 1.4826 * statistics.median(abs(s - median) for s in samples)
+        return median, spread
+
+    def to_dict(self) -> dict:
+        """Return the samples as a JSON serializable dict.
+
+        Returns:
+            dict: The frozen flag and the samples per kind and slot.
+        """
+        return {
+            "frozen": self.frozen,
+            "samples": {
+                kind: [list(samples) for samples in self.samples[kind]]
+                for kind in self.KINDS
+            },
+        }
+
+    def from_dict(self, data: dict) -> None:
+        """Restore the samples from a dict created with to_dict.
+
+        Args:
+            data (dict): The frozen flag and the samples per kind and slot.
+        """
+        self.reset()
+        self.frozen = bool(data.get("frozen", False))
+        for kind, slots in data.get("samples", {}).items():
+            if kind not in self.KINDS:
+                continue
+            for slot, samples in enumerate(slots[: self.number_of_slots]):
+                self.samples[kind][slot].extend(samples)
+
+
+class ParkedTipModel:
+    """Track where the filament tip of every slot is.
+
+    The positions are in mm of pulley travel from the FINDA trigger point,
+    negative values are behind FINDA. A position is set when FINDA changes
+    state, moved with the pulley moves of its slot, and forgotten when the
+    filament leaves the MMU or can be moved by hand.
+
+    Args:
+        number_of_slots (int): The number of slots.
+    """
+
+    def __init__(self, number_of_slots: int) -> None:
+        self.number_of_slots = number_of_slots
+        self.positions: list[None | float] = [None] * number_of_slots
+
+    def is_valid_slot(self, slot: None | int) -> bool:
+        """Check if the slot is tracked.
+
+        Args:
+            slot (None | int): The slot.
+
+        Returns:
+            bool: True if the slot is tracked.
+        """
+        return slot is not None and 0 <= slot < self.number_of_slots
+
+    def get(self, slot: None | int) -> None | float:
+        """Return the tip position of the slot.
+
+        Args:
+            slot (None | int): The slot.
+
+        Returns:
+            None | float: The position, None if it is not known.
+        """
+        if not self.is_valid_slot(slot):
+            return None
+        return self.positions[slot]
+
+    def set(self, slot: None | int, position: None | float) -> None:
+        """Set the tip position of the slot.
+
+        Args:
+            slot (None | int): The slot. Ignored if None.
+            position (None | float): The position, None if it is not known.
+        """
+        if self.is_valid_slot(slot):
+            self.positions[slot] = position
+
+    def move(self, slot: None | int, distance: float) -> None:
+        """Move the known tip position of the slot.
+
+        Args:
+            slot (None | int): The slot. Ignored if None.
+            distance (float): The pulley travel.
+        """
+        if self.get(slot) is not None:
+            self.positions[slot] += distance
+
+    def forget(self, slot: None | int = None) -> None:
+        """Forget the tip position.
+
+        Args:
+            slot (None | int): The slot, all slots if None.
+        """
+        if slot is None:
+            self.positions = [None] * self.number_of_slots
+        else:
+            self.set(slot, None)
+
+    def get_distance_to_finda(self, slot: None | int) -> None | float:
+        """Return the distance the tip of the slot needs to travel to FINDA.
+
+        Args:
+            slot (None | int): The slot.
+
+        Returns:
+            None | float: The distance, None if the position is not known or
+                the tip is not behind FINDA.
+        """
+        position = self.get(slot)
+        if position is None or position >= 0:
+            return None
+        return -position
+
+    def to_list(self) -> list[None | float]:
+        """Return the positions as a JSON serializable list.
+
+        Returns:
+            list[None | float]: The positions per slot.
+        """
+        return list(self.positions)
+
+    def from_list(self, positions: list[None | float]) -> None:
+        """Restore the positions from a list created with to_list.
+
+        Args:
+            positions (list[None | float]): The positions per slot.
+        """
+        self.forget()
+        for slot, position in enumerate(positions[: self.number_of_slots]):
+            if isinstance(position, (int, float)):
+                self.positions[slot] = float(position)
+
+
+class HomingConfidence:
+    """Track how much the idler and selector positions can be trusted.
+
+    The confidence of an axis drops with the travel since its last home and
+    with stall events. An axis is lost if it stalled or travelled more than
+    its limit since the last home, and needs a verification if its position
+    has been restored from the saved state after a restart.
+
+    Args:
+        max_travel (dict[str, float]): The maximum travel per axis before the
+            axis is considered lost.
+    """
+
+    AXES = ("idler", "selector")
+
+    def __init__(self, max_travel: dict[str, float]) -> None:
+        self.max_travel = max_travel
+        self.travel = dict.fromkeys(self.AXES, 0.0)
+        self.stalls = dict.fromkeys(self.AXES, 0)
+        self.unverified = dict.fromkeys(self.AXES, False)
+
+    def reset(self, axis: str) -> None:
+        """Restore the full confidence of the axis after homing or verifying.
+
+        Args:
+            axis (str): One of AXES.
+        """
+        self.travel[axis] = 0.0
+        self.stalls[axis] = 0
+        self.unverified[axis] = False
+
+    def add_travel(self, axis: str, distance: float) -> None:
+        """Record a move of the axis.
+
+        Args:
+            axis (str): One of AXES.
+            distance (float): The travelled distance.
+        """
+        self.travel[axis] += abs(distance)
+
+    def add_stall(self, axis: str) -> None:
+        """Record a stall of the axis.
+
+        Args:
+            axis (str): One of AXES.
+        """
+        self.stalls[axis] += 1
+
+    def set_unverified(self) -> None:
+        """Record that the positions of all the axes have been restored."""
+        for axis in self.AXES:
+            self.unverified[axis] = True
+
+    def is_lost(self, axis: str) -> bool:
+        """Return if the axis needs a full home.
+
+        Args:
+            axis (str): One of AXES.
+
+        Returns:
+            bool: True if the axis position can not be trusted.
+        """
+        return bool(self.stalls[axis]) or self.travel[axis] > self.max_travel[axis]
+
+    def needs_verification(self, axis: str) -> bool:
+        """Return if the axis position should be verified before it is used.
+
+        Args:
+            axis (str): One of AXES.
+
+        Returns:
+            bool: True if the position has been restored since the last home.
+        """
+        return self.unverified[axis]
+
+
+class RammingProfile:
+    """A ramming profile made of relative extruder moves, dwells and commands.
+
+    Each step is one of:
+
+    - ``("move", distance, speed)``: extruder only move of distance mm with
+      speed mm/s, speed is None if the move uses the previous feedrate. The
+      distance is relative, absolute extrusion is converted when parsed.
+    - ``("dwell", duration)``: dwell for duration seconds.
+    - ``("gcode", line)``: any other G-code command to run as is.
+
+    Args:
+        name (str): The name of the profile.
+        steps (list[tuple]): The steps of the profile.
+    """
+
+    # commands that only change the G-code state and are implied by the
+    # native ramming, which moves the extruder with the given speeds
+    IGNORED_COMMANDS = ("M220",)
+
+    def __init__(self, name: str, steps: list[tuple]) -> None:
+        self.name = name
+        self.steps = steps
+
+    def __repr__(self) -> str:
+        """Return the string representation.
+
+        Returns:
+            str: The string representation.
+        """
+        return f"<RammingProfile {self.name}: {len(self.steps)} steps>"
+
+    @classmethod
+    def from_gcode(cls, name: str, gcode: str) -> RammingProfile:
+        """Create a ramming profile from extrusion G-code.
+
+        The positioning modes are tracked like Klipper does, the extruder
+        moves are absolute after G90 and M82, and relative after G91 or M83.
+        The profile starts with absolute coordinates and relative extrusion,
+        the state of a print with M83. The extruder position is tracked from
+        G92, and the absolute extruder moves are converted to relative
+        distances.
+
+        Args:
+            name (str): The name of the profile.
+            gcode (str): The G-code, i.e. the body of the RAMMING_SLICER macro.
+
+        Raises:
+            ValueError: If the G-code contains templates or non-extruder moves.
+
+        Returns:
+            RammingProfile: The ramming profile.
+        """
+        if "{" in gcode:
+            raise ValueError(f"Ramming profile {name} can not contain templates")
+        steps = []
+        speed = None
+        absolute_coord = True
+        absolute_extrude = False
+        position = 0.0
+        for raw_line in gcode.splitlines():
+            line = raw_line.split(";", 1)[0].strip()
+            if not line:
+                continue
+            words = line.split()
+            command = words[0].upper()
+            if command in ("G0", "G1"):
+                params = {w[0].upper(): w[1:] for w in words[1:]}
+                if set(params) - {"E", "F"}:
+                    raise ValueError(
+                        f"Ramming profile {name} can only move the extruder: {line}"
+                    )
+                if "F" in params:
+                    speed = float(params["F"]) / 60.0
+                if "E" in params:
+                    distance = float(params["E"])
+                    if absolute_coord and absolute_extrude:
+                        distance -= position
+                    position += distance
+                    steps.append(("move", distance, speed))
+            elif command in ("G90", "G91"):
+                absolute_coord = command == "G90"
+            elif command in ("M82", "M83"):
+                absolute_extrude = command == "M82"
+            elif command == "G92":
+                params = {w[0].upper(): w[1:] for w in words[1:]}
+                if not params:
+                    position = 0.0
+                elif "E" in params:
+                    position = float(params["E"])
+            elif command == "G4":
+                params = {w[0].upper(): w[1:] for w in words[1:]}
+                duration = float(params.get("S", 0)) + float(params.get("P", 0)) / 1000
+                if duration > 0:
+                    steps.append(("dwell", duration))
+            elif command in cls.IGNORED_COMMANDS:
+                continue
+            else:
+                steps.append(("gcode", line))
+        return cls(name, steps)
+
+
+class MMU3:
+    """MMU3 class to manage the MMU3 multi-material unit.
+
+    Args:
+        config (ConfigWrapper): The configuration wrapper.
+    """
+
+    # the attributes reported by get_status
+    STATUS_ATTRIBUTES = (
+        "current_tool",
+        "current_filament",
+        "staged_tool",
+        "is_paused",
+        "is_homed",
+        "steppers_enabled",
+        "number_of_tools",
+        "number_of_material_changes",
+        "number_of_successful_material_changes",
+        "number_of_fails",
+        "number_of_stepper_disables",
+        "number_of_avoided_enable_cycles",
+        "number_of_homes_skipped",
+        "number_of_verification_failures",
+    )
+    current_tool = StatusAttribute()
+    current_filament = StatusAttribute()
+    staged_tool = StatusAttribute()
+    is_paused = StatusAttribute()
+    is_homed = StatusAttribute()
+    steppers_enabled = StatusAttribute()
+    number_of_tools = StatusAttribute()
+    number_of_material_changes = StatusAttribute()
+    number_of_successful_material_changes = StatusAttribute()
+    number_of_fails = StatusAttribute()
+    number_of_stepper_disables = StatusAttribute()
+    number_of_avoided_enable_cycles = StatusAttribute()
+    number_of_homes_skipped = StatusAttribute()
+    number_of_verification_failures = StatusAttribute()
+
+    def __init__(self, config: ConfigWrapper) -> None:
+        self._last_command_failed = None
+        self._last_command_failed_args = None
+        self._last_command_failed_kwargs = None
+
+        self.printer: Printer = config.get_printer()
+        self.gcode: GCodeDispatch = self.printer.lookup_object("gcode")
+        self.gcode_move: None | GCodeMove = None
+        self.query_endstops: QueryEndstops = self.printer.load_object(
+            config, "query_endstops"
+        )
+        self.reactor: Reactor = self.printer.get_reactor()
+
+        self.mcu: None | MCU = None
+        self.toolhead: None | ToolHead = None
+        self.motion_queuing : None | PrinterMotionQueuing = None
+        self.extruder: None | PrinterExtruder = None
+        self.extruder_heater: None | Heater = None
+        self.heaters: None | PrinterHeaters = None
+        self.idler_stepper: None | ManualStepper = None
+        self._idler_stepper_endstop = None
+        self.pulley_stepper: None | ManualStepper = None
+        self.pulley_stepper_endstop: None | MCU_endstop = None
+        self.selector_stepper: None | ManualStepper = None
+        self.selector_stepper_endstop: None | MCU_endstop = None
+        self.display_status: None | DisplayStatus = None
+        self.filament_switch_sensor: None | SwitchSensor = None
+        self.filament_switch_sensor_endstop: None | MCU_endstop = None
+        self.filament_switch_sensor_position: None | SwitchSensorPosition = None
+        self.filament_motion_sensor: None | EncoderSensor = None
+        self.virtual_sdcard: None | VirtualSD = None
+        self.sensor_scheduler: None | PrintTimeScheduler = None
+        self.motion_coordinator = MotionCoordinator(self)
+        self.tool_change_executor = ToolChangeExecutor(self)
+        self.tracer = ToolChangeTracer(self, config.getint("trace_buffer_size", 20))
+
+        # state variables
+        self.debug = False
+
+        self.is_paused = False
+        self.is_homed = False
+        self.extruder_temp = None
+        self.current_tool = None
+        self.current_filament = None
+        self.staged_tool = None
+        self.bowden_load_triggered = False
+        self.steppers_enabled = False
+        self.disable_steppers_pending = False
+
+        # statistics variables
+        self.number_of_material_changes = 0
+        self.number_of_successful_material_changes = 0
+        self.number_of_fails = 0
+        self.number_of_stepper_disables = 0
+        self.number_of_avoided_enable_cycles = 0
+        self.number_of_homes_skipped = 0
+        self.number_of_verification_failures = 0
+        self.status_dirty = True
+        self.status = {}
+
+        # load config values
+        # are we in debug mode
+        self.debug = config.getboolean("debug", False)
+        self.debug_log = DebugLog(
+            self.reactor, config.getint("log_buffer_size", 1000, minval=1)
+        )
+        self.number_of_tools = config.getint("number_of_tools", 5)
+        self.tool_mapping = config.getintlist(
+            "tool_mapping",
+            list(range(self.number_of_tools)),
+        )
+        if len(self.tool_mapping) != self.number_of_tools or not all(
+            0 <= slot < self.number_of_tools for slot in self.tool_mapping
+        ):
+            raise config.error(
+                f"tool_mapping needs {self.number_of_tools} slots between 0 and "
+                f"{self.number_of_tools - 1}, got {self.tool_mapping}"
+            )
+
+        # timeouts
+        self.timeout_pause = config.getint("timeout_pause", 36000)
+        self.disable_heater = config.getint("disable_heater", 600)
+        # bowden load
+        self.bowden_load_length1 = config.getint("bowden_load_length1", 450)
+        self.bowden_load_length2 = config.getint("bowden_load_length2", 20)
+        self.bowden_load_length3 = config.getint("bowden_load_length3", 20)
         self.bowden_load_speed1 = config.getint("bowden_load_speed1", 120)
         self.bowden_load_speed2 = config.getint("bowden_load_speed2", 60)
         self.bowden_load_accel1 = config.getint("bowden_load_accel1", 80)
@@ -477,6 +1731,16 @@ class MMU3:
         self.finda_unload_speed = config.getint("finda_unload_speed", 20)
         self.finda_load_accel = config.getint("finda_load_accel", 50)
         self.finda_unload_accel = config.getint("finda_unload_accel", 50)
+        self.enable_finda_approach = config.getboolean("enable_finda_approach", True)
+        self.finda_approach_margin = config.getfloat(
+            "finda_approach_margin", 3, minval=0
+        )
+        self.finda_approach_speed = config.getfloat(
+            "finda_approach_speed", self.bowden_load_speed1, above=0
+        )
+        self.finda_approach_accel = config.getfloat(
+            "finda_approach_accel", self.bowden_load_accel1, above=0
+        )
         # cut in mmu3
         self.cut_filament_length = config.getfloat("cut_filament_length", 20)
         self.cutting_edge_retract = config.getfloat("cutting_edge_retract", 5)
@@ -525,9 +1789,34 @@ class MMU3:
             config.getint("pause_after_disabling_steppers", 250) / 1000.0
         )
         self.pause_position = config.getfloatlist("pause_position", [0, 200, 10])
+        self.stepper_disable_delay = config.getfloat(
+            "stepper_disable_delay", 2.0, minval=0
+        )
+        self.disable_steppers_timer = self.reactor.register_timer(
+            self._handle_disable_steppers_timer
+        )
         # temperature
         self.min_temp_extruder = config.getint("min_temp_extruder", 180)
         self.extruder_eject_temp = config.getint("extruder_eject_temp", 200)
+        # start heating and run the cold-safe phases instead of failing or
+        # waiting for the heater first
+        self.enable_deferred_heating = config.getboolean(
+            "enable_deferred_heating", False
+        )
+        # the hotend temperature of the filament in every slot, 0 to leave the
+        # heater alone
+        self.slot_temperatures = config.getfloatlist(
+            "slot_temperatures", [0.0] * self.number_of_tools
+        )
+        if len(self.slot_temperatures) != self.number_of_tools or not all(
+            temp == 0 or temp >= self.min_temp_extruder
+            for temp in self.slot_temperatures
+        ):
+            raise config.error(
+                f"slot_temperatures needs {self.number_of_tools} temperatures, "
+                f"either 0 or at least min_temp_extruder, "
+                f"got {self.slot_temperatures}"
+            )
         # other options
         self.enable_no_selector_mode: bool = config.getboolean(
             "enable_no_selector_mode",
@@ -552,10 +1841,160 @@ class MMU3:
             "filament_motion_sensor_name",
             "filament_motion_sensor encoder_sensor",
         )
+        # ramming
+        self.ramming_macro = config.get("ramming_macro", "RAMMING_SLICER")
+        self.ramming_mode = config.getchoice(
+            "ramming_mode", {"macro": "macro", "native": "native"}, "macro"
+        )
+        self.ramming_profile: None | RammingProfile = None
+        self.last_ramming_cpu_time = 0.0
+        if self.ramming_mode == "native":
+            section_name = f"gcode_macro {self.ramming_macro}"
+            if not config.has_section(section_name):
+                raise config.error(
+                    f"ramming_mode native requires the [{section_name}] section"
+                )
+            try:
+                self.ramming_profile = RammingProfile.from_gcode(
+                    self.ramming_macro,
+                    config.getsection(section_name).get("gcode"),
+                )
+            except ValueError as e:
+                raise config.error(str(e)) from e
+        # ramming profile library, created with scripts/ramming_extracter.py
+        self.ramming_profile_library = config.get("ramming_profile_library", None)
+        self.slot_materials = config.getlist(
+            "slot_materials", ["default"] * self.number_of_tools
+        )
+        if len(self.slot_materials) != self.number_of_tools:
+            raise config.error(
+                f"slot_materials needs {self.number_of_tools} materials, "
+                f"got {len(self.slot_materials)}"
+            )
+        self.ramming_profiles: dict[str, RammingProfile] = {}
+        if self.ramming_profile_library:
+            try:
+                self.ramming_profiles = self.load_ramming_profile_library()
+            except (OSError, ValueError) as e:
+                raise config.error(
+                    f"Can not load ramming profile library: {e}"
+                ) from e
+        # sensor terminated bowden load
+        self.enable_sensor_bowden_load = config.getboolean(
+            "enable_sensor_bowden_load", False
+        )
+        self.bowden_sensor_load_length = config.getfloat(
+            "bowden_sensor_load_length",
+            self.bowden_load_length1
+            + self.bowden_load_length2
+            + self.bowden_load_length3,
+            above=0,
+        )
+        if self.enable_sensor_bowden_load:
+            # the switch_pin of the filament switch sensor is used as an endstop
+            filament_switch_sensor_pin = None
+            if config.has_section(self.filament_switch_sensor_name):
+                filament_switch_sensor_pin = config.getsection(
+                    self.filament_switch_sensor_name
+                ).get("switch_pin", None)
+            if filament_switch_sensor_pin is None:
+                raise config.error(
+                    f"[{self.filament_switch_sensor_name}] with a switch_pin is "
+                    "required when enable_sensor_bowden_load is True"
+                )
+            if self.filament_switch_sensor_position == SwitchSensorPosition.PostGears:
+                raise config.error(
+                    "enable_sensor_bowden_load is not supported "
+                    "with post_gears filament switch sensors"
+                )
+            # the pin is shared with the filament_switch_sensor
+            ppins = self.printer.lookup_object("pins")
+            # the pull up and invert flags are not part of the pin name
+            ppins.allow_multi_use_pin(filament_switch_sensor_pin.lstrip("^~! "))
+            self.filament_switch_sensor_endstop = ppins.setup_pin(
+                "endstop", filament_switch_sensor_pin
+            )
+            self.printer.register_event_handler(
+                "klippy:mcu_identify", self._handle_mcu_identify
+            )
+        # bowden calibration
+        self.enable_bowden_calibration = config.getboolean(
+            "enable_bowden_calibration", True
+        )
+        self.bowden_calibration_margin = config.getfloat(
+            "bowden_calibration_margin", 10, minval=0
+        )
+        self.bowden_calibration = BowdenCalibration(
+            self.number_of_tools,
+            max_samples=config.getint("bowden_calibration_samples", 15, minval=1),
+            min_samples=config.getint("bowden_calibration_min_samples", 3, minval=1),
+        )
+        # the filament tip positions of the slots
+        self.parked_tips = ParkedTipModel(self.number_of_tools)
+        # endstop state caches
+        self.finda_state = EndstopStateCache(self, "FINDA")
+        self.selector_endstop_state = EndstopStateCache(self, "Selector")
+        finda_pin = config.get("finda_pin", None)
+        if finda_pin is not None:
+            self.finda_state.register_pin(config, finda_pin)
+        selector_endstop_pin = config.get("selector_endstop_pin", None)
+        if selector_endstop_pin is not None:
+            self.selector_endstop_state.register_pin(config, selector_endstop_pin)
+        self.finda_max_age = config.getfloat("finda_max_age", None, minval=0)
+        # homing confidence
+        self.homing_confidence = HomingConfidence(
+            {
+                "idler": config.getfloat(
+                    "idler_max_travel_since_home", 20000, above=0
+                ),
+                "selector": config.getfloat(
+                    "selector_max_travel_since_home", 20000, above=0
+                ),
+            }
+        )
+        self.selector_verify_distance = config.getfloat(
+            "selector_verify_distance", 3, above=0
+        )
+        self.selector_verify_tolerance = config.getfloat(
+            "selector_verify_tolerance", 1, above=0
+        )
+        # look-ahead
+        self.lookahead_interval = config.getfloat("lookahead_interval", 2.0, minval=0)
+        self.lookahead = ToolChangeLookahead(
+            self, config.getint("lookahead_window", 65536, minval=1024)
+        )
+        self.lookahead.staging_callbacks.append(self.stage_next_tool)
+        # persistent state
+        self.state_file = os.path.expanduser(
+            config.get(
+                "state_file",
+                os.path.join(
+                    os.path.dirname(self.printer.get_start_args()["config_file"]),
+                    "mmu3_state.json",
+                ),
+            )
+        )
+        self.state_save_interval = config.getfloat(
+            "state_save_interval", 1.0, above=0
+        )
+        self.saved_state = None
+        self.state_restored = False
 
         # register commands
         self.register_commands()
         self.printer.register_event_handler("klippy:connect", self._connect)
+        self.printer.register_event_handler("klippy:ready", self._handle_ready)
+        self.printer.register_event_handler(
+            "klippy:disconnect", self._handle_disconnect
+        )
+
+    def _handle_mcu_identify(self) -> None:
+        """Add the pulley steppers to the filament switch sensor endstop."""
+        pulley_stepper: ManualStepper = self.printer.lookup_object(
+            PULLEY_STEPPER_NAME
+        )
+        for stepper in pulley_stepper.rail.get_steppers():
+            self.filament_switch_sensor_endstop.add_stepper(stepper)
 
     def _connect(self) -> None:
         """Handle klippy:connect event."""
@@ -578,36 +2017,235 @@ class MMU3:
         self.selector_stepper_endstop: MCU_endstop = self.get_endstop(
             SELECTOR_STEPPER_NAME
         )
-        self.mcu: MCU_endstop = self.pulley_stepper_endstop.get_mcu()
+        self.mcu: MCU = self.pulley_stepper_endstop.get_mcu()
+        self.finda_state.endstop = self.pulley_stepper_endstop
+        self.selector_endstop_state.endstop = self.selector_stepper_endstop
+        self.sensor_scheduler = PrintTimeScheduler(
+            self.reactor, self.toolhead, self.mcu
+        )
         self.filament_switch_sensor: SwitchSensor = self.printer.lookup_object(
             self.filament_switch_sensor_name
         )
 
-        with contextlib.suppress(configparser.Error):
-            self.filament_motion_sensor: EncoderSensor = self.printer.lookup_object(
-                self.filament_motion_sensor_name
+        with contextlib.suppress(configparser.Error):
+            self.filament_motion_sensor: EncoderSensor = self.printer.lookup_object(
+                self.filament_motion_sensor_name
+            )
+        self.display_status: DisplayStatus = self.printer.lookup_object(
+            "display_status"
+        )
+        self.virtual_sdcard: None | VirtualSD = self.printer.lookup_object(
+            "virtual_sdcard", None
+        )
+        if self.virtual_sdcard is not None and self.lookahead_interval:
+            self.reactor.register_timer(
+                self._handle_lookahead_timer, self.reactor.NOW
+            )
+
+    def _handle_ready(self) -> None:
+        """Handle klippy:ready event."""
+        self.restore_state()
+        self.reactor.register_timer(
+            self._handle_state_timer,
+            self.reactor.monotonic() + self.state_save_interval,
+        )
+
+    def _handle_disconnect(self) -> None:
+        """Handle klippy:disconnect event."""
+        if self.saved_state is not None:
+            self.save_state(self.get_state())
+
+    def _handle_state_timer(self, eventtime: float) -> float:
+        """Save the state if it has changed since the last save.
+
+        The state is only compared and written every state_save_interval
+        seconds, so a burst of state changes results in a single write.
+
+        Args:
+            eventtime (float): The reactor time of the event.
+
+        Returns:
+            float: The next wake up time.
+        """
+        state = self.get_state()
+        if state != self.saved_state:
+            self.save_state(state)
+        return eventtime + self.state_save_interval
+
+    def get_state(self) -> dict:
+        """Return the state to be persisted.
+
+        Returns:
+            dict: The state.
+        """
+        return {
+            "version": 1,
+            "current_tool": self.current_tool,
+            "current_filament": self.current_filament,
+            "is_homed": self.is_homed,
+            "idler_position": self.idler_stepper.get_position()[0],
+            "selector_position": self.selector_stepper.get_position()[0],
+            "bowden_calibration": self.bowden_calibration.to_dict(),
+            "parked_tips": self.parked_tips.to_list(),
+        }
+
+    def save_state(self, state: dict) -> None:
+        """Write the state to the state file atomically.
+
+        Args:
+            state (dict): The state.
+        """
+        temp_path = f"{self.state_file}.tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(state, f)
+            os.replace(temp_path, self.state_file)
+        except OSError as e:
+            self.respond_debug("Can not save the MMU state: %s", e)
+        # don't retry on every timer tick if the file can not be written
+        self.saved_state = state
+
+    def load_state(self) -> None | dict:
+        """Read the state from the state file.
+
+        Returns:
+            None | dict: The state, None if there is no valid state file.
+        """
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(state, dict) or state.get("version") != 1:
+            return None
+        return state
+
+    def restore_state(self) -> bool:
+        """Restore the persisted state if it matches the sensors.
+
+        The filament and tool state is only restored if FINDA and the filament
+        switch sensor agree with it, i.e. both detect the filament if it is
+        loaded, none of them if it is not.
+
+        Returns:
+            bool: True if the state is restored, False otherwise.
+        """
+        state = self.load_state()
+        if state is None:
+            return False
+
+        self.saved_state = state
+        self.bowden_calibration.from_dict(state.get("bowden_calibration", {}))
+
+        loaded = state.get("current_filament") is not None
+        consistent = self.is_filament_in_switch_sensor() == loaded
+        if not self.enable_no_selector_mode:
+            consistent &= self.is_filament_in_finda() == loaded
+        if not consistent:
+            self.respond_info(
+                "The saved MMU state does not match the sensors, HOME_MMU required"
             )
-        self.display_status: DisplayStatus = self.printer.lookup_object(
-            "display_status"
+            return False
+
+        self.current_tool = state.get("current_tool")
+        self.current_filament = state.get("current_filament")
+        self.parked_tips.from_list(state.get("parked_tips", []))
+        self.is_homed = bool(state.get("is_homed"))
+        if self.is_homed:
+            self.idler_stepper.do_set_position(state.get("idler_position", 0))
+            self.selector_stepper.do_set_position(state.get("selector_position", 0))
+            # the axes may have been moved while Klipper was not running
+            self.homing_confidence.set_unverified()
+        self.state_restored = True
+        self.respond_info(
+            f"MMU state restored: tool {self.current_tool}, "
+            f"filament {self.current_filament}, homed {self.is_homed}"
         )
+        return True
+
+    def _handle_lookahead_timer(self, eventtime: float) -> float:
+        """Update the look-ahead of the next tool change.
+
+        Args:
+            eventtime (float): The reactor time of the event.
+
+        Returns:
+            float: The next wake up time.
+        """
+        if self.virtual_sdcard.is_active():
+            self.lookahead.update(
+                self.virtual_sdcard.file_path(),
+                self.virtual_sdcard.file_position,
+                eventtime,
+            )
+        elif self.lookahead.file_path is not None:
+            self.lookahead.reset()
+        return eventtime + self.lookahead_interval
+
+    def stage_next_tool(self, tool_id: int, eta: None | float) -> None:
+        """Report the next tool change found in the printed file.
+
+        The tool is mapped to its slot, which is reported as staged_tool
+        along with the next_tool and next_tool_eta of the lookahead. Nothing is
+        moved or prepared, the tool change is not started before its T<n>.
+
+        Args:
+            tool_id (int): The tool id of the next tool change.
+            eta (None | float): The estimated time to the next tool change in
+                seconds, None if it can not be estimated yet.
+        """
+        slot = self.get_mapped_tool_id(tool_id)
+        if slot == self.staged_tool:
+            return
+        self.staged_tool = slot
+        self.respond_debug("Staged next tool T%s (slot %s)", tool_id, slot)
+
+    def log(self, level: int, msg: str, *args) -> None:
+        """Log a message to the debug log and the console.
+
+        The message is only formatted if it is sent to the console, which is
+        done for info and higher levels, and for debug messages in debug mode.
+
+        Args:
+            level (int): The logging level, i.e. logging.DEBUG.
+            msg (str): The %-style message.
+            *args: The message arguments.
+        """
+        self.debug_log.add(level, msg, args)
+        if level >= logging.INFO or self.debug:
+            self.gcode.respond_info(f"MMU3: {msg % args if args else msg}")
 
-    def respond_info(self, msg: str) -> None:
+    def respond_info(self, msg: str, *args) -> None:
         """Respond info through the current GCodeCommand instance.
 
         Args:
-            msg (str): The info message.
+            msg (str): The %-style info message.
+            *args: The message arguments.
         """
-        self.gcode.respond_info(f"MMU3: {msg}")
+        self.log(logging.INFO, msg, *args)
 
-    def respond_debug(self, msg: str) -> None:
+    def respond_debug(self, msg: str, *args) -> None:
         """Respond debug through the current GCodeCommand instance.
 
         Args:
-            msg (str): The debug message.
+            msg (str): The %-style debug message.
+            *args: The message arguments.
         """
-        if not self.debug:
-            return
-        self.gcode.respond_info(f"MMU3: {msg}")
+        self.log(logging.DEBUG, msg, *args)
+
+    def dump_log(self, console: bool = False) -> None:
+        """Write the debug log to the Klipper log.
+
+        Args:
+            console (bool): Also send the debug log to the console.
+        """
+        lines = list(self.debug_log.iter_lines())
+        logging.info("MMU3 debug log:\n%s", "\n".join(lines))
+        if console:
+            self.gcode.respond_info("\n".join(lines))
+        self.gcode.respond_info(
+            f"MMU3: Dumped {len(lines)} debug log records to the Klipper log"
+        )
 
     def display_status_msg(self, msg: str) -> None:
         """Display the given status message in the LCD display."""
@@ -630,6 +2268,21 @@ class MMU3:
         self.gcode.register_command("HOME_IDLER", self.cmd_home_idler)
         self.gcode.register_command("HOME_MMU", self.cmd_home_mmu)
         self.gcode.register_command("HOME_MMU_ONLY", self.cmd_home_mmu_only)
+        self.gcode.register_command(
+            "MMU_BOWDEN_CALIBRATION", self.cmd_bowden_calibration
+        )
+        self.gcode.register_command("MMU_LOOKAHEAD", self.cmd_lookahead)
+        self.gcode.register_command(
+            "MMU_RAMMING_PROFILE", self.cmd_ramming_profile
+        )
+        self.gcode.register_command(
+            "MMU_SLOT_TEMPERATURE", self.cmd_slot_temperature
+        )
+        self.gcode.register_command("MMU_TRACE", self.cmd_trace)
+        self.gcode.register_command("MMU_DUMP_LOG", self.cmd_dump_log)
+        self.gcode.register_command(
+            "MMU_HOMING_CONFIDENCE", self.cmd_homing_confidence
+        )
         self.gcode.register_command("PAUSE_MMU", self.cmd_pause)
         self.gcode.register_command("RESUME_MMU", self.cmd_resume)
 
@@ -684,6 +2337,25 @@ class MMU3:
         self.gcode.register_command("EJECT_FROM_EXTRUDER", self.cmd_eject_from_extruder)
         self.gcode.register_command("EJECT_BEFORE_HOME", self.cmd_eject_before_home)
 
+    def get_status(self, eventtime: float) -> dict:
+        """Return the status of the MMU3 for the web UIs.
+
+        The status is polled frequently, so the dict is cached and only rebuilt
+        after any of the reported values is set, see StatusAttribute.
+
+        Args:
+            eventtime (float): The current reactor time.
+
+        Returns:
+            dict: The status.
+        """
+        if self.status_dirty or self.lookahead.status_dirty:
+            self.status_dirty = self.lookahead.status_dirty = False
+            self.status = {name: getattr(self, name) for name in self.STATUS_ATTRIBUTES}
+            self.status["next_tool"] = self.lookahead.next_tool
+            self.status["next_tool_eta"] = self.lookahead.next_tool_eta
+        return self.status
+
     def get_mapped_tool_id(self, tool_id: int) -> int:
         """Return the mapped tool id.
 
@@ -695,6 +2367,20 @@ class MMU3:
         """
         return self.tool_mapping[tool_id]
 
+    def get_slot_name(self, slot: int) -> str:
+        """Return the name of a slot for the messages, i.e. T2.
+
+        Args:
+            slot (int): The slot.
+
+        Returns:
+            str: The first tool mapped to the slot, or the slot if no tool is
+                mapped to it.
+        """
+        if slot in self.tool_mapping:
+            return f"T{self.tool_mapping.index(slot)}"
+        return f"slot {slot}"
+
     def get_endstop(self, endstop_name: str) -> None | MCU_endstop:
         """Return the endstop with the given name.
 
@@ -718,6 +2404,15 @@ class MMU3:
         print_time = self.toolhead.get_last_move_time()
         return self.extruder_heater.get_temp(print_time)[0]
 
+    def get_extruder_target_temperature(self) -> float:
+        """Return the current extruder target temperature.
+
+        Returns:
+            float: The current extruder target temperature, 0 if it is off.
+        """
+        print_time = self.toolhead.get_last_move_time()
+        return self.extruder_heater.get_temp(print_time)[1]
+
     def is_filament_in_switch_sensor(self) -> bool:
         """Check if the filament present in the filament switch sensor.
 
@@ -738,14 +2433,31 @@ class MMU3:
             return True
         return self.filament_motion_sensor.get_status(None)["filament_detected"]
 
-    def is_filament_in_finda(self) -> bool:
+    def is_filament_in_finda(self, max_age: None | float = None) -> bool:
         """Return if the filament is in FINDA or not.
 
+        The cached FINDA state is used if it is fresh enough, otherwise FINDA
+        is queried from the MCU.
+
+        Args:
+            max_age (None | float): The maximum age of the cached state in
+                seconds. Defaults to finda_max_age.
+
         Returns:
             bool: True if the filament is present in FINDA, False otherwise.
         """
-        print_time = self.toolhead.get_last_move_time()
-        return bool(self.pulley_stepper_endstop.query_endstop(print_time))
+        return self.finda_state.query(
+            [self.pulley_stepper],
+            self.finda_max_age if max_age is None else max_age,
+        )
+
+    def is_selector_endstop_triggered(self) -> bool:
+        """Return if the selector endstop is triggered or not.
+
+        Returns:
+            bool: True if the selector endstop is triggered, False otherwise.
+        """
+        return self.selector_endstop_state.query([self.selector_stepper])
 
     def disable_steppers(
         self, steppers: None | ManualStepper | list[ManualStepper] = None
@@ -760,7 +2472,7 @@ class MMU3:
         Returns:
             bool: True, if all are successfully disabled, False otherwise.
         """
-        start_time = time.time()
+        start_time = self.reactor.monotonic()
         if steppers is None:
             steppers = [self.pulley_stepper, self.selector_stepper, self.idler_stepper]
         elif isinstance(steppers, ManualStepper):
@@ -770,17 +2482,78 @@ class MMU3:
             return False
 
         self.respond_debug("Disabling steppers ...")
+        self.cancel_disable_steppers()
         self.toolhead.wait_moves()
         for stepper in steppers:
             # stepper.dwell(self.pause_before_disabling_steppers)
             stepper.do_enable(False)
             # stepper.dwell(self.pause_after_disabling_steppers)
+        self.steppers_enabled = False
+        self.number_of_stepper_disables += 1
         self.respond_debug("Steppers disabled!")
 
-        duration = time.time() - start_time
-        self.respond_debug(f"disable_steppers took {duration:0.1f} seconds")
+        duration = self.reactor.monotonic() - start_time
+        self.respond_debug("disable_steppers took %0.1f seconds", duration)
+        return True
+
+    def schedule_disable_steppers(self) -> None:
+        """Disable all the steppers after stepper_disable_delay seconds."""
+        if not self.stepper_disable_delay:
+            self.disable_steppers()
+            return
+        self.disable_steppers_pending = True
+        self.reactor.update_timer(
+            self.disable_steppers_timer,
+            self.reactor.monotonic() + self.stepper_disable_delay,
+        )
+
+    def cancel_disable_steppers(self) -> bool:
+        """Cancel the scheduled disabling of the steppers, if any.
+
+        Returns:
+            bool: True if a scheduled disable is cancelled, False otherwise.
+        """
+        if not self.disable_steppers_pending:
+            return False
+        self.disable_steppers_pending = False
+        self.reactor.update_timer(self.disable_steppers_timer, self.reactor.NEVER)
         return True
 
+    def _handle_disable_steppers_timer(self, eventtime: float) -> float:
+        """Disable the steppers once they are idle.
+
+        Args:
+            eventtime (float): The reactor time of the event.
+
+        Returns:
+            float: The next wake up time.
+        """
+        if not self.disable_steppers_pending:
+            return self.reactor.NEVER
+
+        if self.gcode.get_mutex().test():
+            # a command is running, try again later
+            return eventtime + self.stepper_disable_delay
+
+        steppers = [self.pulley_stepper, self.selector_stepper, self.idler_stepper]
+        print_time = self.mcu.estimated_print_time(eventtime)
+        end_time = max(stepper.next_cmd_time for stepper in steppers)
+        if print_time < end_time:
+            # the steppers are still moving, no need to drain the queue
+            return eventtime + end_time - print_time
+
+        self.disable_steppers_pending = False
+        # do_enable flushes the step generation and dwells the toolhead, hold
+        # the mutex so that no G-code command, i.e. of a printed file, can
+        # run in between
+        with self.gcode.get_mutex():
+            for stepper in steppers:
+                stepper.do_enable(False)
+        self.steppers_enabled = False
+        self.number_of_stepper_disables += 1
+        self.respond_debug("Steppers disabled after being idle!")
+        return self.reactor.NEVER
+
     def sync_stepper_to_extruder(self, manual_stepper: ManualStepper) -> None:
         """Synchronize the given stepper to the extruder so that they move together.
 
@@ -817,6 +2590,69 @@ class MMU3:
         stepper.set_trapq(trapq)
         self.motion_queuing.check_step_generation_scan_windows()
 
+    def get_slot_temperature(self, slot: int) -> float:
+        """Return the hotend temperature of the filament in the given slot.
+
+        Args:
+            slot (int): The slot.
+
+        Returns:
+            float: The temperature, 0 if it is not set.
+        """
+        return self.slot_temperatures[slot]
+
+    def get_heating_temperature(self, slot: None | int = None) -> float:
+        """Return the temperature to heat the extruder to.
+
+        Args:
+            slot (None | int): The slot to heat for. Defaults to None.
+
+        Returns:
+            float: The temperature of the slot if it is set, otherwise the
+                current target if it is hot enough to extrude, otherwise
+                extruder_eject_temp.
+        """
+        if slot is not None and self.get_slot_temperature(slot):
+            return self.get_slot_temperature(slot)
+        target = self.get_extruder_target_temperature()
+        if target >= self.min_temp_extruder:
+            return target
+        return max(self.min_temp_extruder, self.extruder_eject_temp)
+
+    def start_heating(self, slot: None | int = None) -> bool:
+        """Move the heater toward the heating temperature without waiting.
+
+        Args:
+            slot (None | int): The slot to heat for. Defaults to None.
+
+        Returns:
+            bool: True, always.
+        """
+        temp = self.get_heating_temperature(slot)
+        if temp != self.get_extruder_target_temperature():
+            self.respond_debug("Heating to %s", temp)
+            self.gcode.run_script_from_command(f"M104 S{temp}")
+        return True
+
+    def wait_for_heater(self, slot: None | int = None) -> bool:
+        """Wait for the heater to reach the heating temperature.
+
+        The heater is only waited for while heating, a hotter nozzle doesn't
+        prevent loading.
+
+        Args:
+            slot (None | int): The slot to heat for. Defaults to None.
+
+        Returns:
+            bool: True, always.
+        """
+        self.start_heating(slot)
+        temp = self.get_heating_temperature(slot)
+        if self.get_extruder_temperature() < temp - 1:
+            self.respond_debug("Waiting for the heater to reach %s", temp)
+            self.gcode.run_script_from_command(f"M109 S{temp}")
+        return True
+
     def validate_extruder_is_hot_enough(self) -> bool:
         """Validate if the extruder is hot enough.
 
@@ -826,6 +2662,13 @@ class MMU3:
             bool: True if hotend is hot enough, False otherwise.
         """
         self.respond_debug("Checking hotend temperature")
+        if (
+            self.enable_deferred_heating
+            and self.get_extruder_temperature() < self.min_temp_extruder
+            and self.get_extruder_target_temperature() >= self.min_temp_extruder
+        ):
+            # the heater has been started by an earlier phase
+            self.wait_for_heater()
         if self.get_extruder_temperature() < self.min_temp_extruder:
             self.display_status_msg("Extruder is not hot enough!")
             return False
@@ -845,25 +2688,41 @@ class MMU3:
         self.idler_stepper.do_set_position(0)
         # to make sure that the idler is not already at the endstop
         # rotate it a little back
-        self.idler_stepper.do_move(
-            self.idler_homing_move_lengths[0],
-            self.idler_homing_speed,
-            self.idler_homing_accel,
+        self.motion_coordinator.move(
+            [
+                (
+                    self.idler_stepper,
+                    self.idler_homing_move_lengths[0],
+                    self.idler_homing_speed,
+                    self.idler_homing_accel,
+                )
+            ]
         )
         # do a big rotation to ensure we hit the end stop
-        self.idler_stepper.do_move(
-            self.idler_homing_move_lengths[1],
-            self.idler_homing_speed,
-            self.idler_homing_accel,
+        self.motion_coordinator.move(
+            [
+                (
+                    self.idler_stepper,
+                    self.idler_homing_move_lengths[1],
+                    self.idler_homing_speed,
+                    self.idler_homing_accel,
+                )
+            ]
         )
         # we must have hit the endstop
         # this is the 0 position
         self.idler_stepper.do_set_position(0)
+        self.homing_confidence.reset("idler")
         # move to the parking position
-        self.idler_stepper.do_move(
-            self.idler_positions[-1],
-            self.idler_speed,
-            self.idler_accel,
+        self.motion_coordinator.move(
+            [
+                (
+                    self.idler_stepper,
+                    self.idler_positions[-1],
+                    self.idler_speed,
+                    self.idler_accel,
+                )
+            ],
             sync=False,
         )
 
@@ -884,6 +2743,7 @@ class MMU3:
             self.respond_debug,
             self.reactor,
             self.toolhead,
+            self.sensor_scheduler,
         ):
             self.is_homed = True
             self.respond_debug("Homing MMU ...")
@@ -912,44 +2772,135 @@ class MMU3:
 
         self.home_idler()
         if not self.enable_no_selector_mode:
-            self.respond_debug("Homing selector")
-            self.selector_stepper.do_set_position(0)
-            # do a fast homing first
-            self.selector_stepper.do_homing_move(
-                movepos=-abs(self.selector_homing_move_length),
-                speed=self.selector_homing_speed,
-                accel=self.selector_accel,
-                probe_pos=False,
-                triggered=True,
-                check_trigger=True,
-            )
-            # and then a slow homing
-            self.toolhead.wait_moves()
-            self.selector_stepper.do_set_position(0)
-            self.selector_stepper.do_move(
-                3,
-                self.selector_speed,
-                self.selector_accel,
-            )
-            self.selector_stepper.do_set_position(0)
-            self.toolhead.wait_moves()
+            self.home_selector()
+
+        self.current_tool = None
+        self.current_filament = None
+        self.unselect_tool()
+        self.is_homed = True
+        self.respond_debug("Homing MMU ended ...")
+
+        return True
+
+    def home_selector(self) -> bool:
+        """Home the selector with a fast and then a slow homing move.
+
+        Returns:
+            bool: True, always.
+        """
+        self.respond_debug("Homing selector")
+        self.selector_stepper.do_set_position(0)
+        # do a fast homing first
+        self.selector_stepper.do_homing_move(
+            movepos=-abs(self.selector_homing_move_length),
+            speed=self.selector_homing_speed,
+            accel=self.selector_accel,
+            probe_pos=False,
+            triggered=True,
+            check_trigger=True,
+        )
+        # and then a slow homing
+        self.toolhead.wait_moves()
+        self.selector_stepper.do_set_position(0)
+        self.selector_stepper.do_move(
+            3,
+            self.selector_speed,
+            self.selector_accel,
+        )
+        self.selector_stepper.do_set_position(0)
+        self.toolhead.wait_moves()
+        self.selector_stepper.do_homing_move(
+            movepos=-abs(self.selector_homing_move_length),
+            speed=self.selector_homing_speed_slow,
+            accel=self.selector_accel,
+            probe_pos=False,
+            triggered=True,
+            check_trigger=True,
+        )
+        self.toolhead.wait_moves()
+        self.selector_stepper.do_set_position(0)
+        self.homing_confidence.reset("selector")
+        return True
+
+    def verify_selector(self) -> bool:
+        """Verify the selector position with a single slow touch of the endstop.
+
+        The selector is moved close to the endstop and then homed slowly, the
+        endstop should trigger within selector_verify_tolerance of the zero
+        position. This is a lot faster than a full home.
+
+        Returns:
+            bool: True if the selector position is verified, False otherwise.
+        """
+        self.respond_debug("Verifying selector position")
+        self.selector_stepper.do_move(
+            self.selector_verify_distance, self.selector_speed, self.selector_accel
+        )
+        try:
             self.selector_stepper.do_homing_move(
-                movepos=-abs(self.selector_homing_move_length),
+                movepos=-self.selector_verify_tolerance,
                 speed=self.selector_homing_speed_slow,
                 accel=self.selector_accel,
                 probe_pos=False,
                 triggered=True,
                 check_trigger=True,
             )
+        except self.printer.command_error as e:
+            self.respond_debug("Selector verification failed: %s", e)
+            trigger_position = None
+        else:
             self.toolhead.wait_moves()
-            self.selector_stepper.do_set_position(0)
+            trigger_position = self.selector_stepper.get_position()[0]
 
-        self.current_tool = None
-        self.current_filament = None
-        self.unselect_tool()
-        self.is_homed = True
-        self.respond_debug("Homing MMU ended ...")
+        if (
+            trigger_position is None
+            or abs(trigger_position) > self.selector_verify_tolerance
+        ):
+            self.number_of_verification_failures += 1
+            self.homing_confidence.add_stall("selector")
+            return False
+
+        self.selector_stepper.do_set_position(0)
+        self.homing_confidence.reset("selector")
+        return True
+
+    def check_homing(self, verify: bool = False) -> bool:
+        """Home the idler and selector only if their positions can't be trusted.
+
+        A never homed MMU gets a full home. Otherwise each lost axis is homed
+        on its own, and the selector is verified with a single touch if its
+        position has been restored after a restart or if verify is True.
+
+        Args:
+            verify (bool): Verify the selector even if it is trusted. Used
+                where a full home was done unconditionally before.
+
+        Returns:
+            bool: True, if the positions are trusted now, False otherwise.
+        """
+        if not self.is_homed:
+            self.display_status_msg("MMU is not homed, homing!")
+            return self.home_mmu()
+
+        homed = False
+        if self.homing_confidence.is_lost("idler"):
+            self.respond_debug("Idler position is lost, homing idler")
+            self.home_idler()
+            homed = True
+
+        if not self.enable_no_selector_mode and (
+            self.homing_confidence.is_lost("selector")
+            or (
+                (verify or self.homing_confidence.needs_verification("selector"))
+                and not self.verify_selector()
+            )
+        ):
+            self.respond_debug("Selector position is lost, homing selector")
+            self.home_selector()
+            homed = True
 
+        if verify and not homed:
+            self.number_of_homes_skipped += 1
         return True
 
     def load_filament_to_finda_in_loop(self) -> bool:
@@ -961,7 +2912,24 @@ class MMU3:
         Returns:
             bool: True, if filament loaded to FINDA, False otherwise.
         """
-        self.toolhead.wait_moves()
+        travel = 0.0
+        distance = self.parked_tips.get_distance_to_finda(self.current_tool)
+        if distance is not None and self.is_finda_approach_faster(distance):
+            travel = self.approach_finda(distance)
+            if self.is_filament_in_finda():
+                self.respond_debug("FINDA endstop triggered after the approach.")
+                self.parked_tips.set(self.current_tool, 0)
+                self.bowden_calibration.add_sample(
+                    "finda_load", self.current_tool, travel
+                )
+                return True
+            self.parked_tips.move(self.current_tool, travel)
+            self.respond_debug(
+                "FINDA endstop not triggered %.1f mm from the parked tip, "
+                "falling back to the loop.",
+                travel,
+            )
+
         for i in range(int(self.finda_load_retry)):
             self.pulley_stepper.do_set_position(0)
             self.pulley_stepper.do_homing_move(
@@ -973,17 +2941,80 @@ class MMU3:
                 check_trigger=False,
             )
             self.toolhead.wait_moves()
+            travel += self.pulley_stepper.get_position()[0]
 
             # check endstop status and exit from the loop
             if self.is_filament_in_finda():
                 self.respond_debug("FINDA endstop triggered. Exiting filament load.")
+                self.parked_tips.set(self.current_tool, 0)
+                self.bowden_calibration.add_sample(
+                    "finda_load", self.current_tool, travel
+                )
                 return True
-            self.respond_debug(f"FINDA endstop not triggered. Retrying... {i + 1}")
+            self.parked_tips.move(
+                self.current_tool, self.pulley_stepper.get_position()[0]
+            )
+            self.respond_debug("FINDA endstop not triggered. Retrying... %s", i + 1)
+        self.parked_tips.forget(self.current_tool)
         self.display_status_msg(
             f"Couldn't load filament to FINDA after {self.finda_load_retry} tries!"
         )
         return False
 
+    def is_finda_approach_faster(self, distance: float) -> bool:
+        """Check if approaching FINDA is faster than homing to it directly.
+
+        Args:
+            distance (float): The expected distance from the tip to FINDA.
+
+        Returns:
+            bool: True if the approach is enabled and it is expected to be
+                faster.
+        """
+        fast_length = distance - self.finda_approach_margin
+        if not self.enable_finda_approach or fast_length <= 0:
+            return False
+        approach_duration = get_move_duration(
+            fast_length, self.finda_approach_speed, self.finda_approach_accel
+        ) + get_homing_duration(
+            self.finda_approach_margin, self.finda_load_speed, self.finda_load_accel
+        )
+        homing_duration = get_homing_duration(
+            distance, self.finda_load_speed, self.finda_load_accel
+        )
+        return approach_duration < homing_duration
+
+    def approach_finda(self, distance: float) -> float:
+        """Move the filament fast to just short of FINDA and home to it slowly.
+
+        The pulley moves with finda_approach_speed until finda_approach_margin
+        before the expected FINDA position, then does a homing move with
+        finda_load_speed for twice the margin.
+
+        Args:
+            distance (float): The expected distance from the tip to FINDA.
+
+        Returns:
+            float: The distance the filament travelled.
+        """
+        self.respond_debug("Approaching FINDA, expected at %.1f mm", distance)
+        self.pulley_stepper.do_set_position(0)
+        self.pulley_stepper.do_move(
+            distance - self.finda_approach_margin,
+            self.finda_approach_speed,
+            self.finda_approach_accel,
+        )
+        self.pulley_stepper.do_homing_move(
+            movepos=distance + self.finda_approach_margin,
+            speed=self.finda_load_speed,
+            accel=self.finda_load_accel,
+            probe_pos=False,
+            triggered=True,
+            check_trigger=False,
+        )
+        self.toolhead.wait_moves()
+        return self.pulley_stepper.get_position()[0]
+
     def pause(self) -> bool:
         """Pause the MMU.
 
@@ -1044,6 +3075,8 @@ class MMU3:
         """
         self.display_status_msg("Unlocking MMU...")
         self.is_paused = False
+        # the filament can be moved by hand while the idler is parked
+        self.parked_tips.forget()
         return self.home_idler()
 
     def select_tool(self, tool_id: int) -> bool:
@@ -1058,31 +3091,44 @@ class MMU3:
         if self.is_paused:
             return False
 
-        if not self.is_homed:
-            self.display_status_msg("MMU is not homed, homing!")
-            if not self.home_mmu():
-                return False
+        if not self.check_homing():
+            return False
 
         if tool_id is None or tool_id < 0:
             self.display_status_msg(f"Invalid tool id: {tool_id}")
             return False
 
-        self.respond_debug(f"Select Tool {tool_id} ...")
-        self.idler_stepper.do_move(
-            self.idler_positions[tool_id],
-            self.idler_speed,
-            self.idler_accel,
-            sync=False,
+        self.respond_debug("Select Tool %s ...", tool_id)
+        self.homing_confidence.add_travel(
+            "idler",
+            self.idler_positions[tool_id] - self.idler_stepper.get_position()[0],
         )
-
+        moves = [
+            (
+                self.idler_stepper,
+                self.idler_positions[tool_id],
+                self.idler_speed,
+                self.idler_accel,
+            )
+        ]
         if not self.enable_no_selector_mode:
-            self.selector_stepper.do_move(
-                self.selector_positions[tool_id],
-                self.selector_speed,
-                self.selector_accel,
+            self.homing_confidence.add_travel(
+                "selector",
+                self.selector_positions[tool_id]
+                - self.selector_stepper.get_position()[0],
+            )
+            moves.append(
+                (
+                    self.selector_stepper,
+                    self.selector_positions[tool_id],
+                    self.selector_speed,
+                    self.selector_accel,
+                )
             )
+        time_saved = self.motion_coordinator.move(moves)
+        self.respond_debug("Idler/Selector overlap saved %0.2f seconds", time_saved)
         self.current_tool = tool_id
-        self.respond_debug(f"Tool {tool_id} Enabled")
+        self.respond_debug("Tool %s Enabled", tool_id)
         return True
 
     def unselect_tool(self) -> bool:
@@ -1094,20 +3140,26 @@ class MMU3:
         if self.is_paused:
             return False
 
-        if not self.is_homed:
-            self.display_status_msg("MMU is not homed, homing!")
-            if not self.home_mmu():
-                return False
+        if not self.check_homing():
+            return False
 
         if self.current_tool is not None:
-            self.respond_debug(f"Unselecting Tool T{self.current_tool}")
+            self.respond_debug("Unselecting Tool T%s", self.current_tool)
         else:
             self.respond_debug("Unselecting tool while Current Tool is None!")
 
-        self.idler_stepper.do_move(
-            self.idler_positions[-1],
-            self.idler_speed,
-            self.idler_accel,
+        self.homing_confidence.add_travel(
+            "idler", self.idler_positions[-1] - self.idler_stepper.get_position()[0]
+        )
+        self.motion_coordinator.move(
+            [
+                (
+                    self.idler_stepper,
+                    self.idler_positions[-1],
+                    self.idler_speed,
+                    self.idler_accel,
+                )
+            ],
             sync=False,
         )
         self.current_tool = None
@@ -1175,9 +3227,12 @@ class MMU3:
             """)
             self.toolhead.wait_moves()
 
-        if not self.is_filament_in_switch_sensor():
+        # the retries are not needed if the filament is known to be at the
+        # filament switch sensor
+        if not self.bowden_load_triggered and not self.is_filament_in_switch_sensor():
             for _ in range(self.load_retry):
                 self.retry_load_filament_to_hotend()
+        self.bowden_load_triggered = False
 
         self.unselect_tool()
 
@@ -1257,9 +3312,9 @@ class MMU3:
             return True
 
         if self.current_tool is not None:
-            self.respond_debug(f"Tool T{self.current_tool} selected!")
+            self.respond_debug("Tool T%s selected!", self.current_tool)
             self.respond_debug("Auto unselecting it!")
-            self.respond_debug(f"Auto unselecting T{self.current_tool}")
+            self.respond_debug("Auto unselecting T%s", self.current_tool)
             self.unselect_tool()
 
         if not self.validate_extruder_is_hot_enough():
@@ -1287,10 +3342,97 @@ class MMU3:
         self.respond_debug("Filament removed")
         return True
 
+    def load_ramming_profile_library(self) -> dict[str, RammingProfile]:
+        """Load the ramming profiles per material from the profile library.
+
+        Raises:
+            ValueError: If the library is not valid.
+
+        Returns:
+            dict[str, RammingProfile]: The ramming profiles per material.
+        """
+        path = os.path.expanduser(self.ramming_profile_library)
+        with open(path) as f:
+            library = json.load(f)
+        if library.get("version") != 1:
+            raise ValueError(f"Unsupported library version: {library.get('version')}")
+
+        profiles = {}
+        for material, profile_id in library["materials"].items():
+            if profile_id not in library["profiles"]:
+                raise ValueError(f"Unknown profile {profile_id} for {material}")
+            profiles[material] = RammingProfile.from_gcode(
+                f"{material} ({profile_id})",
+                "\n".join(library["profiles"][profile_id]),
+            )
+        return profiles
+
+    def get_ramming_profile(self, slot: None | int) -> None | RammingProfile:
+        """Return the ramming profile for the material in the given slot.
+
+        Falls back to the default material of the library and then to the
+        native ramming macro profile.
+
+        Args:
+            slot (None | int): The slot id.
+
+        Returns:
+            None | RammingProfile: The ramming profile, None to run the macro.
+        """
+        if slot is not None and self.slot_materials[slot] in self.ramming_profiles:
+            return self.ramming_profiles[self.slot_materials[slot]]
+        return self.ramming_profiles.get("default", self.ramming_profile)
+
     def ramming_slicer(self) -> None:
         """Call the ramming process."""
-        self.gcode.run_script_from_command("RAMMING_SLICER")
+        start_time = time.process_time()
+        profile = self.get_ramming_profile(self.current_filament)
+        if profile is not None:
+            self.respond_debug("Ramming with %s", profile.name)
+            self.run_ramming_profile(profile)
+        else:
+            self.gcode.run_script_from_command(self.ramming_macro)
+        self.last_ramming_cpu_time = time.process_time() - start_time
+        self.respond_debug(
+            "Ramming took %0.2f ms of CPU time", self.last_ramming_cpu_time * 1000
+        )
+        self.toolhead.wait_moves()
+
+    def run_ramming_profile(self, profile: RammingProfile) -> None:
+        """Queue the ramming moves directly on the toolhead.
+
+        This skips the G-code macro rendering and parsing of the ramming
+        macro. The moves are relative extruder moves with the speeds given in
+        the profile, the speed factor is not applied.
+
+        Args:
+            profile (RammingProfile): The ramming profile to run.
+        """
+        speed = self.gcode_move.speed
+        position = self.toolhead.get_position()
+        for step in profile.steps:
+            if step[0] == "move":
+                if step[2] is not None:
+                    speed = step[2]
+                position[3] += step[1]
+                self.toolhead.move(position, speed)
+            elif step[0] == "dwell":
+                self.toolhead.dwell(step[1])
+            else:
+                self.gcode_move.reset_last_position()
+                self.gcode.run_script_from_command(step[1])
+                position = self.toolhead.get_position()
+        self.gcode_move.reset_last_position()
+
+    def cut_filament_in_extruder(self) -> bool:
+        """Cut the filament in the extruder with CUT_FILAMENT_IN_EXTRUDER.
+
+        Returns:
+            bool: True, always.
+        """
+        self.gcode.run_script_from_command("CUT_FILAMENT_IN_EXTRUDER")
         self.toolhead.wait_moves()
+        return True
 
     def eject_ramming(self) -> bool:
         """Eject the filament with ramming from the extruder nozzle to the MMU3.
@@ -1304,7 +3446,7 @@ class MMU3:
         if self.current_filament is None:
             return False
 
-        self.respond_debug(f"UT {self.current_filament} ...")
+        self.respond_debug("UT %s ...", self.current_filament)
         if not self.unload_filament_from_hotend_with_ramming():
             return False
         self.select_tool(self.current_filament)
@@ -1319,20 +3461,19 @@ class MMU3:
         if self.is_paused:
             return False
 
-        if not self.validate_extruder_is_hot_enough():
-            return False
-
         if self.current_tool is not None:
-            self.respond_debug(f"Tool T{self.current_tool} selected!")
+            self.respond_debug("Tool T%s selected!", self.current_tool)
             self.respond_debug("Auto unselecting it!")
-            self.respond_debug(f"Auto unselecting T{self.current_tool}")
+            self.respond_debug("Auto unselecting T%s", self.current_tool)
             self.unselect_tool()
 
+        if not self.validate_extruder_is_hot_enough():
+            return False
+
         self.respond_debug("Ramming and Unloading Filament...")
 
         if self.enable_filament_cutter:
-            self.gcode.run_script_from_command("CUT_FILAMENT_IN_EXTRUDER")
-            self.toolhead.wait_moves()
+            self.cut_filament_in_extruder()
         else:
             self.ramming_slicer()
 
@@ -1369,6 +3510,8 @@ class MMU3:
             self.bowden_load_speed1,
             self.bowden_load_accel1,
         )
+        # the filament is pulled out by hand to measure it
+        self.parked_tips.forget(self.current_tool)
         return True
 
     def pre_load_filament_to_finda(self, filament_id: int) -> bool:
@@ -1385,18 +3528,131 @@ class MMU3:
             self.display_status_msg(f"Invalid filament id: {filament_id}")
             return False
 
-        if filament_id == -1:
-            filament_ids = range(self.number_of_tools)
+        if filament_id != -1:
+            # an explicitly requested slot is always checked with FINDA
+            return self.select_tool(filament_id) and self.park_tip(confirm=True)
+
+        # bulk preload
+        filament_ids = [
+            fid for fid in range(self.number_of_tools) if not self.is_tip_parked(fid)
+        ]
+        durations = []
+        for fid in self.get_preload_order(filament_ids):
+            with self.tracer.span(f"preload T{fid}") as span:
+                span.ok = self.select_tool(fid) and self.park_tip()
+            if not span.ok:
+                return False
+            durations.append(f"T{fid} {span.duration:0.1f}s")
+        if durations:
+            self.respond_info(
+                "Preloaded %s slots: %s", len(durations), ", ".join(durations)
+            )
         else:
-            filament_ids = [filament_id]
+            self.respond_info("All slots are already parked behind FINDA")
+        return True
 
-        for fid in filament_ids:
-            self.select_tool(fid)
-            if not self.load_filament_to_finda():
-                return False
-            if not self.unload_filament_from_finda():
-                return False
+    def get_preload_order(self, slots: list[int]) -> list[int]:
+        """Order the slots to preload to minimize the idler and selector travel.
+
+        The slot positions are monotonic along both axes, so the fastest route
+        is a single sweep over the slots. Both sweep directions are estimated
+        from the current positions and the faster one is returned.
+
+        Args:
+            slots (list[int]): The slots to preload.
+
+        Returns:
+            list[int]: The slots in the preload order.
+        """
+        positions = (
+            self.idler_positions
+            if self.enable_no_selector_mode
+            else self.selector_positions
+        )
+        sweep = sorted(slots, key=lambda slot: positions[slot])
+        return min([sweep, sweep[::-1]], key=self.get_select_route_duration)
+
+    def get_select_route_duration(self, slots: list[int]) -> float:
+        """Estimate the idler and selector move time to select the given slots.
+
+        The idler and selector move concurrently, so every select takes as
+        long as the slower of the two moves.
+
+        Args:
+            slots (list[int]): The slots in the order they are selected.
+
+        Returns:
+            float: The estimated duration in seconds.
+        """
+        idler_position = self.idler_stepper.get_position()[0]
+        selector_position = self.selector_stepper.get_position()[0]
+        duration = 0.0
+        for slot in slots:
+            select_duration = get_move_duration(
+                self.idler_positions[slot] - idler_position,
+                self.idler_speed,
+                self.idler_accel,
+            )
+            idler_position = self.idler_positions[slot]
+            if not self.enable_no_selector_mode:
+                select_duration = max(
+                    select_duration,
+                    get_move_duration(
+                        self.selector_positions[slot] - selector_position,
+                        self.selector_speed,
+                        self.selector_accel,
+                    ),
+                )
+                selector_position = self.selector_positions[slot]
+            duration += select_duration
+        return duration
+
+    def is_tip_parked(self, slot: int) -> bool:
+        """Check if the filament tip of the slot is at the park position.
+
+        Args:
+            slot (int): The slot.
+
+        Returns:
+            bool: True if the tip is known to be finda_unload_length behind
+                FINDA.
+        """
+        position = self.parked_tips.get(slot)
+        return position is not None and math.isclose(
+            position, -self.finda_unload_length, abs_tol=0.1
+        )
 
+    def park_tip(self, confirm: bool = False) -> bool:
+        """Move the filament tip of the selected tool to the park position.
+
+        A tip known to be behind FINDA is moved there directly at
+        finda_approach_speed, otherwise the filament is loaded to FINDA and
+        unloaded from it.
+
+        Args:
+            confirm (bool): Always load the filament to FINDA and unload it
+                from it, so that FINDA confirms the tip position. A known tip
+                is still approached fast by the FINDA load.
+
+        Returns:
+            bool: True if the tip is parked, False otherwise.
+        """
+        if not confirm and self.is_tip_parked(self.current_tool):
+            return True
+        distance = self.parked_tips.get_distance_to_finda(self.current_tool)
+        if confirm or distance is None:
+            return self.load_filament_to_finda() and self.unload_filament_from_finda()
+
+        length = distance - self.finda_unload_length
+        self.respond_debug("Moving the parked tip %.1f mm", length)
+        self.pulley_stepper.do_set_position(0)
+        self.pulley_stepper.do_move(
+            length,
+            self.finda_approach_speed,
+            self.finda_approach_accel,
+        )
+        self.pulley_stepper.do_set_position(0)
+        self.parked_tips.move(self.current_tool, length)
         return True
 
     def load_filament_to_finda(self) -> bool:
@@ -1444,15 +3700,25 @@ class MMU3:
             return False
 
         self.respond_debug("Loading filament from FINDA to extruder ...")
+        # the tip leaves the MMU, it is found again when unloaded to FINDA
+        self.parked_tips.forget(self.current_tool)
+        if self.enable_no_selector_mode:
+            # there is no FINDA load to set the current filament
+            self.current_filament = self.current_tool
+        self.bowden_load_triggered = False
+        if self.enable_sensor_bowden_load:
+            return self.load_filament_from_finda_to_switch_sensor()
+
+        length1, length2 = self.get_bowden_load_lengths(self.current_tool)
         self.pulley_stepper.do_set_position(0)
         self.pulley_stepper.do_move(
-            self.bowden_load_length1,
+            length1,
             self.bowden_load_speed1,
             self.bowden_load_accel1,
         )
         self.pulley_stepper.do_set_position(0)
         self.pulley_stepper.do_move(
-            self.bowden_load_length2,
+            length2,
             self.bowden_load_speed2,
             self.bowden_load_accel2,
             sync=False,
@@ -1461,6 +3727,142 @@ class MMU3:
 
         return True
 
+    def get_learned_bowden_length(self, slot: None | int) -> None | float:
+        """Return the learned conservative length from FINDA to the extruder.
+
+        The FINDA to filament switch sensor length is preferred, the extruder to
+        FINDA unload length is used if the former is not learned yet.
+
+        Args:
+            slot (None | int): The slot.
+
+        Returns:
+            None | float: The learned length minus the safety margin and three
+                times the spread, None if it is not learned yet or the bowden
+                calibration is disabled.
+        """
+        if not self.enable_bowden_calibration:
+            return None
+        stats = self.bowden_calibration.get_stats(
+            "sensor_load", slot
+        ) or self.bowden_calibration.get_stats("finda_unload", slot)
+        if stats is None:
+            return None
+        median, spread = stats
+        return median - 3 * spread
+
+    def get_bowden_load_lengths(self, slot: None | int) -> tuple[float, float]:
+        """Return the fast and slow bowden load lengths for the given slot.
+
+        The learned length is used to end the slow move at most
+        bowden_calibration_margin past the expected trigger point, and to
+        start the slow move that much before it. The result never exceeds the
+        configured lengths.
+
+        Args:
+            slot (None | int): The slot.
+
+        Returns:
+            tuple[float, float]: The fast and the slow move lengths.
+        """
+        length1 = self.bowden_load_length1
+        length2 = self.bowden_load_length2
+        learned_length = self.get_learned_bowden_length(slot)
+        if learned_length is None:
+            return length1, length2
+
+        margin = self.bowden_calibration_margin
+        total = min(length1 + length2, learned_length + margin)
+        fast = max(0.0, min(length1, learned_length - margin))
+        return fast, max(0.0, total - fast)
+
+    def get_bowden_sensor_load_length(self, slot: None | int) -> float:
+        """Return the maximum sensor terminated bowden load length.
+
+        Args:
+            slot (None | int): The slot.
+
+        Returns:
+            float: The maximum length to move while waiting for the filament
+                switch sensor to trigger.
+        """
+        learned_length = self.get_learned_bowden_length(slot)
+        if learned_length is None:
+            return self.bowden_sensor_load_length
+        return min(
+            self.bowden_sensor_load_length,
+            learned_length + 2 * self.bowden_calibration_margin,
+        )
+
+    def get_bowden_unload_length(self, slot: None | int) -> float:
+        """Return the maximum bowden unload length for the given slot.
+
+        Args:
+            slot (None | int): The slot.
+
+        Returns:
+            float: The maximum length to move while waiting for FINDA to clear.
+        """
+        if not self.enable_bowden_calibration:
+            return self.bowden_unload_length
+        stats = self.bowden_calibration.get_stats("finda_unload", slot)
+        if stats is None:
+            return self.bowden_unload_length
+        median, spread = stats
+        return min(
+            self.bowden_unload_length,
+            median + 3 * spread + 2 * self.bowden_calibration_margin,
+        )
+
+    def load_filament_from_finda_to_switch_sensor(self) -> bool:
+        """Load from the FINDA until the filament switch sensor triggers.
+
+        This is a single homing move of the pulley stepper using the filament
+        switch sensor as the endstop.
+
+        Returns:
+            bool: True, if the filament switch sensor is triggered, False
+                otherwise.
+        """
+        self.pulley_stepper.do_set_position(0)
+        # manual_home accelerates with the homing_accel of the stepper
+        homing_accel = self.pulley_stepper.homing_accel
+        self.pulley_stepper.homing_accel = self.bowden_load_accel1
+        phoming = self.printer.lookup_object("homing")
+        length = self.get_bowden_sensor_load_length(self.current_tool)
+        try:
+            phoming.manual_home(
+                self.pulley_stepper,
+                [(self.filament_switch_sensor_endstop, "filament_switch_sensor")],
+                [length, 0.0, 0.0, 0.0],
+                self.bowden_load_speed1,
+                True,
+                False,
+            )
+        finally:
+            self.pulley_stepper.homing_accel = homing_accel
+        print_time = self.toolhead.get_last_move_time()
+        self.bowden_load_triggered = bool(
+            self.filament_switch_sensor_endstop.query_endstop(print_time)
+        )
+        trigger_position = self.pulley_stepper.get_position()[0]
+        self.pulley_stepper.do_set_position(0)
+
+        if not self.bowden_load_triggered:
+            self.display_status_msg(
+                "Filament switch sensor not triggered after "
+                f"{length:0.1f} mm!"
+            )
+            return False
+
+        self.respond_debug(
+            "Filament switch sensor triggered at %0.1f mm", trigger_position
+        )
+        self.bowden_calibration.add_sample(
+            "sensor_load", self.current_tool, trigger_position
+        )
+        return True
+
     def load_filament_to_extruder(self) -> bool:
         """Load from MMU3 to extruder gear by calling LOAD_FILAMENT_TO_FINDA.
 
@@ -1519,6 +3921,7 @@ class MMU3:
         self.pulley_stepper.do_set_position(0)
         if self.is_filament_in_finda():
             return False
+        self.parked_tips.move(self.current_tool, -self.finda_unload_length)
         self.current_filament = None
         self.respond_debug("Unloading done from FINDA")
         return True
@@ -1546,13 +3949,20 @@ class MMU3:
         self.pulley_stepper.do_set_position(0)
         if not self.enable_no_selector_mode:
             self.pulley_stepper.do_homing_move(
-                movepos=-self.bowden_unload_length,
+                movepos=-self.get_bowden_unload_length(self.current_tool),
                 speed=self.bowden_unload_speed,
                 accel=self.bowden_unload_accel,
                 probe_pos=False,
                 triggered=False,
                 check_trigger=False,
             )
+            if not self.is_filament_in_finda():
+                self.parked_tips.set(self.current_tool, 0)
+                self.bowden_calibration.add_sample(
+                    "finda_unload",
+                    self.current_tool,
+                    self.pulley_stepper.get_position()[0],
+                )
 
             # if the filament sensor is pre-gears, check if we were able to
             # pull the filament out.
@@ -1578,6 +3988,8 @@ class MMU3:
                 self.bowden_unload_speed,
                 self.bowden_unload_accel,
             )
+            # there is no FINDA unload to clear the current filament
+            self.current_filament = None
         self.respond_debug("Done unloading from FINDA!")
         return True
 
@@ -1605,8 +4017,9 @@ class MMU3:
             # check endstop status and exit from the loop
             if not self.is_filament_in_finda():
                 self.respond_debug("FINDA endstop triggered. Exiting filament unload.")
+                self.parked_tips.set(self.current_tool, 0)
                 return True
-            self.respond_debug(f"FINDA endstop not triggered. Retrying... {i + 1}")
+            self.respond_debug("FINDA endstop not triggered. Retrying... %s", i + 1)
         self.display_status_msg(
             f"Couldn't unload filament to FINDA after {self.finda_unload_retry} tries!"
         )
@@ -1670,7 +4083,7 @@ class MMU3:
             self.display_status_msg("Not supported in 5in1 mode!")
             return False
 
-        self.respond_debug(f"Cutting filament T{tool_id} ...")
+        self.respond_debug("Cutting filament T%s ...", tool_id)
 
         # First unload filament
         if not self.unload_tool():
@@ -1681,28 +4094,30 @@ class MMU3:
         if not self.select_tool(tool_id):
             return False
 
-        # Feed to FINDA
-        if not self.load_filament_to_finda():
-            return False
-
-        # Unload filament from FINDA
-        if not self.unload_filament_from_finda():
+        # Feed to FINDA and unload from it, the cut length is measured from
+        # the park position, so it is always confirmed by FINDA
+        if not self.park_tip(confirm=True):
             return False
 
         # Prepare blade
         # - move the idler to the current tool position,
         #   to keep the filament tight in place.
-        # - move the selector to the 0 position
-        self.idler_stepper.do_move(
-            self.idler_positions[tool_id],
-            self.idler_homing_speed,
-            self.idler_homing_accel,
-        )
-        # move the selector to 0 position or close to 0
-        self.selector_stepper.do_move(
-            5,
-            self.selector_speed,
-            self.selector_accel,
+        # - move the selector to 0 position or close to 0
+        self.motion_coordinator.move(
+            [
+                (
+                    self.idler_stepper,
+                    self.idler_positions[tool_id],
+                    self.idler_homing_speed,
+                    self.idler_homing_accel,
+                ),
+                (
+                    self.selector_stepper,
+                    5,
+                    self.selector_speed,
+                    self.selector_accel,
+                ),
+            ]
         )
 
         # Push filament
@@ -1712,6 +4127,9 @@ class MMU3:
             self.pulley_stepper.velocity,
             self.pulley_stepper.accel,
         )
+        self.parked_tips.move(
+            tool_id, self.cut_filament_length + self.cutting_edge_retract
+        )
 
         # Unlock the selector
         # Perform the cut by moving to the current slot
@@ -1741,6 +4159,9 @@ class MMU3:
             SET_TMC_CURRENT STEPPER={stepper_name} CURRENT=0.580
         """)
 
+        # the cut piece is gone
+        self.parked_tips.move(tool_id, -self.cut_filament_length)
+
         # Pull filament back from the cutting edge
         self.pulley_stepper.do_set_position(0)
         self.pulley_stepper.do_move(
@@ -1748,11 +4169,14 @@ class MMU3:
             self.pulley_stepper.velocity,
             self.pulley_stepper.accel,
         )
+        self.parked_tips.move(tool_id, -self.cutting_edge_retract)
 
-        # Home the mmu
-        self.home_mmu()
+        # the cut pushes the selector through the filament with the stall
+        # detection disabled, verify its position and home only if needed
+        self.check_homing(verify=True)
+        self.unselect_tool()
 
-        self.respond_debug(f"Done cutting T{tool_id}!")
+        self.respond_debug("Done cutting T%s!", tool_id)
         return True
 
     def load_tool(self, tool_id: int) -> bool:
@@ -1767,19 +4191,85 @@ class MMU3:
         if self.is_paused:
             return False
 
-        if not self.validate_extruder_is_hot_enough():
+        if self.enable_deferred_heating:
+            # the cold-safe phases run while heating, the heater is waited
+            # for before the hotend load
+            self.start_heating(tool_id)
+        elif not self.validate_extruder_is_hot_enough():
             return False
 
-        self.respond_debug(f"LT {tool_id}")
-        if not self.select_tool(tool_id):
-            return False
-        if not self.load_filament_to_extruder():
-            return False
-        return self.load_filament_to_hotend()
+        self.respond_debug("LT %s", tool_id)
+        with self.tracer.span(f"load T{tool_id}") as span:
+            span.ok = self.tool_change_executor.run(self.get_load_phases(tool_id))
+        return span.ok
 
-    def unload_tool(self) -> bool:
+    def get_load_phases(self, tool_id: int) -> list[ToolChangePhase]:
+        """Return the phases to load the given tool from MMU3 to nozzle.
+
+        Args:
+            tool_id (int): The tool id.
+
+        Returns:
+            list[ToolChangePhase]: The load phases.
+        """
+        phases = [
+            ToolChangePhase(
+                "select",
+                {ToolChangeResource.Idler, ToolChangeResource.Selector},
+                partial(self.select_tool, tool_id),
+                blocking=False,
+            ),
+        ]
+        if not self.enable_no_selector_mode:
+            phases.append(
+                ToolChangePhase(
+                    "finda_load",
+                    {ToolChangeResource.Pulley},
+                    self.load_filament_to_finda,
+                    depends_on=["select"],
+                )
+            )
+        phases += [
+            ToolChangePhase(
+                "bowden_load",
+                {ToolChangeResource.Pulley},
+                self.load_filament_from_finda_to_extruder,
+                depends_on=["select", "finda_load"],
+                blocking=self.enable_sensor_bowden_load,
+            ),
+        ]
+        if self.enable_deferred_heating or self.get_slot_temperature(tool_id):
+            # wait for the heater while the bowden load moves are running
+            phases.append(
+                ToolChangePhase(
+                    "heater_wait",
+                    {ToolChangeResource.Heater},
+                    partial(self.wait_for_heater, tool_id),
+                    depends_on=["bowden_load"],
+                )
+            )
+        phases += [
+            ToolChangePhase(
+                "hotend_load",
+                {
+                    ToolChangeResource.Pulley,
+                    ToolChangeResource.Extruder,
+                    ToolChangeResource.Heater,
+                    ToolChangeResource.Idler,
+                },
+                self.load_filament_to_hotend,
+                depends_on=["bowden_load"],
+            ),
+        ]
+        return phases
+
+    def unload_tool(self, next_slot: None | int = None) -> bool:
         """Unload filament from nozzle to MMU3.
 
+        Args:
+            next_slot (None | int): The slot that is loaded next, the heater is
+                moved to its temperature during the unload. Defaults to None.
+
         Returns:
             bool: True, if tool is unloaded, False otherwise.
         """
@@ -1795,10 +4285,10 @@ class MMU3:
                     self.respond_debug("Current Tool is also None!")
                     self.respond_debug("Cancelling unload!!!")
                     return False
-                self.respond_debug(f"Current Tool is {self.current_tool}")
+                self.respond_debug("Current Tool is %s", self.current_tool)
                 self.current_filament = self.current_tool
                 self.respond_debug(
-                    f"Also setting Current filament to {self.current_filament}"
+                    "Also setting Current filament to %s", self.current_filament
                 )
                 return True
             # filament is not in FINDA
@@ -1806,18 +4296,84 @@ class MMU3:
             self.respond_debug("No need to unload!")
             return True
 
-        if self.enable_filament_cutter and self.is_filament_in_switch_sensor():
-            self.respond_debug(f"Cut T{self.current_filament}")
-            # cut the filament in extruder
-            self.gcode.run_script_from_command("CUT_FILAMENT_IN_EXTRUDER")
-            self.toolhead.wait_moves()
+        self.respond_debug("UT %s", self.current_filament)
+        if self.enable_deferred_heating and self.is_filament_in_switch_sensor():
+            # the hotend unload waits for the heater
+            self.start_heating()
+        with self.tracer.span(f"unload T{self.current_filament}") as span:
+            span.ok = self.tool_change_executor.run(
+                self.get_unload_phases(next_slot)
+            )
+        return span.ok
 
-        self.respond_debug(f"UT {self.current_filament}")
-        if not self.unload_filament_from_hotend():
-            return False
-        if not self.select_tool(self.current_filament):
-            return False
-        return self.unload_filament_from_extruder()
+    def get_unload_phases(self, next_slot: None | int = None) -> list[ToolChangePhase]:
+        """Return the phases to unload the current filament from nozzle to MMU3.
+
+        Args:
+            next_slot (None | int): The slot that is loaded next. Defaults to
+                None.
+
+        Returns:
+            list[ToolChangePhase]: The unload phases.
+        """
+        filament_id = self.current_filament
+        phases = []
+        if self.enable_filament_cutter and self.is_filament_in_switch_sensor():
+            self.respond_debug("Cut T%s", filament_id)
+            phases.append(
+                ToolChangePhase(
+                    "ramming_cut",
+                    {ToolChangeResource.Extruder, ToolChangeResource.Heater},
+                    self.cut_filament_in_extruder,
+                )
+            )
+        if next_slot is not None and self.get_slot_temperature(next_slot):
+            # the old temperature is not needed after the ramming or the cut,
+            # M104 doesn't queue any moves, so it doesn't lock any resources
+            phases.append(
+                ToolChangePhase(
+                    "heater",
+                    set(),
+                    partial(self.start_heating, next_slot),
+                    depends_on=["ramming_cut"],
+                    blocking=False,
+                )
+            )
+        phases += [
+            ToolChangePhase(
+                "hotend_unload",
+                {
+                    ToolChangeResource.Extruder,
+                    ToolChangeResource.Heater,
+                    ToolChangeResource.Idler,
+                },
+                self.unload_filament_from_hotend,
+                depends_on=["ramming_cut"],
+            ),
+            ToolChangePhase(
+                "select",
+                {ToolChangeResource.Idler, ToolChangeResource.Selector},
+                partial(self.select_tool, filament_id),
+                depends_on=["hotend_unload"],
+                blocking=False,
+            ),
+            ToolChangePhase(
+                "bowden_unload",
+                {ToolChangeResource.Pulley, ToolChangeResource.Extruder},
+                self.unload_filament_from_extruder_to_finda,
+                depends_on=["select"],
+            ),
+        ]
+        if not self.enable_no_selector_mode:
+            phases.append(
+                ToolChangePhase(
+                    "finda_park",
+                    {ToolChangeResource.Pulley},
+                    self.unload_filament_from_finda,
+                    depends_on=["bowden_unload"],
+                )
+            )
+        return phases
 
     def eject_from_extruder(self) -> bool:
         """Preheat the heater if needed and unload the filament with ramming.
@@ -1838,7 +4394,11 @@ class MMU3:
         self.respond_debug("Filament in hotend, trying to eject it ...")
         self.respond_debug("Preheat Nozzle")
         min_temp = max(self.get_extruder_temperature(), self.extruder_eject_temp)
-        self.gcode.run_script_from_command(f"M109 S{min_temp}")
+        if self.enable_deferred_heating:
+            # the ramming waits for the heater, after unselecting the tool
+            self.gcode.run_script_from_command(f"M104 S{min_temp}")
+        else:
+            self.gcode.run_script_from_command(f"M109 S{min_temp}")
         return self.unload_filament_from_hotend_with_ramming()
 
     def eject_before_home(self) -> None:
@@ -1877,21 +4437,22 @@ class MMU3:
         Returns:
             bool: True if command completed successfully, False otherwise.
         """
-        # Query the endstops
-        print_time = self.toolhead.get_last_move_time()
-
         # Report results
         self.respond_info("Endstop status")
         self.respond_info("==============")
         self.respond_info(f"Extruder : {self.is_filament_in_switch_sensor()}")
         self.respond_info(
-            f"{STEPPER_NAME_MAP[PULLEY_STEPPER_NAME]} : "
-            f"{self.pulley_stepper_endstop.query_endstop(print_time)}"
+            f"{STEPPER_NAME_MAP[PULLEY_STEPPER_NAME]} : {self.is_filament_in_finda()}"
         )
         self.respond_info(
             f"{STEPPER_NAME_MAP[SELECTOR_STEPPER_NAME]} : "
-            f"{self.selector_stepper_endstop.query_endstop(print_time)}"
+            f"{self.is_selector_endstop_triggered()}"
         )
+        for cache in [self.finda_state, self.selector_endstop_state]:
+            self.respond_info(
+                f"{cache.name} cache: {cache.number_of_cached_reads} cached reads, "
+                f"{cache.number_of_queries} queries, {cache.number_of_events} events"
+            )
 
         return True
 
@@ -1915,7 +4476,9 @@ class MMU3:
         """Home the MMU.
 
         Eject filament if loaded with EJECT_BEFORE_HOME
-        next home the mmu with HOME_MMU_ONLY
+        next home the mmu with HOME_MMU_ONLY. The first HOME_MMU after a
+        restart is skipped if the state is restored from the state file,
+        unless FORCE=1 is given.
 
         Args:
             gcmd (GcodeCommand): The G-code command.
@@ -1923,6 +4486,14 @@ class MMU3:
         Returns:
             bool: True if command completed successfully, False otherwise.
         """
+        restored = self.state_restored
+        self.state_restored = False
+        if restored and self.is_homed and not gcmd.get_int("FORCE", 0):
+            self.respond_info(
+                "MMU state restored from the state file, skipping the homing, "
+                "use HOME_MMU FORCE=1 to home anyway"
+            )
+            return True
         return self.home_mmu()
 
     @auto_pause
@@ -1994,22 +4565,26 @@ class MMU3:
 
         Args:
             gcmd (GCodeCommand): The G-code command.
-            tool_id (int, optional): The tool id to load. Defaults to 0.
+            tool_id (int, optional): The tool id to load, it is mapped to a slot
+                with the tool_mapping. Defaults to 0.
 
         Returns:
             bool: True if command completed successfully, False otherwise.
         """
+        slot = self.get_mapped_tool_id(tool_id)
         previous_filament = self.current_filament
 
         if previous_filament is not None:
-            status_message = f"T{previous_filament} => T{tool_id}"
+            previous_tool = self.get_slot_name(previous_filament)
+            status_message = f"{previous_tool} => T{tool_id}"
         else:
             status_message = f"T{tool_id}"
         self.display_status_msg(status_message)
 
-        if self.current_filament == tool_id:
+        if self.current_filament == slot:
             return True
 
+        self.number_of_material_changes += 1
         with (
             FilamentSwitchSensorManager(
                 self.filament_switch_sensor,
@@ -2017,6 +4592,7 @@ class MMU3:
                 self.respond_debug,
                 self.reactor,
                 self.toolhead,
+                self.sensor_scheduler,
             ),
             FilamentMotionSensorManager(
                 self.filament_motion_sensor,
@@ -2024,6 +4600,7 @@ class MMU3:
                 self.respond_debug,
                 self.reactor,
                 self.toolhead,
+                self.sensor_scheduler,
             ),
         ):
             for i in range(self.tool_change_retry):
@@ -2031,64 +4608,43 @@ class MMU3:
                     self.display_status_msg(f"Retry ({i + 1}): T{tool_id}...")
 
                 if i in range(1, self.tool_change_retry - 1):
-                    # on last try we'll home the mmu
-                    self.home_idler()
-
-                if not self.unload_tool():
-                    self.respond_debug(f"Unload T{self.current_filament} failed!")
+                    # the failed attempt may have been caused by a lost idler
+                    self.homing_confidence.add_stall("idler")
+                    self.check_homing(verify=True)
+
+                if not self.unload_tool(next_slot=slot):
+                    self.respond_debug(
+                        "Unload of slot %s failed!", self.current_filament
+                    )
                     continue
 
                 # if this is the last try, do a homing move as a last resort
                 if i == self.tool_change_retry - 1:
                     self.home_mmu()
 
-                if not self.load_tool(tool_id):
-                    self.respond_debug(f"Load T{tool_id} failed!")
+                if not self.load_tool(slot):
+                    self.respond_debug("Load T%s failed!", tool_id)
                     continue
                 break
             else:
                 # so the load did not happen...
                 if previous_filament is not None:
-                    error_message = f"T{previous_filament} => T{tool_id} failed!"
+                    error_message = f"{previous_tool} => T{tool_id} failed!"
                 else:
                     error_message = f"T{tool_id} failed!"
                 self.respond_debug(error_message)
+                self.number_of_fails += 1
 
                 # display a prompt in Mainsail UI
-                prompt = Prompt(
-                    headline="MMU Error",
-                    widgets=[
-                        Text(text=error_message),
-                        # Add possible commands,
-                        ButtonGroup(
-                            buttons=[
-                                Button(label="Unlock MMU", gcode="UNLOCK_MMU"),
-                                Button(label="Unload Tool", gcode="UT"),
-                            ],
-                        ),
-                        ButtonGroup(
-                            buttons=[
-                                Button(label="Home MMU", gcode="HOME_MMU"),
-                                Button(
-                                    label=f"Retry T{tool_id}",
-                                    gcode="PROMPT_CLOSE_AND_RUN_COMMAND "
-                                    f"COMMAND=T{tool_id}",
-                                ),
-                            ],
-                        ),
-                        FooterButton(
-                            label="Resume",
-                            gcode="PROMPT_CLOSE_AND_RUN_COMMAND COMMAND=RESUME",
-                        ),
-                    ],
-                )
-                self.gcode.run_script_from_command(prompt.to_gcode())
+                prompt = get_tool_change_error_prompt(error_message, tool_id)
+                prompt.respond(self.gcode.respond_raw)
                 return False
 
+        self.number_of_successful_material_changes += 1
         if previous_filament is not None:
-            self.respond_debug(f"Done T{previous_filament} => T{tool_id}")
+            self.respond_debug("Done %s => T%s", previous_tool, tool_id)
         else:
-            self.respond_debug(f"Done T{tool_id}")
+            self.respond_debug("Done T%s", tool_id)
         return True
 
     @auto_pause
@@ -2098,7 +4654,8 @@ class MMU3:
 
         Args:
             gcmd (GCodeCommand): The G-code command.
-            tool_id (int, optional): The tool id to cut. Defaults to 0.
+            tool_id (int, optional): The slot to cut, K<n> is not mapped with
+                the tool_mapping. Defaults to 0.
 
         Returns:
             bool: True if command completed successfully, False otherwise.
@@ -2148,6 +4705,7 @@ class MMU3:
                 self.respond_debug,
                 self.reactor,
                 self.toolhead,
+                self.sensor_scheduler,
             ),
             FilamentMotionSensorManager(
                 self.filament_motion_sensor,
@@ -2155,6 +4713,7 @@ class MMU3:
                 self.respond_debug,
                 self.reactor,
                 self.toolhead,
+                self.sensor_scheduler,
             ),
         ):
             return self.unload_tool()
@@ -2440,6 +4999,7 @@ class MMU3:
         return self.pulley_calibrate()
 
     @auto_pause
+    @measure_duration
     @auto_disable_steppers
     def cmd_preload_filament_to_finda(self, gcmd: GCodeCommand) -> bool:
         """Preload filament to finda.
@@ -2453,6 +5013,213 @@ class MMU3:
         filament_id: int = gcmd.get_int("VALUE", -1)
         return self.pre_load_filament_to_finda(filament_id)
 
+    def cmd_bowden_calibration(self, gcmd: GCodeCommand) -> bool:
+        """Show, reset, freeze or unfreeze the learned bowden lengths.
+
+        Args:
+            gcmd (GCodeCommand): The G-Code command.
+
+        Returns:
+            bool: True if command completed successfully, False otherwise.
+        """
+        action = gcmd.get("ACTION", "SHOW").upper()
+        slot = gcmd.get_int(
+            "SLOT", None, minval=0, maxval=self.number_of_tools - 1
+        )
+        if action == "RESET":
+            self.bowden_calibration.reset(slot)
+        elif action == "FREEZE":
+            self.bowden_calibration.frozen = True
+        elif action == "UNFREEZE":
+            self.bowden_calibration.frozen = False
+        elif action != "SHOW":
+            self.respond_info(f"Unknown action: {action}")
+            return False
+
+        self.respond_info(
+            "Bowden calibration"
+            + (" (frozen)" if self.bowden_calibration.frozen else "")
+        )
+        slots = range(self.number_of_tools) if slot is None else [slot]
+        for s in slots:
+            values = []
+            for kind in BowdenCalibration.KINDS:
+                stats = self.bowden_calibration.get_stats(kind, s)
+                count = len(self.bowden_calibration.samples[kind][s])
+                if stats is None:
+                    values.append(f"{kind}: - ({count})")
+                else:
+                    values.append(
+                        f"{kind}: {stats[0]:0.1f} +/- {stats[1]:0.1f} ({count})"
+                    )
+            length1, length2 = self.get_bowden_load_lengths(s)
+            self.respond_info(
+                f"Slot {s}: {', '.join(values)}, "
+                f"load: {length1:0.1f} + {length2:0.1f}"
+            )
+        return True
+
+    def cmd_ramming_profile(self, gcmd: GCodeCommand) -> bool:
+        """Reload the ramming profile library or set the material of a slot.
+
+        Args:
+            gcmd (GCodeCommand): The G-Code command.
+
+        Returns:
+            bool: True if command completed successfully, False otherwise.
+        """
+        if gcmd.get_int("RELOAD", 0):
+            if not self.ramming_profile_library:
+                self.respond_info("No ramming_profile_library configured")
+                return False
+            try:
+                self.ramming_profiles = self.load_ramming_profile_library()
+            except (OSError, ValueError) as e:
+                self.respond_info(f"Can not load ramming profile library: {e}")
+                return False
+
+        slot = gcmd.get_int(
+            "SLOT", None, minval=0, maxval=self.number_of_tools - 1
+        )
+        material = gcmd.get("MATERIAL", None)
+        if material is not None:
+            if slot is None:
+                self.respond_info("MATERIAL requires SLOT")
+                return False
+            self.slot_materials[slot] = material
+
+        self.respond_info(f"{len(self.ramming_profiles)} ramming profiles loaded")
+        for s in range(self.number_of_tools):
+            profile = self.get_ramming_profile(s)
+            self.respond_info(
+                f"Slot {s}: {self.slot_materials[s]}, "
+                f"profile: {profile.name if profile else self.ramming_macro}"
+            )
+        return True
+
+    def cmd_slot_temperature(self, gcmd: GCodeCommand) -> bool:
+        """Report the slot temperatures or set the temperature of a slot.
+
+        Args:
+            gcmd (GCodeCommand): The G-Code command.
+
+        Returns:
+            bool: True if command completed successfully, False otherwise.
+        """
+        slot = gcmd.get_int(
+            "SLOT", None, minval=0, maxval=self.number_of_tools - 1
+        )
+        temp = gcmd.get_float("TEMP", None, minval=0)
+        if temp is not None:
+            if slot is None:
+                self.respond_info("TEMP requires SLOT")
+                return False
+            if temp and temp < self.min_temp_extruder:
+                self.respond_info(
+                    f"TEMP needs to be 0 or at least {self.min_temp_extruder}"
+                )
+                return False
+            self.slot_temperatures[slot] = temp
+
+        for s in range(self.number_of_tools):
+            temp = self.get_slot_temperature(s)
+            self.respond_info(f"Slot {s}: {f'{temp:0.0f}' if temp else 'not set'}")
+        return True
+
+    def cmd_homing_confidence(self, gcmd: GCodeCommand) -> bool:
+        """Report the idler and selector position confidence or record a stall.
+
+        Args:
+            gcmd (GCodeCommand): The G-Code command.
+
+        Returns:
+            bool: True if command completed successfully, False otherwise.
+        """
+        stall = gcmd.get("STALL", None)
+        if stall is not None:
+            if stall not in HomingConfidence.AXES:
+                self.respond_info(f"Unknown axis: {stall}")
+                return False
+            self.homing_confidence.add_stall(stall)
+
+        confidence = self.homing_confidence
+        for axis in HomingConfidence.AXES:
+            state = (
+                "lost"
+                if confidence.is_lost(axis)
+                else "verify"
+                if confidence.needs_verification(axis)
+                else "ok"
+            )
+            self.respond_info(
+                f"{axis}: {state}, travel: {confidence.travel[axis]:0.1f}, "
+                f"stalls: {confidence.stalls[axis]}"
+            )
+        self.respond_info(
+            f"Homes skipped: {self.number_of_homes_skipped}, "
+            f"verification failures: {self.number_of_verification_failures}"
+        )
+        return True
+
+    def cmd_dump_log(self, gcmd: GCodeCommand) -> bool:
+        """Write the debug log to the Klipper log and optionally the console.
+
+        Args:
+            gcmd (GCodeCommand): The G-Code command.
+
+        Returns:
+            bool: True if command completed successfully, False otherwise.
+        """
+        self.dump_log(console=bool(gcmd.get_int("CONSOLE", 0)))
+        if gcmd.get_int("CLEAR", 0):
+            self.debug_log.records.clear()
+        return True
+
+    def cmd_trace(self, gcmd: GCodeCommand) -> bool:
+        """Report the recent traces with the durations of their phases.
+
+        Args:
+            gcmd (GCodeCommand): The G-Code command.
+
+        Returns:
+            bool: True if command completed successfully, False otherwise.
+        """
+        if gcmd.get_int("CLEAR", 0):
+            self.tracer.traces.clear()
+            self.respond_info("Traces cleared")
+            return True
+
+        count = gcmd.get_int("COUNT", 1, minval=1)
+        traces = list(self.tracer.traces)[-count:]
+        if not traces:
+            self.respond_info("No traces recorded")
+            return True
+
+        for trace in traces:
+            self.respond_info("\n".join(trace.format()))
+        return True
+
+    def cmd_lookahead(self, gcmd: GCodeCommand) -> bool:
+        """Report the next tool change in the printed file.
+
+        Args:
+            gcmd (GCodeCommand): The G-Code command.
+
+        Returns:
+            bool: True if command completed successfully, False otherwise.
+        """
+        if self.lookahead.next_tool is None:
+            self.respond_info("No upcoming tool change found")
+            return True
+
+        eta = self.lookahead.next_tool_eta
+        self.respond_info(
+            f"Next tool change: T{self.lookahead.next_tool} in "
+            f"{self.lookahead.next_tool_distance} bytes"
+            + (f", ~{eta:0.0f} seconds" if eta is not None else "")
+        )
+        return True
+
     def cmd_get_mmu_param(self, gcmd: GCodeCommand) -> bool:
         """Get any of the MMU parameters/attributes.
 
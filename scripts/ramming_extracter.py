@@ -1,137 +1,237 @@
-"""Extract ramming sequence from the given gcode."""
-import re
+"""Extract ramming sequences from slicer G-code into a ramming profile library.
 
-RAMMING_TEST_GCODE = """
-M104 S200
-HOME_MMU
-T0
-G92 E0
-G1 E70 F600
-EJECT_BEFORE_HOME
-UNLOCK_MMU
-M104 S200
-"""
+The slicer output files are streamed, every wipe tower tool change unload
+block is extracted along with the material it unloads, converted to relative
+extruder-only moves and de-duplicated. The result is written as a JSON
+profile library that MMU3 loads with the ``ramming_profile_library`` option::
+
+    python ramming_extracter.py print1.gcode print2.gcode -o ramming.json
+
+The library looks like this::
 
-GCODE_SEQUENCE = """
-SET_PRESSURE_ADVANCE ADVANCE=0
-G1  X143.396  E2.1091
-G1 F1052
-G1  X146.403  E0.1518
-G1  Y144.240  F7200
-G1 F1052
-G1  X145.026  E0.0695
-G1 F1180
-G1  X140.111  E0.2481
-G1 F1451
-G1  X134.067  E0.3051
-G1 F1769
-G1  X126.694  E0.3722
-G1 F1993
-G1  X118.392  E0.4191
-G1 F2248
-G1  X109.026  E0.4728
-G1 F2758
-G1  X97.536  E0.5800
-G1 F3379
-G1  X87.903  E0.4862
-G1  Y145.020  F7200
-G1 F3379
-G1  X92.352  E0.2246
-G1 F3730
-G1  X107.894  E0.7846
-G1 F3842
-G1  X123.901  E0.8080
-G1 F4161
-G1  X141.237  E0.8751
-G1 F4750
-G1  X146.403  E0.2608
-G1  Y145.800  F7200
-G1 F4750
-G1  X131.776  E0.7384
-G1 F5165
-G1  X110.255  E1.0863
-G1 F5245
-G1  X88.403  E1.1031
-;WIDTH:0.5
-; Ramming start
-; Retract(unload)
-G1 E-15.0000 F1500
-G1 E-7.7000 F600
-G1 E-2.2000 F300
-G1 E-1.1000 F180
-G4 S0
-M104 S215
-; Cooling
-G1  Y146.580
-G1  X146.403  E5.0000 F696
-G1  X88.403  E-5.0000
-G1  X108.403  E11.5000 F1043
-G1  X88.403  E5.0000 F2400
-G1 E-16.5000 F600
-G1  X146.403  E5.0000 F696
-G1  X88.403  E-5.0000
-G1  X108.403  E11.5000 F1043
-G1  X88.403  E5.0000 F2400
-G1 E-16.5000 F600
-G1  X146.403  E5.0000 F696
-G1  X88.403  E-5.0000
-G1  X108.403  E11.5000 F1043
-G1  X88.403  E5.0000 F2400
-G1 E-16.5000 F600
-G1  X146.403  E5.0000 F696
-G1  X88.403  E-5.0000
-; Cooling park
-G4 S3.000
-G1 E-2.0000 F2000
-M73 P1 R623
-; Ramming end
-G1  Y146.440  F2400
-G4 S0
-G1 E-2 F5100
-; filament end gcode
+    {
+        "version": 1,
+        "profiles": {"<profile id>": ["G1 E2.1091 F1052", ...]},
+        "materials": {"PLA": "<profile id>"}
+    }
+
+Use ``--print-macro`` to print the profiles as ``RAMMING_SLICER`` macro bodies
+instead, to be pasted into ``mmu3.cfg``.
 """
 
+from __future__ import annotations
+
+import argparse
+import collections
+import hashlib
+import json
+import os
+import re
+import sys
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
+LIBRARY_VERSION = 1
+
+BLOCK_START = "; CP TOOLCHANGE START"
+UNLOAD_START = "; CP TOOLCHANGE UNLOAD"
+BLOCK_ENDS = ("; filament end gcode", "; CP TOOLCHANGE WIPE", "; CP TOOLCHANGE END")
+
+MATERIAL_REGEX = re.compile(r";\s*material\s*:\s*(\S+)\s*->\s*(\S+)")
+TOOL_CHANGE_REGEX = re.compile(r"T\d+\s*(;.*)?$")
+FEEDRATE_REGEX = re.compile(r"\bF([0-9.]+)")
+G1_XY_E_REGEX = re.compile(r"G1\s+(?:[XY][0-9.\-]+\s+)+(E[0-9.\-]+)")
+G1_E_REGEX = re.compile(r"G1\s+(E[0-9.\-]+)")
+
+MACRO_HEADER = """    G91
+    G92 E0
+    M220 S100"""
+
+
+def iter_ramming_blocks(lines: Iterable[str]) -> Iterator[tuple[str, list[str]]]:
+    """Extract the ramming blocks from the given G-code lines.
 
-def main():
-    ramming_buffer = []
-    g1_regex = re.compile(r"(G1  X)([0-9.\-\s]+)(E[0-9.\-]+)([\sF0-9]*)")
-    g1_f_regex = re.compile(r"(G1 )([\sF0-9]*)")
-    for line in GCODE_SEQUENCE.split("\n"):
-        if (
-            line.startswith(("SET_PRESSURE_ADVANCE", ";", "G1 F", "G1 E", "G4", "G91"))
+    Args:
+        lines (Iterable[str]): The G-code lines.
+
+    Yields:
+        tuple[str, list[str]]: The material being unloaded and the normalized
+            ramming G-code lines.
+    """
+    feedrate = None
+    material = "default"
+    block = None
+    for raw_line in lines:
+        line = raw_line.strip()
+        if not line:
+            continue
+
+        if line.startswith(BLOCK_START):
+            material = "default"
+            continue
+
+        if m := MATERIAL_REGEX.match(line):
+            material = m.group(1)
+            continue
+
+        if line.startswith(UNLOAD_START):
+            block = []
+            continue
+
+        if block is not None and (
+            line.startswith(BLOCK_ENDS) or TOOL_CHANGE_REGEX.match(line)
         ):
-            ramming_buffer.append(line)
-        elif line.startswith("G1  Y") or line.startswith("M73 "):
+            if block:
+                yield material, block
+            block = None
+
+        # keep track of the feedrate, so that every ramming move has one
+        if line.startswith(("G0", "G1")) and (m := FEEDRATE_REGEX.search(line)):
+            feedrate = m.group(1)
+
+        if block is None:
             continue
-        elif m:=g1_regex.match(line):
-            ramming_buffer.append(f"G1 {m.groups()[2]}{m.groups()[3]}")
-
-    # join G1 F's with next line
-    for i, line in enumerate(ramming_buffer):
-        if line.startswith("G1 F"):
-            # join with the next line
-            m = g1_f_regex.match(line)
-            speed = m.groups()[1] if m else ""
-            ramming_buffer[i] = ""
-            ramming_buffer[i + 1] = f"{ramming_buffer[i + 1]} {speed}"
-
-    # remove empty lines
-    ramming_buffer = (
-        """    G91
-    G92 E0
-    ;TYPE:Prime tower
-    ;WIDTH:0.5
-    ;--------------------
-    ; CP TOOLCHANGE START
-    M220 S100
-    ; CP TOOLCHANGE UNLOAD
-    ;WIDTH:0.65""".split("\n") +
-    [f"    {line}" for line in ramming_buffer if line.strip()]
+        if line.startswith("SET_PRESSURE_ADVANCE"):
+            block.append(line)
+        elif line.startswith("G4"):
+            block.append(line.split(";", 1)[0].strip())
+        elif (m := G1_XY_E_REGEX.match(line)) or (m := G1_E_REGEX.match(line)):
+            move = f"G1 {m.group(1)}"
+            block.append(f"{move} F{feedrate}" if feedrate else move)
+
+
+def get_profile_id(profile: list[str]) -> str:
+    """Return a stable id for the given profile.
+
+    Args:
+        profile (list[str]): The normalized ramming G-code lines.
+
+    Returns:
+        str: The profile id.
+    """
+    return hashlib.sha1("\n".join(profile).encode()).hexdigest()[:12]  # noqa: S324
+
+
+def build_library(
+    blocks: Iterable[tuple[str, list[str]]], library: None | dict = None
+) -> dict:
+    """Build a de-duplicated profile library from the given ramming blocks.
+
+    Every material is mapped to its most frequently used profile.
+
+    Args:
+        blocks (Iterable[tuple[str, list[str]]]): The material and ramming
+            G-code pairs.
+        library (None | dict): An existing library to merge into.
+
+    Returns:
+        dict: The profile library.
+    """
+    if library is None:
+        library = {"version": LIBRARY_VERSION, "profiles": {}, "materials": {}}
+    counts: dict[str, collections.Counter] = collections.defaultdict(
+        collections.Counter
+    )
+    for material, profile in blocks:
+        profile_id = get_profile_id(profile)
+        library["profiles"][profile_id] = profile
+        counts[material][profile_id] += 1
+
+    for material, counter in counts.items():
+        library["materials"][material] = counter.most_common(1)[0][0]
+    return library
+
+
+def to_macro(profile: list[str]) -> str:
+    """Render the given profile as a RAMMING_SLICER macro body.
+
+    Args:
+        profile (list[str]): The normalized ramming G-code lines.
+
+    Returns:
+        str: The indented macro body.
+    """
+    return "\n".join([MACRO_HEADER, *[f"    {line}" for line in profile], "    G90"])
+
+
+def read_lines(paths: list[str]) -> Iterator[str]:
+    """Stream the lines of the given files.
+
+    Args:
+        paths (list[str]): The file paths, "-" for stdin.
+
+    Yields:
+        str: The lines.
+    """
+    for path in paths:
+        if path == "-":
+            yield from sys.stdin
+            continue
+        with open(path, encoding="utf-8", errors="replace") as f:
+            yield from f
+
+
+def main(argv: None | list[str] = None) -> int:
+    """Run the ramming extracter.
+
+    Args:
+        argv (None | list[str]): The command line arguments.
+
+    Returns:
+        int: The exit code.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="+", help="slicer G-code files, - for stdin")
+    parser.add_argument(
+        "-o", "--output", help="the profile library file to write, default stdout"
+    )
+    parser.add_argument(
+        "-m",
+        "--merge",
+        action="store_true",
+        help="merge into the existing output library instead of replacing it",
     )
+    parser.add_argument(
+        "--print-macro",
+        action="store_true",
+        help="print the profiles as RAMMING_SLICER macro bodies",
+    )
+    args = parser.parse_args(argv)
+
+    library = None
+    if args.merge and args.output and os.path.exists(args.output):
+        with open(args.output) as f:
+            library = json.load(f)
 
-    print("\n".join(ramming_buffer))
+    library = build_library(iter_ramming_blocks(read_lines(args.files)), library)
+    if not library["profiles"]:
+        print("No ramming blocks found!", file=sys.stderr)
+        return 1
 
+    if args.print_macro:
+        for material, profile_id in sorted(library["materials"].items()):
+            print(f"; {material} ({profile_id})")
+            print(to_macro(library["profiles"][profile_id]))
+            print()
+        return 0
+
+    data = json.dumps(library, indent=1, sort_keys=True)
+    if not args.output:
+        print(data)
+        return 0
+
+    temp_path = f"{args.output}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(data)
+    os.replace(temp_path, args.output)
+    print(
+        f"Wrote {len(library['profiles'])} profiles for "
+        f"{len(library['materials'])} materials to {args.output}"
+    )
+    return 0
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,535 @@
+"""Find the tool_mapping that minimizes the MMU travel for slicer G-code files.
+
+The slicer output files are streamed and the sequence of ``T<n>`` tool changes
+is extracted. The idler and selector travel and the estimated time to move them
+for the tool changes is calculated for the ``tool_mapping`` in the MMU3 config,
+then the tools are assigned to the slots that need the least travel::
+
+    python tool_mapping_optimizer.py print1.gcode print2.gcode -c mmu3.cfg
+
+All the slot assignments are tried if there are not too many of them, otherwise
+a local search swaps the slots of two tools at a time, starting from the current
+mapping and a number of random mappings. The result is printed as a
+``tool_mapping`` line to be pasted into the ``[mmu3 MMU3]`` section, the
+filaments need to be moved to their new slots accordingly.
+
+A tool change moves the parked idler to the old slot to unload it, the idler
+and selector to the new slot to load it, and the idler back to the park
+position after the load. The selector stays at the loaded slot.
+"""
+
+from __future__ import annotations
+
+import argparse
+import collections
+import configparser
+import itertools
+import math
+import random
+import re
+import sys
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable, Iterator
+
+TOOL_CHANGE_REGEX = re.compile(r"T(\d+)\s*(;.*)?$")
+
+# the maximum number of slot assignments to try them all
+EXHAUSTIVE_LIMIT = 50000
+
+# the MMU3 defaults of the options used here
+DEFAULTS = {
+    "number_of_tools": "5",
+    "selector_speed": "35",
+    "selector_accel": "200",
+    "selector_positions": "73.5, 59.375, 45.25, 31.125, 17, 0",
+    "idler_speed": "100",
+    "idler_accel": "80",
+    "idler_positions": "5, 20, 35, 50, 65, 85",
+    "enable_no_selector_mode": "False",
+}
+
+
+def get_move_duration(distance: float, speed: float, accel: float) -> float:
+    """Return the duration of a trapezoidal move that starts and ends at rest.
+
+    Args:
+        distance (float): The move distance.
+        speed (float): The maximum speed.
+        accel (float): The acceleration.
+
+    Returns:
+        float: The duration in seconds.
+    """
+    distance = abs(distance)
+    if not distance:
+        return 0.0
+    speed = min(speed, math.sqrt(distance * accel))
+    return distance / speed + speed / accel
+
+
+class MMUGeometry:
+    """The slot positions and the idler and selector motion limits of an MMU3.
+
+    The idler and selector positions have the park position after the slot
+    positions, the MMU is parked after it is homed.
+
+    Args:
+        options (dict[str, str]): The options of the MMU3 config section.
+
+    Raises:
+        ValueError: If the tool_mapping doesn't match the number_of_tools.
+    """
+
+    def __init__(self, options: dict[str, str]) -> None:
+        options = {**DEFAULTS, **options}
+        self.number_of_tools = int(options["number_of_tools"])
+        self.tool_mapping = (
+            self.parse_list(options["tool_mapping"], int)
+            if "tool_mapping" in options
+            else list(range(self.number_of_tools))
+        )
+        self.selector_speed = float(options["selector_speed"])
+        self.selector_accel = float(options["selector_accel"])
+        self.selector_positions = self.parse_list(options["selector_positions"], float)
+        self.idler_speed = float(options["idler_speed"])
+        self.idler_accel = float(options["idler_accel"])
+        self.idler_positions = self.parse_list(options["idler_positions"], float)
+        self.no_selector = options["enable_no_selector_mode"].lower() in (
+            "true",
+            "1",
+        )
+        if len(self.tool_mapping) != self.number_of_tools:
+            raise ValueError(
+                f"tool_mapping needs {self.number_of_tools} slots, "
+                f"got {len(self.tool_mapping)}"
+            )
+        self.park = self.number_of_tools
+
+    @staticmethod
+    def parse_list(value: str, type_: type) -> list:
+        """Parse a comma separated config value the way Klipper does.
+
+        Args:
+            value (str): The config value.
+            type_ (type): The item type.
+
+        Returns:
+            list: The parsed items.
+        """
+        return [type_(item.strip()) for item in value.split(",") if item.strip()]
+
+    @classmethod
+    def from_config_file(cls, path: str, section: None | str = None) -> MMUGeometry:
+        """Read the MMU3 section of a Klipper config file.
+
+        Args:
+            path (str): The config file path.
+            section (None | str): The section name, defaults to the first
+                section starting with "mmu3".
+
+        Raises:
+            ValueError: If the section is not found.
+
+        Returns:
+            MMUGeometry: The geometry.
+        """
+        fileconfig = configparser.RawConfigParser(
+            strict=False, inline_comment_prefixes=(";", "#")
+        )
+        with open(path, encoding="utf-8") as f:
+            fileconfig.read_string(f.read(), path)
+        if section is None:
+            section = next(
+                (name for name in fileconfig.sections() if name.startswith("mmu3")),
+                None,
+            )
+        if section is None or not fileconfig.has_section(section):
+            raise ValueError(f"No MMU3 section in {path}")
+        return cls(dict(fileconfig.items(section)))
+
+    def get_select_duration(self, slot1: int, slot2: int) -> float:
+        """Return the time to move the idler and selector between two slots.
+
+        The idler and selector move concurrently, the slower one decides.
+
+        Args:
+            slot1 (int): The slot to move from, self.park for the park position.
+            slot2 (int): The slot to move to.
+
+        Returns:
+            float: The duration in seconds.
+        """
+        return max(
+            get_move_duration(
+                self.get_idler_travel(slot1, slot2), self.idler_speed, self.idler_accel
+            ),
+            get_move_duration(
+                self.get_selector_travel(slot1, slot2),
+                self.selector_speed,
+                self.selector_accel,
+            ),
+        )
+
+    def get_idler_duration(self, slot1: int, slot2: int) -> float:
+        """Return the time to move only the idler between two slots.
+
+        Args:
+            slot1 (int): The slot to move from, self.park for the park position.
+            slot2 (int): The slot to move to, self.park for the park position.
+
+        Returns:
+            float: The duration in seconds.
+        """
+        return get_move_duration(
+            self.get_idler_travel(slot1, slot2), self.idler_speed, self.idler_accel
+        )
+
+    def get_change_duration(self, slot1: int, slot2: int) -> float:
+        """Return the idler and selector move time of a tool change.
+
+        The parked idler moves to the old slot for the unload, the idler and
+        selector move to the new slot, and the idler is parked after the load.
+
+        Args:
+            slot1 (int): The loaded slot, self.park if nothing is loaded.
+            slot2 (int): The slot to load.
+
+        Returns:
+            float: The duration in seconds.
+        """
+        return (
+            self.get_idler_duration(self.park, slot1)
+            + self.get_select_duration(slot1, slot2)
+            + self.get_idler_duration(slot2, self.park)
+        )
+
+    def get_change_idler_travel(self, slot1: int, slot2: int) -> float:
+        """Return the idler travel of a tool change.
+
+        Args:
+            slot1 (int): The loaded slot, self.park if nothing is loaded.
+            slot2 (int): The slot to load.
+
+        Returns:
+            float: The travel in mm.
+        """
+        return (
+            self.get_idler_travel(self.park, slot1)
+            + self.get_idler_travel(slot1, slot2)
+            + self.get_idler_travel(slot2, self.park)
+        )
+
+    def get_idler_travel(self, slot1: int, slot2: int) -> float:
+        """Return the idler travel between two slots.
+
+        Args:
+            slot1 (int): The slot to move from, self.park for the park position.
+            slot2 (int): The slot to move to.
+
+        Returns:
+            float: The travel in mm.
+        """
+        return abs(self.idler_positions[slot2] - self.idler_positions[slot1])
+
+    def get_selector_travel(self, slot1: int, slot2: int) -> float:
+        """Return the selector travel between two slots.
+
+        Args:
+            slot1 (int): The slot to move from, self.park for the park position.
+            slot2 (int): The slot to move to.
+
+        Returns:
+            float: The travel in mm, 0 in the no selector mode.
+        """
+        if self.no_selector:
+            return 0.0
+        return abs(self.selector_positions[slot2] - self.selector_positions[slot1])
+
+    def get_matrix(self, cost: Callable[[int, int], float]) -> list[list[float]]:
+        """Return the slot to slot matrix of a cost.
+
+        Args:
+            cost (Callable[[int, int], float]): The cost between two slots,
+                i.e. self.get_change_duration.
+
+        Returns:
+            list[list[float]]: The costs, indexed by the slots and the park
+                position.
+        """
+        slots = range(self.number_of_tools + 1)
+        return [[cost(slot1, slot2) for slot2 in slots] for slot1 in slots]
+
+
+def iter_tool_changes(lines: Iterable[str]) -> Iterator[int]:
+    """Extract the tool changes from the given G-code lines.
+
+    Args:
+        lines (Iterable[str]): The G-code lines.
+
+    Yields:
+        int: The tool ids, repeated tools are skipped as they don't change
+            anything.
+    """
+    current_tool = None
+    for raw_line in lines:
+        m = TOOL_CHANGE_REGEX.match(raw_line.strip())
+        if not m:
+            continue
+        tool_id = int(m.group(1))
+        if tool_id != current_tool:
+            current_tool = tool_id
+            yield tool_id
+
+
+def count_transitions(tools: Iterable[int]) -> collections.Counter:
+    """Count the moves between the tools, starting from the park position.
+
+    Args:
+        tools (Iterable[int]): The tool change sequence.
+
+    Returns:
+        collections.Counter: The number of moves per (from, to) tool pair,
+            None is the park position.
+    """
+    transitions = collections.Counter()
+    previous_tool = None
+    for tool_id in tools:
+        transitions[previous_tool, tool_id] += 1
+        previous_tool = tool_id
+    return transitions
+
+
+def get_mapping_cost(
+    mapping: list[int],
+    transitions: collections.Counter,
+    matrix: list[list[float]],
+    park: int,
+) -> float:
+    """Return the sum of the costs of the tool changes.
+
+    Args:
+        mapping (list[int]): The slot of every tool.
+        transitions (collections.Counter): The tool transition counts.
+        matrix (list[list[float]]): The tool change costs between the slots,
+            including the park position.
+        park (int): The index of the park position in the matrix.
+
+    Returns:
+        float: The total cost.
+    """
+    return sum(
+        count * matrix[park if tool1 is None else mapping[tool1]][mapping[tool2]]
+        for (tool1, tool2), count in transitions.items()
+    )
+
+
+def complete_mapping(
+    used_slots: dict[int, int], current_mapping: list[int]
+) -> list[int]:
+    """Assign the free slots to the tools that are not used.
+
+    The unused tools keep their current slot if it is free, so that only the
+    filaments of the used tools need to be moved.
+
+    Args:
+        used_slots (dict[int, int]): The slots of the used tools.
+        current_mapping (list[int]): The current slot of every tool.
+
+    Returns:
+        list[int]: The slot of every tool.
+    """
+    slots = dict(used_slots)
+    for tool, slot in enumerate(current_mapping):
+        if tool not in slots and slot not in slots.values():
+            slots[tool] = slot
+    free_slots = iter(sorted(set(range(len(current_mapping))) - set(slots.values())))
+    return [
+        slots[tool] if tool in slots else next(free_slots)
+        for tool in range(len(current_mapping))
+    ]
+
+
+def optimize_tool_mapping(
+    geometry: MMUGeometry,
+    transitions: collections.Counter,
+    restarts: int = 20,
+    seed: int = 0,
+) -> list[int]:
+    """Find the tool mapping with the minimum estimated tool change moves.
+
+    Args:
+        geometry (MMUGeometry): The MMU geometry.
+        transitions (collections.Counter): The tool transition counts.
+        restarts (int): The number of random starts of the local search.
+        seed (int): The random seed of the local search.
+
+    Returns:
+        list[int]: The slot of every tool, the current mapping if it can't be
+            improved.
+    """
+    matrix = geometry.get_matrix(geometry.get_change_duration)
+    number_of_tools = geometry.number_of_tools
+    used_tools = sorted({tool for pair in transitions for tool in pair} - {None})
+    best = list(geometry.tool_mapping)
+    best_cost = get_mapping_cost(best, transitions, matrix, geometry.park)
+
+    if math.perm(number_of_tools, len(used_tools)) <= EXHAUSTIVE_LIMIT:
+        starts = []
+        # only the slots of the used tools matter
+        for slots in itertools.permutations(range(number_of_tools), len(used_tools)):
+            mapping = [geometry.park] * number_of_tools
+            for tool, slot in zip(used_tools, slots):
+                mapping[tool] = slot
+            cost = get_mapping_cost(mapping, transitions, matrix, geometry.park)
+            if cost < best_cost - 1e-9:
+                best, best_cost = mapping, cost
+    else:
+        rng = random.Random(seed)
+        starts = [list(geometry.tool_mapping)]
+        for _ in range(restarts):
+            starts.append(rng.sample(range(number_of_tools), number_of_tools))
+
+    for mapping in starts:
+        cost = get_mapping_cost(mapping, transitions, matrix, geometry.park)
+        improved = True
+        while improved:
+            improved = False
+            for tool1, tool2 in itertools.combinations(range(number_of_tools), 2):
+                mapping[tool1], mapping[tool2] = mapping[tool2], mapping[tool1]
+                new_cost = get_mapping_cost(mapping, transitions, matrix, geometry.park)
+                if new_cost < cost - 1e-9:
+                    cost = new_cost
+                    improved = True
+                else:
+                    mapping[tool1], mapping[tool2] = mapping[tool2], mapping[tool1]
+        if cost < best_cost - 1e-9:
+            best, best_cost = mapping, cost
+
+    if best == geometry.tool_mapping:
+        return best
+    return complete_mapping(
+        {tool: best[tool] for tool in used_tools}, geometry.tool_mapping
+    )
+
+
+def format_report(
+    geometry: MMUGeometry, transitions: collections.Counter, mapping: list[int]
+) -> str:
+    """Format the travel and the estimated duration of a tool mapping.
+
+    Args:
+        geometry (MMUGeometry): The MMU geometry.
+        transitions (collections.Counter): The tool transition counts.
+        mapping (list[int]): The slot of every tool.
+
+    Returns:
+        str: The report line.
+    """
+    duration, idler_travel, selector_travel = (
+        get_mapping_cost(mapping, transitions, geometry.get_matrix(cost), geometry.park)
+        for cost in (
+            geometry.get_change_duration,
+            geometry.get_change_idler_travel,
+            geometry.get_selector_travel,
+        )
+    )
+    return (
+        f"tool_mapping: {format_mapping(mapping)} -> idler {idler_travel:0.1f} mm, "
+        f"selector {selector_travel:0.1f} mm, {duration:0.1f} s"
+    )
+
+
+def format_mapping(mapping: list[int]) -> str:
+    """Format a tool mapping as a config value.
+
+    Args:
+        mapping (list[int]): The slot of every tool.
+
+    Returns:
+        str: The comma separated slots.
+    """
+    return ", ".join(str(slot) for slot in mapping)
+
+
+def read_lines(paths: list[str]) -> Iterator[str]:
+    """Stream the lines of the given files.
+
+    Args:
+        paths (list[str]): The file paths, "-" for stdin.
+
+    Yields:
+        str: The lines.
+    """
+    for path in paths:
+        if path == "-":
+            yield from sys.stdin
+            continue
+        with open(path, encoding="utf-8", errors="replace") as f:
+            yield from f
+
+
+def main(argv: None | list[str] = None) -> int:
+    """Run the tool mapping optimizer.
+
+    Args:
+        argv (None | list[str]): The command line arguments.
+
+    Returns:
+        int: The exit code.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="+", help="slicer G-code files, - for stdin")
+    parser.add_argument(
+        "-c", "--config", default="mmu3.cfg", help="the MMU3 config file"
+    )
+    parser.add_argument(
+        "--section", help="the MMU3 config section, default the first mmu3 section"
+    )
+    parser.add_argument(
+        "--restarts",
+        type=int,
+        default=20,
+        help="the number of random starts of the local search",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="the random seed of the local search"
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        geometry = MMUGeometry.from_config_file(args.config, args.section)
+    except (OSError, ValueError, configparser.Error) as e:
+        print(f"Can not read the MMU3 config: {e}", file=sys.stderr)
+        return 1
+
+    tools = list(iter_tool_changes(read_lines(args.files)))
+    if not tools:
+        print("No tool changes found!", file=sys.stderr)
+        return 1
+    if max(tools) >= geometry.number_of_tools:
+        print(
+            f"T{max(tools)} is used but the MMU has "
+            f"{geometry.number_of_tools} tools!",
+            file=sys.stderr,
+        )
+        return 1
+
+    transitions = count_transitions(tools)
+    mapping = optimize_tool_mapping(geometry, transitions, args.restarts, args.seed)
+    print(f"{len(tools)} tool changes")
+    print(f"current   {format_report(geometry, transitions, geometry.tool_mapping)}")
+    print(f"optimized {format_report(geometry, transitions, mapping)}")
+    for tool_id, (old_slot, new_slot) in enumerate(
+        zip(geometry.tool_mapping, mapping)
+    ):
+        if old_slot != new_slot:
+            print(f"  T{tool_id}: slot {old_slot} -> slot {new_slot}")
+    print()
+    print(f"tool_mapping: {format_mapping(mapping)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1869 @@
+"""A virtual-time stand-in for the Klipper objects used by MMU3.
+
+The real ``MMU3`` class is loaded from a Klipper config file and run against
+fake printer objects that only advance a virtual reactor clock:
+
+- ``manual_stepper`` and extruder moves take the time of their trapezoidal
+  velocity profile, calculated the same way Klipper does.
+- The filament of every slot has a tip position along a simulated path with
+  the FINDA, the filament switch sensor, the motion sensor, the extruder gears,
+  the cutter and the nozzle on it. The pulley only drives the slot the idler is
+  engaged on, the extruder gears only grip the filament whose tip is past them.
+- The selector and the idler have hard stops, the selector virtual endstop
+  triggers at its hard stop.
+- The extruder heater ramps its temperature with a constant rate.
+- The G-code commands MMU3 uses are interpreted, the gcode macros of the
+  config file are run by substituting their ``params``.
+
+Nothing waits for real time, so a tool change runs in milliseconds of CPU time
+while the reactor clock reports the simulated mechanical time::
+
+    sim = KlipperSimulation(tmp_path)
+    result = sim.run_gcode("T0")
+    print(result.simulated_time, result.cpu_time)
+"""
+
+from __future__ import annotations
+
+import bisect
+import configparser
+import math
+import os
+import re
+import sys
+import time
+import types
+from typing import Callable
+
+# the time Klipper buffers ahead when it starts moving after being idle
+BUFFER_TIME_START = 0.250
+# the maximum time Klipper queues moves ahead of the MCU
+BUFFER_TIME_HIGH = 2.0
+# the round trip time of an MCU query
+QUERY_LATENCY = 0.005
+# the resolution of the trigger positions of the homing moves
+TRIGGER_RESOLUTION = 0.01
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CONFIG_PATH = os.path.join(REPO_PATH, "mmu3.cfg")
+
+CLASSIC_COMMAND_REGEX = re.compile(r"[A-Z]\d+(?:\.\d+)?")
+EXTENDED_PARAM_REGEX = re.compile(r'(\w+)=("[^"]*"|\S+)')
+MACRO_PARAM_REGEX = re.compile(r"\{\s*params\.(\w+)\s*\}")
+
+_SENTINEL = object()
+
+
+class CommandError(Exception):
+    """The stand-in of printer.command_error and gcode.error."""
+
+
+def calc_move_time(
+    distance: float, speed: float, accel: float
+) -> tuple[float, float, float]:
+    """Calculate the trapezoidal velocity profile of a move.
+
+    This is the same calculation Klipper's force_move.calc_move_time does.
+
+    Args:
+        distance (float): The move distance.
+        speed (float): The maximum speed.
+        accel (float): The acceleration, 0 for no acceleration limit.
+
+    Returns:
+        tuple[float, float, float]: The acceleration time, the cruise time and
+            the cruise speed.
+    """
+    distance = abs(distance)
+    if not accel or not distance:
+        return 0.0, distance / speed, speed
+    max_cruise_v2 = distance * accel
+    if max_cruise_v2 < speed**2:
+        speed = math.sqrt(max_cruise_v2)
+    accel_t = speed / accel
+    accel_decel_d = accel_t * speed
+    cruise_t = (distance - accel_decel_d) / speed
+    return accel_t, cruise_t, speed
+
+
+def move_duration(distance: float, speed: float, accel: float) -> float:
+    """Return the duration of a move.
+
+    Args:
+        distance (float): The move distance.
+        speed (float): The maximum speed.
+        accel (float): The acceleration, 0 for no acceleration limit.
+
+    Returns:
+        float: The duration in seconds.
+    """
+    accel_t, cruise_t, _ = calc_move_time(distance, speed, accel)
+    return accel_t + cruise_t + accel_t
+
+
+def time_to_distance(
+    partial_distance: float, distance: float, speed: float, accel: float
+) -> float:
+    """Return the time it takes a move to travel part of its distance.
+
+    Args:
+        partial_distance (float): The distance travelled.
+        distance (float): The total distance of the move.
+        speed (float): The maximum speed.
+        accel (float): The acceleration, 0 for no acceleration limit.
+
+    Returns:
+        float: The time in seconds.
+    """
+    partial_distance = min(abs(partial_distance), abs(distance))
+    accel_t, cruise_t, cruise_v = calc_move_time(distance, speed, accel)
+    if not accel_t:
+        return partial_distance / cruise_v
+    accel_d = 0.5 * cruise_v * accel_t
+    if partial_distance <= accel_d:
+        return math.sqrt(2 * partial_distance / accel)
+    if partial_distance <= accel_d + cruise_v * cruise_t:
+        return accel_t + (partial_distance - accel_d) / cruise_v
+    remaining = max(0.0, abs(distance) - partial_distance)
+    return accel_t + cruise_t + accel_t - math.sqrt(2 * remaining / accel)
+
+
+def normalize_pin(pin: str) -> str:
+    """Remove the pull up, pull down and invert flags from a pin name.
+
+    Args:
+        pin (str): The pin name.
+
+    Returns:
+        str: The bare pin name.
+    """
+    return pin.strip().lstrip("^~!").strip()
+
+
+class SimTimer:
+    """A reactor timer."""
+
+    def __init__(self, callback: Callable[[float], float], waketime: float) -> None:
+        self.callback = callback
+        self.waketime = waketime
+
+
+class SimReactor:
+    """A reactor with a virtual clock.
+
+    The clock only moves when something waits for it, the due timers are run
+    in order while it moves.
+    """
+
+    NOW = 0.0
+    NEVER = 9999999999999999.0
+
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.timers: list[SimTimer] = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def register_timer(
+        self, callback: Callable[[float], float], waketime: float = NEVER
+    ) -> SimTimer:
+        timer = SimTimer(callback, waketime)
+        self.timers.append(timer)
+        return timer
+
+    def unregister_timer(self, timer: SimTimer) -> None:
+        timer.waketime = self.NEVER
+        if timer in self.timers:
+            self.timers.remove(timer)
+
+    def update_timer(self, timer: SimTimer, waketime: float) -> None:
+        timer.waketime = waketime
+
+    def register_callback(
+        self, callback: Callable[[float], None], waketime: float = NOW
+    ) -> None:
+        def run_once(eventtime: float) -> float:
+            self.unregister_timer(timer)
+            callback(eventtime)
+            return self.NEVER
+
+        timer = self.register_timer(run_once, waketime)
+
+    def pause(self, waketime: float) -> float:
+        self.advance(waketime)
+        return self.now
+
+    def advance(self, waketime: float) -> None:
+        """Move the clock to the given time running the due timers.
+
+        Args:
+            waketime (float): The time to move the clock to.
+        """
+        while True:
+            due = [timer for timer in self.timers if timer.waketime <= waketime]
+            if not due:
+                break
+            timer = min(due, key=lambda t: t.waketime)
+            self.now = max(self.now, timer.waketime)
+            # don't run the timer again from a nested advance
+            timer.waketime = self.NEVER
+            waketime_ = timer.callback(self.now)
+            if timer in self.timers and timer.waketime == self.NEVER:
+                timer.waketime = waketime_
+        self.now = max(self.now, waketime)
+
+
+class SimMutex:
+    """The G-code mutex, locked while a command runs."""
+
+    def __init__(self) -> None:
+        self.locked = False
+
+    def test(self) -> bool:
+        return self.locked
+
+    def __enter__(self) -> SimMutex:
+        # nothing else runs while a timer holds the mutex in the simulation
+        assert not self.locked, "the G-code mutex is already locked"
+        self.locked = True
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.locked = False
+
+
+class SimMCU:
+    """An MCU whose print time is the reactor time."""
+
+    def __init__(self, reactor: SimReactor) -> None:
+        self.reactor = reactor
+        self.number_of_queries = 0
+
+    def get_name(self) -> str:
+        return "mmboard"
+
+    def estimated_print_time(self, eventtime: float) -> float:
+        return eventtime
+
+
+class SimEndstop:
+    """An endstop whose state is read from the simulated mechanics.
+
+    Args:
+        sim (KlipperSimulation): The simulation.
+        kind (str): The kind of the endstop, "finda", "switch_sensor" or
+            "selector".
+    """
+
+    def __init__(self, sim: KlipperSimulation, kind: str) -> None:
+        self.sim = sim
+        self.kind = kind
+        self.steppers = []
+
+    def get_mcu(self) -> SimMCU:
+        return self.sim.mcu
+
+    def add_stepper(self, stepper: SimStepper) -> None:
+        self.steppers.append(stepper)
+
+    def get_steppers(self) -> list[SimStepper]:
+        return list(self.steppers)
+
+    def get_state(self) -> bool:
+        """Return the state after all the queued moves.
+
+        Returns:
+            bool: True if triggered.
+        """
+        return self.sim.path.get_sensor_state(self.kind)
+
+    def query_endstop(self, print_time: float) -> int:
+        """Query the endstop, waits until the given print time.
+
+        Args:
+            print_time (float): The print time to query the state at.
+
+        Returns:
+            int: 1 if triggered, 0 otherwise.
+        """
+        self.sim.mcu.number_of_queries += 1
+        self.sim.reactor.pause(max(self.sim.reactor.now, print_time) + QUERY_LATENCY)
+        return int(self.sim.path.get_sensor_state(self.kind, print_time))
+
+
+class SimStepper:
+    """The stepper of a manual stepper rail."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.trapq = object()
+
+    def get_name(self) -> str:
+        return self.name
+
+    def get_trapq(self) -> object:
+        return self.trapq
+
+    def set_trapq(self, trapq: object) -> object:
+        old_trapq, self.trapq = self.trapq, trapq
+        return old_trapq
+
+    def set_position(self, coord: list[float]) -> None:
+        pass
+
+
+class SimRail:
+    """The rail of a manual stepper."""
+
+    def __init__(self, stepper: SimStepper, endstops: list) -> None:
+        self.stepper = stepper
+        self.endstops = endstops
+
+    def get_steppers(self) -> list[SimStepper]:
+        return [self.stepper]
+
+    def get_endstops(self) -> list:
+        return list(self.endstops)
+
+
+class SimManualStepper:
+    """A manual_stepper with the move timing of Klipper's ManualStepper.
+
+    The commanded position is what MMU3 sees, the physical position is where
+    the carriage really is, which stops at the hard stops.
+
+    Args:
+        sim (KlipperSimulation): The simulation.
+        name (str): The config section name.
+        velocity (float): The default velocity.
+        accel (float): The default acceleration.
+        endstop (None | SimEndstop): The endstop of the stepper.
+        limits (None | tuple[float, float]): The hard stops in physical
+            coordinates.
+        physical (float): The initial physical position.
+    """
+
+    def __init__(
+        self,
+        sim: KlipperSimulation,
+        name: str,
+        velocity: float,
+        accel: float,
+        endstop: None | SimEndstop = None,
+        limits: None | tuple[float, float] = None,
+        physical: float = 0.0,
+    ) -> None:
+        self.sim = sim
+        self.printer = sim.printer
+        self.name = name
+        self.velocity = velocity
+        self.accel = accel
+        self.homing_accel = accel
+        self.endstop = endstop
+        self.limits = limits
+        self.physical = physical
+        self.position = 0.0
+        self.next_cmd_time = 0.0
+        self.enabled = False
+        self.number_of_moves = 0
+        self.number_of_homing_moves = 0
+        self.travel = 0.0
+        self.rail = SimRail(
+            SimStepper(name.split()[-1]),
+            [(endstop, name)] if endstop is not None else [],
+        )
+        if endstop is not None:
+            endstop.add_stepper(self.rail.stepper)
+
+    def get_position(self) -> list[float]:
+        return [self.position, 0.0, 0.0, 0.0]
+
+    def set_position(self, newpos: list[float], homing_axes: str = "") -> None:
+        self.position = newpos[0]
+
+    def do_set_position(self, setpos: float) -> None:
+        self.position = setpos
+
+    def do_enable(self, enable: bool) -> None:
+        self.sync_print_time()
+        self.enabled = enable
+
+    def sync_print_time(self) -> None:
+        toolhead = self.sim.toolhead
+        print_time = toolhead.get_last_move_time()
+        if self.next_cmd_time > print_time:
+            toolhead.dwell(self.next_cmd_time - print_time)
+        else:
+            self.next_cmd_time = print_time
+
+    def apply(self, delta: float) -> None:
+        """Move the mechanics, without any timing.
+
+        Args:
+            delta (float): The distance moved.
+        """
+        if self.limits is None:
+            self.physical += delta
+        else:
+            self.physical = min(max(self.physical + delta, self.limits[0]), self.limits[1])
+        if self is self.sim.pulley_stepper:
+            self.sim.path.feed(delta, pulley=True)
+
+    def do_move(
+        self, movepos: float, speed: float, accel: float, sync: bool = True
+    ) -> None:
+        self.sync_print_time()
+        delta = movepos - self.position
+        self.next_cmd_time += move_duration(delta, speed, accel)
+        self.apply(delta)
+        self.position = movepos
+        self.enabled = True
+        self.number_of_moves += 1
+        self.travel += abs(delta)
+        self.sim.path.record(self.next_cmd_time)
+        if sync:
+            self.sync_print_time()
+
+    def do_homing_move(
+        self,
+        movepos: float,
+        speed: float,
+        accel: float,
+        probe_pos: bool = False,
+        triggered: bool = True,
+        check_trigger: bool = True,
+    ) -> None:
+        self.homing_accel = accel
+        self.printer.lookup_object("homing").manual_home(
+            self,
+            self.rail.get_endstops(),
+            [movepos, 0.0, 0.0, 0.0],
+            speed,
+            triggered,
+            check_trigger,
+        )
+
+    def homing_move(
+        self,
+        endstops: list,
+        movepos: float,
+        speed: float,
+        triggered: bool,
+        check_triggered: bool,
+    ) -> None:
+        """Move until any of the endstops reach the triggered state.
+
+        Args:
+            endstops (list): The (endstop, name) pairs.
+            movepos (float): The target position.
+            speed (float): The speed.
+            triggered (bool): The endstop state to stop at.
+            check_triggered (bool): Raise an error if the endstops don't reach
+                the triggered state.
+
+        Raises:
+            CommandError: If check_triggered is set and the endstops didn't
+                reach the triggered state.
+        """
+        self.sync_print_time()
+        delta = movepos - self.position
+        travel = self.sim.path.find_trigger(
+            self, [endstop for endstop, _ in endstops], delta, triggered
+        )
+        is_triggered = travel is not None
+        if not is_triggered:
+            travel = abs(delta)
+        moved = math.copysign(travel, delta)
+        self.next_cmd_time += time_to_distance(travel, delta, speed, self.homing_accel)
+        self.apply(moved)
+        self.position += moved
+        self.enabled = True
+        self.number_of_homing_moves += 1
+        self.travel += travel
+        self.sim.path.record(self.next_cmd_time)
+        self.sync_print_time()
+        self.sim.toolhead.wait_moves()
+        if check_triggered and not is_triggered:
+            raise CommandError(
+                f"No trigger on {endstops[0][1] if endstops else self.name} "
+                "after full movement"
+            )
+
+
+class SimHoming:
+    """The homing object, only manual_home is supported."""
+
+    def manual_home(
+        self,
+        toolhead: SimManualStepper,
+        endstops: list,
+        pos: list[float],
+        speed: float,
+        triggered: bool,
+        check_triggered: bool,
+    ) -> None:
+        toolhead.homing_move(endstops, pos[0], speed, triggered, check_triggered)
+
+
+class SimHeater:
+    """A heater that ramps its temperature with constant rates.
+
+    Args:
+        reactor (SimReactor): The reactor.
+        temperature (float): The initial temperature, also the initial target.
+        heating_rate (float): The heating rate in degrees per second.
+        cooling_rate (float): The cooling rate in degrees per second.
+        min_extrude_temp (float): The minimum temperature to extrude at.
+    """
+
+    AMBIENT = 25.0
+
+    def __init__(
+        self,
+        reactor: SimReactor,
+        temperature: float,
+        heating_rate: float = 2.5,
+        cooling_rate: float = 1.0,
+        min_extrude_temp: float = 170.0,
+    ) -> None:
+        self.reactor = reactor
+        self.heating_rate = heating_rate
+        self.cooling_rate = cooling_rate
+        self.min_extrude_temp = min_extrude_temp
+        self.target_temp = temperature if temperature > self.AMBIENT else 0.0
+        self._temp = temperature
+        self._time = reactor.monotonic()
+
+    def get_current_temp(self, eventtime: None | float = None) -> float:
+        """Return the temperature at the given reactor time.
+
+        Args:
+            eventtime (None | float): The reactor time, defaults to now.
+
+        Returns:
+            float: The temperature.
+        """
+        if eventtime is None:
+            eventtime = self.reactor.monotonic()
+        goal = max(self.target_temp, self.AMBIENT)
+        elapsed = max(0.0, eventtime - self._time)
+        if goal >= self._temp:
+            return min(goal, self._temp + self.heating_rate * elapsed)
+        return max(goal, self._temp - self.cooling_rate * elapsed)
+
+    def get_temp(self, eventtime: float) -> tuple[float, float]:
+        # the last measured temperature, not the one at a future print time
+        return self.get_current_temp(), self.target_temp
+
+    def set_temp(self, degrees: float) -> None:
+        self._temp = self.get_current_temp()
+        self._time = self.reactor.monotonic()
+        self.target_temp = degrees
+
+    def check_busy(self, eventtime: float) -> bool:
+        return bool(self.target_temp) and (
+            abs(self.target_temp - self.get_current_temp(eventtime)) > 1.0
+        )
+
+    def get_wait_time(self) -> float:
+        """Return the time left until the heater reaches its target.
+
+        Returns:
+            float: The time in seconds.
+        """
+        if not self.target_temp:
+            return 0.0
+        temp = self.get_current_temp()
+        if temp < self.target_temp - 1.0:
+            return (self.target_temp - 1.0 - temp) / self.heating_rate
+        if temp > self.target_temp + 1.0:
+            return (temp - self.target_temp - 1.0) / self.cooling_rate
+        return 0.0
+
+    @property
+    def can_extrude(self) -> bool:
+        return self.get_current_temp() >= self.min_extrude_temp
+
+    def get_status(self, eventtime: float) -> dict:
+        return {
+            "temperature": self.get_current_temp(eventtime),
+            "target": self.target_temp,
+        }
+
+
+class SimHeaters:
+    """The heaters object."""
+
+    def __init__(self, sim: KlipperSimulation) -> None:
+        self.sim = sim
+        self.heaters = {}
+
+    def lookup_heater(self, name: str) -> SimHeater:
+        return self.heaters[name]
+
+    def set_temperature(self, heater: SimHeater, temp: float, wait: bool = False) -> None:
+        heater.set_temp(temp)
+        if wait and temp:
+            self.sim.reactor.pause(self.sim.reactor.now + heater.get_wait_time())
+
+
+class SimExtruder:
+    """The extruder, moved by the toolhead."""
+
+    def __init__(self, heater: SimHeater) -> None:
+        self.heater = heater
+        self.trapq = object()
+        self.last_position = 0.0
+
+    def get_name(self) -> str:
+        return "extruder"
+
+    def get_heater(self) -> SimHeater:
+        return self.heater
+
+    def get_trapq(self) -> object:
+        return self.trapq
+
+
+class SimToolhead:
+    """The toolhead, with Klipper's print time bookkeeping.
+
+    Args:
+        sim (KlipperSimulation): The simulation.
+        extruder (SimExtruder): The extruder.
+    """
+
+    def __init__(
+        self,
+        sim: KlipperSimulation,
+        extruder: SimExtruder,
+        max_velocity: float = 300.0,
+        max_accel: float = 3000.0,
+        max_extrude_only_velocity: float = 100.0,
+        max_extrude_only_accel: float = 1500.0,
+    ) -> None:
+        self.sim = sim
+        self.reactor = sim.reactor
+        self.extruder = extruder
+        self.max_velocity = max_velocity
+        self.max_accel = max_accel
+        self.max_extrude_only_velocity = max_extrude_only_velocity
+        self.max_extrude_only_accel = max_extrude_only_accel
+        self.print_time = 0.0
+        self.position = [0.0, 0.0, 0.0, 0.0]
+        self.trapq = object()
+        self.number_of_moves = 0
+        self.number_of_drains = 0
+
+    def get_extruder(self) -> SimExtruder:
+        return self.extruder
+
+    def get_trapq(self) -> object:
+        return self.trapq
+
+    def get_position(self) -> list[float]:
+        return list(self.position)
+
+    def set_position(self, newpos: list[float], homing_axes: str = "") -> None:
+        self.position = list(newpos)
+        self.extruder.last_position = newpos[3]
+
+    def get_last_move_time(self) -> float:
+        est_print_time = self.sim.mcu.estimated_print_time(self.reactor.now)
+        if self.print_time <= est_print_time:
+            # the queue has run dry, the moves are restarted with a delay
+            self.print_time = est_print_time + BUFFER_TIME_START
+        return self.print_time
+
+    def _advance(self, print_time: float) -> None:
+        self.print_time = max(self.print_time, print_time)
+        # the host is not allowed to get too far ahead of the MCU
+        if self.print_time - self.reactor.now > BUFFER_TIME_HIGH:
+            self.reactor.pause(self.print_time - BUFFER_TIME_HIGH)
+
+    def dwell(self, delay: float) -> None:
+        self._advance(self.get_last_move_time() + max(0.0, delay))
+
+    def move(self, newpos: list[float], speed: float) -> None:
+        """Queue a toolhead move.
+
+        Args:
+            newpos (list[float]): The new X, Y, Z, E position.
+            speed (float): The speed.
+
+        Raises:
+            CommandError: If the extruder is too cold to extrude.
+        """
+        delta = [n - p for n, p in zip(newpos, self.position)]
+        distance = math.sqrt(delta[0] ** 2 + delta[1] ** 2 + delta[2] ** 2)
+        if delta[3] and not self.extruder.heater.can_extrude:
+            raise CommandError(
+                "Extrude below minimum temp\n"
+                "See the 'min_extrude_temp' config option for details"
+            )
+        if distance:
+            duration = move_duration(
+                distance, min(speed, self.max_velocity), self.max_accel
+            )
+        else:
+            duration = move_duration(
+                delta[3],
+                min(speed, self.max_extrude_only_velocity),
+                self.max_extrude_only_accel,
+            )
+        end_time = self.get_last_move_time() + duration
+        self.position = list(newpos)
+        self.extruder.last_position = newpos[3]
+        self.number_of_moves += 1
+        if delta[3]:
+            self.sim.path.feed(
+                delta[3],
+                pulley=self.sim.is_pulley_synced(),
+                extruder=True,
+            )
+            self.sim.path.record(end_time)
+        self._advance(end_time)
+
+    def wait_moves(self) -> None:
+        self.number_of_drains += 1
+        self.reactor.pause(max(self.reactor.now, self.print_time))
+
+    def flush_step_generation(self) -> None:
+        pass
+
+    def register_lookahead_callback(self, callback: Callable[[float], None]) -> None:
+        callback(self.get_last_move_time())
+
+
+class SimGCodeMove:
+    """The gcode_move object, tracks the G-code coordinates.
+
+    Args:
+        sim (KlipperSimulation): The simulation.
+    """
+
+    def __init__(self, sim: KlipperSimulation) -> None:
+        self.sim = sim
+        self.absolute_coord = True
+        self.absolute_extrude = True
+        self.base_position = [0.0, 0.0, 0.0, 0.0]
+        self.last_position = [0.0, 0.0, 0.0, 0.0]
+        self.speed = 25.0
+        self.speed_factor = 1.0 / 60.0
+        self.saved_states = {}
+
+    def reset_last_position(self) -> None:
+        self.last_position = self.sim.toolhead.get_position()
+
+    def cmd_G1(self, gcmd: SimGCodeCommand) -> None:
+        params = gcmd.get_command_parameters()
+        for i, axis in enumerate("XYZ"):
+            if axis in params:
+                value = float(params[axis])
+                if self.absolute_coord:
+                    self.last_position[i] = value + self.base_position[i]
+                else:
+                    self.last_position[i] += value
+        if "E" in params:
+            value = float(params["E"])
+            if self.absolute_extrude:
+                self.last_position[3] = value + self.base_position[3]
+            else:
+                self.last_position[3] += value
+        if "F" in params:
+            self.speed = float(params["F"]) * self.speed_factor
+        self.sim.toolhead.move(self.last_position, self.speed)
+
+    def cmd_G90(self, gcmd: SimGCodeCommand) -> None:
+        self.absolute_coord = self.absolute_extrude = True
+
+    def cmd_G91(self, gcmd: SimGCodeCommand) -> None:
+        self.absolute_coord = self.absolute_extrude = False
+
+    def cmd_M82(self, gcmd: SimGCodeCommand) -> None:
+        self.absolute_extrude = True
+
+    def cmd_M83(self, gcmd: SimGCodeCommand) -> None:
+        self.absolute_extrude = False
+
+    def cmd_G92(self, gcmd: SimGCodeCommand) -> None:
+        params = gcmd.get_command_parameters()
+        axes = [(i, axis) for i, axis in enumerate("XYZE") if axis in params]
+        if not axes:
+            self.base_position = list(self.last_position)
+        for i, axis in axes:
+            self.base_position[i] = self.last_position[i] - float(params[axis])
+
+    def cmd_M220(self, gcmd: SimGCodeCommand) -> None:
+        value = gcmd.get_float("S", 100.0, above=0.0) / (60.0 * 100.0)
+        self.speed = self.speed / self.speed_factor * value
+        self.speed_factor = value
+
+    def cmd_SAVE_GCODE_STATE(self, gcmd: SimGCodeCommand) -> None:
+        self.saved_states[gcmd.get("NAME", "default")] = (
+            self.absolute_coord,
+            self.absolute_extrude,
+            list(self.base_position),
+            self.speed,
+            self.speed_factor,
+        )
+
+    def cmd_RESTORE_GCODE_STATE(self, gcmd: SimGCodeCommand) -> None:
+        state = self.saved_states.get(gcmd.get("NAME", "default"))
+        if state is None:
+            raise gcmd.error("Unknown g-code state")
+        (
+            self.absolute_coord,
+            self.absolute_extrude,
+            base_position,
+            self.speed,
+            self.speed_factor,
+        ) = state
+        self.base_position = list(base_position)
+        self.reset_last_position()
+
+
+class SimGCodeCommand:
+    """A parsed G-code command."""
+
+    error = CommandError
+
+    def __init__(
+        self, command: str, commandline: str, raw_params: str, params: dict
+    ) -> None:
+        self.command = command
+        self.commandline = commandline
+        self.raw_params = raw_params
+        self.params = params
+
+    def get_command(self) -> str:
+        return self.command
+
+    def get_commandline(self) -> str:
+        return self.commandline
+
+    def get_command_parameters(self) -> dict:
+        return self.params
+
+    def get_raw_command_parameters(self) -> str:
+        return self.raw_params
+
+    def get(
+        self,
+        name: str,
+        default: object = _SENTINEL,
+        parser: Callable = str,
+        minval: None | float = None,
+        maxval: None | float = None,
+        above: None | float = None,
+        below: None | float = None,
+    ) -> object:
+        value = self.params.get(name)
+        if value is None:
+            if default is _SENTINEL:
+                raise self.error(f"Error on '{self.commandline}': missing {name}")
+            return default
+        try:
+            value = parser(value)
+        except ValueError:
+            raise self.error(
+                f"Error on '{self.commandline}': unable to parse {value}"
+            ) from None
+        if (
+            (minval is not None and value < minval)
+            or (maxval is not None and value > maxval)
+            or (above is not None and value <= above)
+            or (below is not None and value >= below)
+        ):
+            raise self.error(f"Error on '{self.commandline}': {name} out of range")
+        return value
+
+    def get_int(self, name: str, default: object = _SENTINEL, **kwargs) -> int:
+        return self.get(name, default, int, **kwargs)
+
+    def get_float(self, name: str, default: object = _SENTINEL, **kwargs) -> float:
+        return self.get(name, default, float, **kwargs)
+
+
+class SimGCodeDispatch:
+    """The gcode object, runs the registered commands and the macros.
+
+    Args:
+        sim (KlipperSimulation): The simulation.
+    """
+
+    error = CommandError
+
+    def __init__(self, sim: KlipperSimulation) -> None:
+        self.sim = sim
+        self.commands: dict[str, Callable] = {}
+        self.mutex = SimMutex()
+        self.responses: list[str] = []
+        self.unknown_commands: list[str] = []
+        self.last_result = None
+        self.number_of_lines = 0
+
+    def register_command(
+        self,
+        cmd: str,
+        func: None | Callable,
+        when_not_ready: bool = False,
+        desc: None | str = None,
+    ) -> None:
+        if func is None:
+            self.commands.pop(cmd, None)
+            return
+        if cmd in self.commands:
+            raise self.sim.printer.config_error(f"gcode command {cmd} already registered")
+        self.commands[cmd] = func
+
+    def get_mutex(self) -> SimMutex:
+        return self.mutex
+
+    def respond_info(self, msg: str, log: bool = True) -> None:
+        self.respond_raw("// " + "\n// ".join(msg.strip().split("\n")))
+
+    def respond_raw(self, msg: str) -> None:
+        self.responses.append(msg)
+
+    def run_script_from_command(self, script: str) -> None:
+        for line in script.split("\n"):
+            self.run_line(line)
+
+    def run_line(self, line: str) -> None:
+        """Parse and run a single G-code line.
+
+        Args:
+            line (str): The G-code line.
+        """
+        line = line.split(";", 1)[0].strip()
+        if not line:
+            return
+        self.number_of_lines += 1
+        parts = line.split(None, 1)
+        command = parts[0].upper()
+        raw_params = parts[1] if len(parts) > 1 else ""
+        if CLASSIC_COMMAND_REGEX.fullmatch(command) and command not in ("M117", "M118"):
+            params = {part[0].upper(): part[1:] for part in raw_params.split()}
+        else:
+            params = {
+                key.upper(): value.strip('"')
+                for key, value in EXTENDED_PARAM_REGEX.findall(raw_params)
+            }
+        handler = self.commands.get(command)
+        if handler is None:
+            self.unknown_commands.append(command)
+            self.respond_info(f'Unknown command:"{command}"')
+            return
+        self.last_result = handler(SimGCodeCommand(command, line, raw_params, params))
+
+
+class SimRunoutHelper:
+    """The runout helper of a filament sensor."""
+
+    def __init__(self) -> None:
+        self.sensor_enabled = True
+        self.runout_times: list[float] = []
+
+
+class SimSwitchSensor:
+    """A filament_switch_sensor reading the simulated filament path."""
+
+    def __init__(self, sim: KlipperSimulation) -> None:
+        self.sim = sim
+        self.runout_helper = SimRunoutHelper()
+
+    def get_status(self, eventtime: None | float) -> dict:
+        return {
+            "filament_detected": self.sim.path.get_sensor_state(
+                "switch_sensor", self.sim.reactor.now
+            ),
+            "enabled": self.runout_helper.sensor_enabled,
+        }
+
+
+class SimEncoderSensor:
+    """A filament_motion_sensor reading the simulated filament path."""
+
+    def __init__(self, sim: KlipperSimulation, detection_length: float = 7.0) -> None:
+        self.sim = sim
+        self.detection_length = detection_length
+        self.runout_helper = SimRunoutHelper()
+        self.number_of_encoder_events = 0
+
+    def encoder_event(self, eventtime: float, state: None | int) -> None:
+        self.number_of_encoder_events += 1
+
+    def get_status(self, eventtime: None | float) -> dict:
+        return {
+            "filament_detected": self.sim.path.get_sensor_state(
+                "motion_sensor", self.sim.reactor.now
+            ),
+            "enabled": self.runout_helper.sensor_enabled,
+        }
+
+
+class SimPins:
+    """The pins object, creates endstops for the known sensor pins."""
+
+    def __init__(self, sim: KlipperSimulation) -> None:
+        self.sim = sim
+        self.pin_kinds: dict[str, str] = {}
+
+    def allow_multi_use_pin(self, pin: str) -> None:
+        pass
+
+    def setup_pin(self, pin_type: str, pin: str) -> SimEndstop:
+        return SimEndstop(self.sim, self.pin_kinds[normalize_pin(pin)])
+
+
+class SimButtons:
+    """The buttons object, reports the sensor pin changes."""
+
+    def __init__(self, sim: KlipperSimulation) -> None:
+        self.sim = sim
+
+    def register_buttons(
+        self, pins: list[str], callback: Callable[[float, int], None]
+    ) -> None:
+        for pin in pins:
+            kind = self.sim.pins.pin_kinds[normalize_pin(pin)]
+            self.sim.path.button_callbacks.setdefault(kind, []).append(callback)
+
+
+class SimQueryEndstops:
+    """The query_endstops object."""
+
+    def __init__(self) -> None:
+        self.endstops: list = []
+
+
+class SimMotionQueuing:
+    """The motion_queuing object."""
+
+    def check_step_generation_scan_windows(self) -> None:
+        pass
+
+
+class SimDisplayStatus:
+    """The display_status object, keeps the M117 message."""
+
+    def __init__(self) -> None:
+        self.message = None
+
+
+class FilamentPath:
+    """The filament path of the MMU and the extruder.
+
+    The positions are the distances along the path from where the filament
+    tips of the slots are parked, which is in front of the FINDA.
+
+    Args:
+        sim (KlipperSimulation): The simulation.
+        number_of_tools (int): The number of slots.
+        idler_positions (list[float]): The idler positions of the slots.
+        selector_positions (None | list[float]): The selector positions of the
+            slots, None if there is no selector.
+        finda_position (float): The FINDA position.
+        switch_sensor_position (float): The filament switch sensor position.
+        motion_sensor_position (float): The filament motion sensor position.
+        gear_position (float): The extruder gears position.
+        cutter_position (float): The cutter position.
+        nozzle_position (float): The nozzle position.
+    """
+
+    # how close the idler and selector need to be to a slot position
+    ALIGNMENT_TOLERANCE = 1.0
+
+    def __init__(
+        self,
+        sim: KlipperSimulation,
+        number_of_tools: int,
+        idler_positions: list[float],
+        selector_positions: None | list[float],
+        finda_position: float = 15.0,
+        switch_sensor_position: float = 650.0,
+        motion_sensor_position: float = 640.0,
+        gear_position: float = 665.0,
+        cutter_position: float = 690.0,
+        nozzle_position: float = 740.0,
+    ) -> None:
+        self.sim = sim
+        self.number_of_tools = number_of_tools
+        self.idler_positions = idler_positions
+        self.selector_positions = selector_positions
+        self.finda_position = finda_position
+        self.switch_sensor_position = switch_sensor_position
+        self.motion_sensor_position = motion_sensor_position
+        self.gear_position = gear_position
+        self.cutter_position = cutter_position
+        self.nozzle_position = nozzle_position
+        self.tips = [0.0] * number_of_tools
+        self.number_of_cuts = 0
+        self.slipped_distance = 0.0
+        self.button_callbacks: dict[str, list[Callable[[float, int], None]]] = {}
+        self.reset_history()
+
+    def reset_history(self) -> None:
+        """Forget the recorded sensor states, start from the current ones."""
+        self.history_times = [0.0]
+        self.history_states = [self.get_sensor_states()]
+        self.reported_states = dict(self.history_states[0])
+
+    def get_engaged_slot(self) -> None | int:
+        """Return the slot the idler presses to the pulley.
+
+        Returns:
+            None | int: The slot, None if the idler is parked.
+        """
+        idler = self.sim.idler_stepper
+        for slot, position in enumerate(self.idler_positions[: self.number_of_tools]):
+            if abs(idler.physical - position) <= self.ALIGNMENT_TOLERANCE:
+                return slot
+        return None
+
+    def is_selector_aligned(self, slot: int) -> bool:
+        if self.selector_positions is None:
+            return True
+        selector = self.sim.selector_stepper
+        return (
+            abs(selector.physical - self.selector_positions[slot])
+            <= self.ALIGNMENT_TOLERANCE
+        )
+
+    def get_gripped_slot(self) -> None | int:
+        """Return the slot whose filament is gripped by the extruder gears.
+
+        Returns:
+            None | int: The slot, None if no filament is in the gears.
+        """
+        for slot, tip in enumerate(self.tips):
+            if tip >= self.gear_position:
+                return slot
+        return None
+
+    def feed(self, delta: float, pulley: bool = False, extruder: bool = False) -> None:
+        """Move the filament with the pulley and/or the extruder.
+
+        Args:
+            delta (float): The distance.
+            pulley (bool): The pulley moves the filament of the engaged slot.
+            extruder (bool): The extruder gears move the gripped filament.
+        """
+        engaged_slot = self.get_engaged_slot() if pulley else None
+        gripped_slot = self.get_gripped_slot() if extruder else None
+        if pulley and engaged_slot is None:
+            self.slipped_distance += abs(delta)
+        for slot in {engaged_slot, gripped_slot} - {None}:
+            self.tips[slot] = self._feed_slot(
+                slot, delta, slot == engaged_slot, slot == gripped_slot
+            )
+
+    def _feed_slot(self, slot: int, delta: float, pulley: bool, extruder: bool) -> float:
+        tip = self.tips[slot]
+        gripped = tip >= self.gear_position
+        if not extruder and gripped:
+            # the gears hold the filament, the pulley slips
+            self.slipped_distance += abs(delta)
+            return tip
+        if not pulley and delta < 0 and tip + delta < self.gear_position:
+            # the gears release the filament once its tip passes them
+            return self.gear_position - TRIGGER_RESOLUTION
+        new_tip = tip + delta
+        if delta > 0:
+            limit = self.nozzle_position if extruder else self.gear_position
+            if (
+                tip < self.finda_position - self.ALIGNMENT_TOLERANCE
+                and not self.is_selector_aligned(slot)
+            ):
+                # the selector body blocks the filament
+                limit = self.finda_position - self.ALIGNMENT_TOLERANCE
+            if new_tip > limit:
+                self.slipped_distance += new_tip - max(limit, tip)
+                new_tip = max(limit, tip)
+        return new_tip
+
+    def cut(self) -> None:
+        """Cut the filament at the cutter."""
+        for slot, tip in enumerate(self.tips):
+            if tip > self.cutter_position:
+                self.tips[slot] = self.cutter_position
+                self.number_of_cuts += 1
+
+    def get_sensor_states(self) -> dict[str, bool]:
+        """Return the sensor states for the current filament tips.
+
+        Returns:
+            dict[str, bool]: The states of the "finda", "switch_sensor",
+                "motion_sensor" and "selector" sensors.
+        """
+        tip = max(self.tips) if self.tips else 0.0
+        selector = self.sim.selector_stepper
+        return {
+            "finda": self.selector_positions is not None
+            and tip >= self.finda_position,
+            "switch_sensor": tip >= self.switch_sensor_position,
+            "motion_sensor": tip >= self.motion_sensor_position,
+            "selector": selector is not None
+            and selector.limits is not None
+            and selector.physical <= selector.limits[0],
+        }
+
+    def get_sensor_state(self, kind: str, print_time: None | float = None) -> bool:
+        """Return the state of a sensor at the given print time.
+
+        Args:
+            kind (str): The sensor kind.
+            print_time (None | float): The print time, None for the state
+                after all the queued moves.
+
+        Returns:
+            bool: The sensor state.
+        """
+        if print_time is None:
+            return self.get_sensor_states()[kind]
+        index = bisect.bisect_right(self.history_times, print_time)
+        return self.history_states[max(0, index - 1)][kind]
+
+    def record(self, print_time: float) -> None:
+        """Record the sensor states at the end of a move.
+
+        The sensor changes are reported to the registered button callbacks and
+        the filament sensors at the print time they happen.
+
+        Args:
+            print_time (float): The print time the move ends.
+        """
+        states = self.get_sensor_states()
+        # forget the states that are not needed anymore
+        now = self.sim.reactor.now
+        while len(self.history_times) > 1 and self.history_times[1] <= now:
+            del self.history_times[0]
+            del self.history_states[0]
+        index = bisect.bisect_right(self.history_times, print_time)
+        self.history_times.insert(index, print_time)
+        self.history_states.insert(index, states)
+
+        for kind, state in states.items():
+            if state == self.reported_states[kind]:
+                continue
+            self.reported_states[kind] = state
+            self.sim.reactor.register_callback(
+                lambda e, kind=kind, state=state: self._handle_sensor_change(
+                    kind, state, e
+                ),
+                print_time,
+            )
+
+    def _handle_sensor_change(self, kind: str, state: bool, eventtime: float) -> None:
+        for callback in self.button_callbacks.get(kind, []):
+            callback(eventtime, int(state))
+        if kind == "switch_sensor" and not state:
+            runout_helper = self.sim.filament_switch_sensor.runout_helper
+            if runout_helper.sensor_enabled:
+                runout_helper.runout_times.append(eventtime)
+
+    def find_trigger(
+        self,
+        stepper: SimManualStepper,
+        endstops: list[SimEndstop],
+        delta: float,
+        triggered: bool,
+    ) -> None | float:
+        """Find the distance a homing move stops at.
+
+        The sensor states change monotonically along a move, so the trigger
+        distance is searched with a bisection on a copy of the mechanics.
+
+        Args:
+            stepper (SimManualStepper): The homing stepper.
+            endstops (list[SimEndstop]): The endstops.
+            delta (float): The full distance of the homing move.
+            triggered (bool): The endstop state to stop at.
+
+        Returns:
+            None | float: The distance travelled until the endstops trigger,
+                None if they don't trigger.
+        """
+
+        def is_triggered(distance: float) -> bool:
+            saved = (list(self.tips), stepper.physical, self.slipped_distance)
+            stepper.apply(math.copysign(distance, delta))
+            result = any(endstop.get_state() == triggered for endstop in endstops)
+            self.tips, stepper.physical, self.slipped_distance = saved
+            return result
+
+        if is_triggered(0.0):
+            return 0.0
+        high = abs(delta)
+        if not is_triggered(high):
+            return None
+        low = 0.0
+        while high - low > TRIGGER_RESOLUTION:
+            middle = (low + high) / 2
+            if is_triggered(middle):
+                high = middle
+            else:
+                low = middle
+        return high
+
+
+class SimConfig:
+    """The ConfigWrapper of a section of a parsed Klipper config file.
+
+    Args:
+        printer (SimPrinter): The printer.
+        fileconfig (configparser.RawConfigParser): The parsed config file.
+        section (str): The section name.
+    """
+
+    error = configparser.Error
+
+    def __init__(
+        self,
+        printer: SimPrinter,
+        fileconfig: configparser.RawConfigParser,
+        section: str,
+    ) -> None:
+        self.printer = printer
+        self.fileconfig = fileconfig
+        self.section = section
+
+    def get_printer(self) -> SimPrinter:
+        return self.printer
+
+    def get_name(self) -> str:
+        return self.section
+
+    def _get(
+        self,
+        option: str,
+        default: object,
+        parser: Callable,
+        minval: None | float = None,
+        maxval: None | float = None,
+        above: None | float = None,
+        below: None | float = None,
+    ) -> object:
+        if not self.fileconfig.has_option(self.section, option):
+            if default is _SENTINEL:
+                raise self.error(
+                    f"Option '{option}' in section '{self.section}' must be specified"
+                )
+            return default
+        try:
+            value = parser(self.fileconfig.get(self.section, option))
+        except ValueError as e:
+            raise self.error(
+                f"Unable to parse option '{option}' in section '{self.section}'"
+            ) from e
+        if (
+            (minval is not None and value < minval)
+            or (maxval is not None and value > maxval)
+            or (above is not None and value <= above)
+            or (below is not None and value >= below)
+        ):
+            raise self.error(
+                f"Option '{option}' in section '{self.section}' is out of range"
+            )
+        return value
+
+    def get(self, option: str, default: object = _SENTINEL) -> object:
+        return self._get(option, default, str)
+
+    def getint(self, option: str, default: object = _SENTINEL, **kwargs) -> int:
+        return self._get(option, default, int, **kwargs)
+
+    def getfloat(self, option: str, default: object = _SENTINEL, **kwargs) -> float:
+        return self._get(option, default, float, **kwargs)
+
+    def getboolean(self, option: str, default: object = _SENTINEL) -> bool:
+        def parse_boolean(value: str) -> bool:
+            try:
+                return configparser.RawConfigParser.BOOLEAN_STATES[value.lower()]
+            except KeyError:
+                raise ValueError(f"Not a boolean: {value}") from None
+
+        return self._get(option, default, parse_boolean)
+
+    def getchoice(
+        self, option: str, choices: dict, default: object = _SENTINEL
+    ) -> object:
+        value = self.get(option, default)
+        if value not in choices:
+            raise self.error(
+                f"Choice '{value}' for option '{option}' in section "
+                f"'{self.section}' is not a valid choice"
+            )
+        return choices[value]
+
+    def _getlist(
+        self, option: str, default: object, parser: Callable, sep: str
+    ) -> list:
+        def parse_list(value: str) -> list:
+            if not value.strip():
+                return []
+            return [parser(part.strip()) for part in value.split(sep)]
+
+        return self._get(option, default, parse_list)
+
+    def getlist(self, option: str, default: object = _SENTINEL, sep: str = ",") -> list:
+        return self._getlist(option, default, str, sep)
+
+    def getintlist(
+        self, option: str, default: object = _SENTINEL, sep: str = ","
+    ) -> list[int]:
+        return self._getlist(option, default, int, sep)
+
+    def getfloatlist(
+        self, option: str, default: object = _SENTINEL, sep: str = ","
+    ) -> list[float]:
+        return self._getlist(option, default, float, sep)
+
+    def has_section(self, section: str) -> bool:
+        return self.fileconfig.has_section(section)
+
+    def getsection(self, section: str) -> SimConfig:
+        return SimConfig(self.printer, self.fileconfig, section)
+
+
+class SimPrinter:
+    """The printer object, holds the simulated printer objects.
+
+    Args:
+        reactor (SimReactor): The reactor.
+        config_file (str): The path reported as the printer config file.
+    """
+
+    config_error = configparser.Error
+    command_error = CommandError
+
+    def __init__(self, reactor: SimReactor, config_file: str) -> None:
+        self.reactor = reactor
+        self.config_file = config_file
+        self.objects = {}
+        self.event_handlers: dict[str, list[Callable]] = {}
+
+    def get_reactor(self) -> SimReactor:
+        return self.reactor
+
+    def get_start_args(self) -> dict:
+        return {"config_file": self.config_file}
+
+    def is_shutdown(self) -> bool:
+        return False
+
+    def add_object(self, name: str, obj: object) -> None:
+        self.objects[name] = obj
+
+    def lookup_object(self, name: str, default: object = _SENTINEL) -> object:
+        if name in self.objects:
+            return self.objects[name]
+        if default is _SENTINEL:
+            raise self.config_error(f"Unknown config object '{name}'")
+        return default
+
+    def load_object(self, config: SimConfig, section: str) -> object:
+        return self.lookup_object(section)
+
+    def register_event_handler(self, event: str, callback: Callable) -> None:
+        self.event_handlers.setdefault(event, []).append(callback)
+
+    def send_event(self, event: str, *args) -> None:
+        for callback in self.event_handlers.get(event, []):
+            callback(*args)
+
+
+class SimResult:
+    """The result of a G-code script run in the simulation."""
+
+    def __init__(self, result: object, stats: dict[str, float]) -> None:
+        self.result = result
+        self.stats = stats
+        self.simulated_time = stats["simulated_time"]
+        self.cpu_time = stats["cpu_time"]
+
+    def __repr__(self) -> str:
+        return (
+            f"<SimResult {self.result!r} simulated={self.simulated_time:0.3f}s "
+            f"cpu={self.cpu_time * 1000:0.1f}ms>"
+        )
+
+
+def read_config_file(path: str) -> configparser.RawConfigParser:
+    """Read a Klipper config file the way Klipper does.
+
+    Args:
+        path (str): The config file path.
+
+    Returns:
+        configparser.RawConfigParser: The parsed config.
+    """
+    fileconfig = configparser.RawConfigParser(
+        strict=False, inline_comment_prefixes=(";", "#")
+    )
+    with open(path) as f:
+        fileconfig.read_string(f.read(), path)
+    return fileconfig
+
+
+def import_mmu3() -> types.ModuleType:
+    """Import extras.mmu3 with the simulated manual_stepper module.
+
+    Returns:
+        types.ModuleType: The extras.mmu3 module.
+    """
+    if "extras.manual_stepper" not in sys.modules:
+        manual_stepper = types.ModuleType("extras.manual_stepper")
+        manual_stepper.ManualStepper = SimManualStepper
+        sys.modules["extras.manual_stepper"] = manual_stepper
+    from extras import mmu3
+
+    return mmu3
+
+
+class KlipperSimulation:
+    """A simulated printer running the real MMU3 class.
+
+    Args:
+        state_dir (str): The directory for the MMU3 state file.
+        config_path (str): The Klipper config file with the mmu3 section.
+        options (None | dict[str, str]): Options overriding the ones in the
+            mmu3 section.
+        extruder_temp (float): The initial extruder temperature and target.
+        motion_sensor (bool): Simulate the filament motion sensor.
+        loaded_slot (None | int): The slot whose filament is loaded to the
+            nozzle initially.
+        **path_kwargs: Passed to FilamentPath to change the path geometry.
+    """
+
+    def __init__(
+        self,
+        state_dir: str,
+        config_path: str = DEFAULT_CONFIG_PATH,
+        options: None | dict[str, str] = None,
+        extruder_temp: float = 215.0,
+        motion_sensor: bool = True,
+        loaded_slot: None | int = None,
+        **path_kwargs,
+    ) -> None:
+        mmu3_module = import_mmu3()
+        self.fileconfig = read_config_file(config_path)
+        section = "mmu3 MMU3"
+        options = {"state_file": os.path.join(state_dir, "mmu3_state.json"), **(options or {})}
+        for option, value in options.items():
+            self.fileconfig.set(section, option, str(value))
+
+        self.reactor = SimReactor()
+        self.printer = SimPrinter(self.reactor, os.path.join(state_dir, "printer.cfg"))
+        self.mcu = SimMCU(self.reactor)
+        self.gcode = SimGCodeDispatch(self)
+        self.pins = SimPins(self)
+        heater = SimHeater(self.reactor, extruder_temp)
+        self.heaters = SimHeaters(self)
+        self.heaters.heaters["extruder"] = heater
+        self.extruder = SimExtruder(heater)
+        self.toolhead = SimToolhead(self, self.extruder)
+        self.gcode_move = SimGCodeMove(self)
+        self.query_endstops = SimQueryEndstops()
+        self.display_status = SimDisplayStatus()
+        self.is_printer_paused = False
+        self.idler_stepper = None
+        self.selector_stepper = None
+        self.pulley_stepper = None
+
+        mmu3_config = SimConfig(self.printer, self.fileconfig, section)
+        self.number_of_tools = mmu3_config.getint("number_of_tools", 5)
+        no_selector = mmu3_config.getboolean("enable_no_selector_mode", False)
+        idler_positions = mmu3_config.getfloatlist("idler_positions")
+        selector_positions = mmu3_config.getfloatlist("selector_positions")
+        self.path = FilamentPath(
+            self,
+            self.number_of_tools,
+            idler_positions,
+            None if no_selector else selector_positions,
+            **path_kwargs,
+        )
+        if loaded_slot is not None:
+            self.path.tips[loaded_slot] = self.path.nozzle_position
+        self.filament_switch_sensor = SimSwitchSensor(self)
+        self.filament_motion_sensor = SimEncoderSensor(self) if motion_sensor else None
+
+        # the steppers
+        finda_endstop = SimEndstop(self, "finda")
+        selector_endstop = SimEndstop(self, "selector")
+        pulley_section = self.fileconfig["manual_stepper pulley_stepper"]
+        self.pins.pin_kinds[normalize_pin(pulley_section["endstop_pin"])] = "finda"
+        switch_sensor_section = mmu3_config.get(
+            "filament_switch_sensor_name", "filament_switch_sensor my_filament_sensor"
+        )
+        switch_sensor_pin = None
+        if self.fileconfig.has_section(switch_sensor_section):
+            switch_sensor_pin = self.fileconfig.get(
+                switch_sensor_section, "switch_pin", fallback=None
+            )
+        if switch_sensor_pin is not None:
+            self.pins.pin_kinds[normalize_pin(switch_sensor_pin)] = "switch_sensor"
+        self.pulley_stepper = self.create_manual_stepper(
+            "manual_stepper pulley_stepper", finda_endstop
+        )
+        homing_lengths = mmu3_config.getfloatlist("idler_homing_move_lengths", [7, -95])
+        span = abs(homing_lengths[-1])
+        self.idler_stepper = self.create_manual_stepper(
+            "manual_stepper idler_stepper",
+            limits=(0.0, span) if homing_lengths[-1] < 0 else (-span, 0.0),
+            physical=idler_positions[-1],
+        )
+        self.selector_stepper = self.create_manual_stepper(
+            "manual_stepper selector_stepper",
+            selector_endstop,
+            limits=(
+                0.0,
+                abs(mmu3_config.getfloat("selector_homing_move_length", -76)),
+            ),
+            physical=selector_positions[-1],
+        )
+        self.path.reset_history()
+        self.query_endstops.endstops = [
+            (finda_endstop, "manual_stepper pulley_stepper"),
+            (selector_endstop, "manual_stepper selector_stepper"),
+        ]
+
+        for name, obj in {
+            "gcode": self.gcode,
+            "gcode_move": self.gcode_move,
+            "toolhead": self.toolhead,
+            "extruder": self.extruder,
+            "heaters": self.heaters,
+            "pins": self.pins,
+            "buttons": SimButtons(self),
+            "homing": SimHoming(),
+            "query_endstops": self.query_endstops,
+            "motion_queuing": SimMotionQueuing(),
+            "display_status": self.display_status,
+            mmu3_config.get(
+                "filament_switch_sensor_name",
+                "filament_switch_sensor my_filament_sensor",
+            ): self.filament_switch_sensor,
+        }.items():
+            self.printer.add_object(name, obj)
+        if self.filament_motion_sensor is not None:
+            self.printer.add_object(
+                mmu3_config.get(
+                    "filament_motion_sensor_name",
+                    "filament_motion_sensor encoder_sensor",
+                ),
+                self.filament_motion_sensor,
+            )
+        self.register_commands()
+
+        self.mmu3 = mmu3_module.load_config_prefix(mmu3_config)
+        self.printer.add_object(section, self.mmu3)
+        self.printer.send_event("klippy:mcu_identify")
+        self.printer.send_event("klippy:connect")
+        self.printer.send_event("klippy:ready")
+
+    def create_manual_stepper(
+        self,
+        section: str,
+        endstop: None | SimEndstop = None,
+        limits: None | tuple[float, float] = None,
+        physical: float = 0.0,
+    ) -> SimManualStepper:
+        """Create a manual stepper from its config section.
+
+        Args:
+            section (str): The config section name.
+            endstop (None | SimEndstop): The endstop of the stepper.
+            limits (None | tuple[float, float]): The hard stops.
+            physical (float): The initial physical position.
+
+        Returns:
+            SimManualStepper: The manual stepper.
+        """
+        config = SimConfig(self.printer, self.fileconfig, section)
+        manual_stepper = SimManualStepper(
+            self,
+            section,
+            config.getfloat("velocity", 5.0),
+            config.getfloat("accel", 0.0),
+            endstop,
+            limits,
+            physical,
+        )
+        self.printer.add_object(section, manual_stepper)
+        return manual_stepper
+
+    def is_pulley_synced(self) -> bool:
+        """Return if the pulley stepper moves with the extruder.
+
+        Returns:
+            bool: True if the pulley is synced to the extruder.
+        """
+        return self.pulley_stepper.rail.stepper.get_trapq() is self.extruder.get_trapq()
+
+    def register_commands(self) -> None:
+        """Register the G-code commands and the gcode macros of the config."""
+        gcode = self.gcode
+        gcode_move = self.gcode_move
+        for name in [
+            "G1",
+            "G90",
+            "G91",
+            "G92",
+            "M82",
+            "M83",
+            "M220",
+            "SAVE_GCODE_STATE",
+            "RESTORE_GCODE_STATE",
+        ]:
+            gcode.register_command(name, getattr(gcode_move, f"cmd_{name}"))
+        gcode.register_command("G0", gcode_move.cmd_G1)
+        gcode.register_command("G4", self.cmd_G4)
+        gcode.register_command("M400", lambda gcmd: self.toolhead.wait_moves())
+        gcode.register_command("M104", self.cmd_M104)
+        gcode.register_command("M109", self.cmd_M109)
+        gcode.register_command("M117", self.cmd_M117)
+        gcode.register_command(
+            "M118", lambda gcmd: gcode.respond_info(gcmd.get_raw_command_parameters())
+        )
+        gcode.register_command("RESPOND", self.cmd_RESPOND)
+        gcode.register_command("PAUSE", self.cmd_PAUSE)
+        gcode.register_command("RESUME", self.cmd_RESUME)
+        for name in [
+            "M300",
+            "SET_IDLE_TIMEOUT",
+            "SET_PRESSURE_ADVANCE",
+            "SET_TMC_CURRENT",
+            "SET_TMC_FIELD",
+        ]:
+            gcode.register_command(name, lambda gcmd: None)
+
+        for section in self.fileconfig.sections():
+            if not section.startswith("gcode_macro "):
+                continue
+            name = section.split(None, 1)[1].upper()
+            script = self.fileconfig.get(section, "gcode", fallback="")
+            gcode.register_command(name, self.create_macro(name, script))
+
+    def create_macro(self, name: str, script: str) -> Callable:
+        """Create the handler of a gcode macro.
+
+        Only the {params.NAME} templates are supported.
+
+        Args:
+            name (str): The macro name.
+            script (str): The macro G-code.
+
+        Returns:
+            Callable: The command handler.
+        """
+
+        def run_macro(gcmd: SimGCodeCommand) -> None:
+            params = gcmd.get_command_parameters()
+            self.gcode.run_script_from_command(
+                MACRO_PARAM_REGEX.sub(lambda m: params.get(m.group(1).upper(), ""), script)
+            )
+            if name == "CUT_FILAMENT_IN_EXTRUDER":
+                self.path.cut()
+
+        return run_macro
+
+    def cmd_G4(self, gcmd: SimGCodeCommand) -> None:
+        if "S" in gcmd.get_command_parameters():
+            delay = gcmd.get_float("S", 0.0, minval=0.0)
+        else:
+            delay = gcmd.get_float("P", 0.0, minval=0.0) / 1000.0
+        self.toolhead.dwell(delay)
+
+    def cmd_M104(self, gcmd: SimGCodeCommand) -> None:
+        self.heaters.set_temperature(
+            self.extruder.heater, gcmd.get_float("S", 0.0), wait=False
+        )
+
+    def cmd_M109(self, gcmd: SimGCodeCommand) -> None:
+        self.heaters.set_temperature(
+            self.extruder.heater, gcmd.get_float("S", 0.0), wait=True
+        )
+
+    def cmd_M117(self, gcmd: SimGCodeCommand) -> None:
+        self.display_status.message = gcmd.get_raw_command_parameters()
+
+    def cmd_RESPOND(self, gcmd: SimGCodeCommand) -> None:
+        self.gcode.respond_raw(f"// {gcmd.get('MSG', '')}")
+
+    def cmd_PAUSE(self, gcmd: SimGCodeCommand) -> None:
+        self.is_printer_paused = True
+
+    def cmd_RESUME(self, gcmd: SimGCodeCommand) -> None:
+        self.is_printer_paused = False
+
+    def get_counters(self) -> dict[str, float]:
+        """Return the cumulative counters of the simulation.
+
+        Returns:
+            dict[str, float]: The counters.
+        """
+        return {
+            "number_of_drains": self.toolhead.number_of_drains,
+            "number_of_queries": self.mcu.number_of_queries,
+            "number_of_gcode_lines": self.gcode.number_of_lines,
+            "number_of_moves": sum(
+                stepper.number_of_moves + stepper.number_of_homing_moves
+                for stepper in (
+                    self.idler_stepper,
+                    self.selector_stepper,
+                    self.pulley_stepper,
+                )
+            )
+            + self.toolhead.number_of_moves,
+        }
+
+    def run_gcode(self, script: str) -> SimResult:
+        """Run a G-code script and wait for all the moves to finish.
+
+        Args:
+            script (str): The G-code script.
+
+        Returns:
+            SimResult: The return value of the last command, and the time and
+                counter differences of the run.
+        """
+        counters = self.get_counters()
+        start_time = self.reactor.monotonic()
+        cpu_start_time = time.process_time()
+        self.gcode.mutex.locked = True
+        try:
+            self.gcode.last_result = None
+            self.gcode.run_script_from_command(script)
+        finally:
+            self.gcode.mutex.locked = False
+        end_time = max(
+            [self.toolhead.print_time]
+            + [
+                stepper.next_cmd_time
+                for stepper in (
+                    self.idler_stepper,
+                    self.selector_stepper,
+                    self.pulley_stepper,
+                )
+            ]
+        )
+        self.reactor.pause(max(self.reactor.now, end_time))
+        cpu_time = time.process_time() - cpu_start_time
+        stats = {
+            "simulated_time": self.reactor.monotonic() - start_time,
+            "cpu_time": cpu_time,
+        }
+        for name, value in self.get_counters().items():
+            stats[name] = value - counters[name]
+        return SimResult(self.gcode.last_result, stats)
+
+    def idle(self, duration: float) -> None:
+        """Let the simulated time pass without running any command.
+
+        Args:
+            duration (float): The time in seconds.
+        """
+        self.reactor.pause(self.reactor.now + duration)
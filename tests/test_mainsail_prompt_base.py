@@ -16,3 +16,11 @@ def test_to_gcode_raises_not_implemented_error():
 
     assert str(cm.value) == "This needs to be implemented in the derived class"
 
+
+def test_to_actions_raises_not_implemented_error():
+    """to_actions() raises NotImplementedError."""
+    prompt = MainsailPromptBase()
+    with pytest.raises(NotImplementedError) as cm:
+        prompt.to_actions()
+
+    assert str(cm.value) == "This needs to be implemented in the derived class"
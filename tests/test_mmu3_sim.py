@@ -0,0 +1,569 @@
+"""Run the MMU3 tool changes end to end in the simulated printer."""
+
+# Standard Library Imports
+import configparser
+import math
+import os
+
+# Third Party Imports
+import pytest
+
+# Local Imports
+from klipper_sim import (
+    REPO_PATH,
+    KlipperSimulation,
+    calc_move_time,
+    import_mmu3,
+    move_duration,
+    time_to_distance,
+)
+
+
+@pytest.fixture
+def sim(tmp_path):
+    return KlipperSimulation(str(tmp_path))
+
+
+def test_move_duration_is_trapezoidal():
+    """The move durations follow the trapezoidal velocity profile."""
+    # accelerates for 0.05 s, cruises for 1.95 s
+    assert move_duration(100, 50, 1000) == pytest.approx(2.05)
+    # never reaches the cruise speed
+    assert move_duration(1, 100, 100) == pytest.approx(0.2)
+    # no acceleration limit
+    assert move_duration(-10, 5, 0) == pytest.approx(2.0)
+    assert calc_move_time(0, 50, 1000) == (0.0, 0.0, 50)
+
+
+def test_time_to_distance_is_consistent_with_move_duration():
+    """Travelling the full distance takes the whole move duration."""
+    assert time_to_distance(100, 100, 50, 1000) == pytest.approx(2.05)
+    assert time_to_distance(0.5, 1, 100, 100) == pytest.approx(0.1)
+    assert time_to_distance(50, 100, 50, 1000) == pytest.approx(1.025)
+
+
+def test_tool_change_from_empty(sim):
+    """T0 homes the MMU and loads the filament to the nozzle."""
+    result = sim.run_gcode("T0")
+    assert result.result is True
+    assert sim.path.tips[0] == sim.path.nozzle_position
+    assert sim.mmu3.current_filament == 0
+    assert sim.mmu3.is_homed is True
+    assert sim.is_printer_paused is False
+    assert sim.gcode.unknown_commands == []
+    # seconds of mechanical time in a fraction of a second of CPU time
+    assert result.simulated_time > 5.0
+    assert result.cpu_time < 1.0
+    assert result.stats["number_of_drains"] > 0
+    assert result.stats["number_of_queries"] > 0
+
+
+def test_tool_change_between_slots(sim):
+    """T1 parks the filament of T0 behind the FINDA and loads T1."""
+    sim.run_gcode("T0")
+    result = sim.run_gcode("T1")
+    assert result.result is True
+    assert sim.path.tips[0] < sim.path.finda_position
+    assert sim.path.tips[1] == sim.path.nozzle_position
+    assert sim.path.number_of_cuts == 1
+    assert sim.mmu3.current_filament == 1
+    assert sim.mmu3.number_of_successful_material_changes == 2
+    # the runout sensor is disabled while the filament is unloaded
+    assert sim.filament_switch_sensor.runout_helper.runout_times == []
+    assert sim.filament_switch_sensor.runout_helper.sensor_enabled is True
+
+
+def test_tool_change_on_the_12x(tmp_path):
+    """The tool changes work with the MMU3-12x geometry."""
+    sim = KlipperSimulation(
+        str(tmp_path), config_path=os.path.join(REPO_PATH, "mmu3-12x.cfg")
+    )
+    assert sim.run_gcode("T11").result is True
+    assert sim.run_gcode("T3").result is True
+    assert sim.path.tips[3] == sim.path.nozzle_position
+    assert sim.path.tips[11] < sim.path.finda_position
+
+
+def test_tool_change_in_no_selector_mode(tmp_path):
+    """The filament is unloaded without the FINDA in the no selector mode."""
+    sim = KlipperSimulation(
+        str(tmp_path), options={"enable_no_selector_mode": "True"}
+    )
+    assert sim.run_gcode("T0").result is True
+    assert sim.run_gcode("T1").result is True
+    assert sim.path.tips[0] < sim.path.gear_position
+    assert sim.path.tips[1] > sim.path.gear_position
+
+
+def test_tool_change_with_a_cold_extruder_pauses(tmp_path):
+    """The extruder refuses to extrude below the minimum temperature."""
+    sim = KlipperSimulation(str(tmp_path), extruder_temp=25.0)
+    result = sim.run_gcode("T0")
+    assert result.result is False
+    assert sim.is_printer_paused is True
+    assert sim.mmu3.is_paused is True
+    assert sim.path.tips[0] < sim.path.nozzle_position
+
+
+def test_m109_waits_for_the_heater_ramp(sim):
+    """M109 advances the clock by the time the heater needs."""
+    heater = sim.heaters.lookup_heater("extruder")
+    result = sim.run_gcode("M109 S240")
+    expected_time = (240 - 1 - 215) / heater.heating_rate
+    assert result.simulated_time == pytest.approx(expected_time)
+    assert heater.get_temp(sim.reactor.monotonic())[0] == pytest.approx(239)
+
+
+def test_finda_homing_move_stops_at_the_trigger_position(sim):
+    """The pulley stops when the filament reaches the FINDA."""
+    sim.run_gcode("SELECT_TOOL VALUE=2")
+    sim.mmu3.pulley_stepper.do_set_position(0)
+    sim.mmu3.pulley_stepper.do_homing_move(
+        100, speed=80, accel=200, triggered=True, check_trigger=True
+    )
+    assert math.isclose(
+        sim.path.tips[2], sim.path.finda_position, abs_tol=0.011
+    )
+    assert sim.mmu3.pulley_stepper.get_position()[0] == pytest.approx(
+        sim.path.tips[2]
+    )
+    assert sim.mmu3.is_filament_in_finda() is True
+
+
+# slow FINDA homing and a long park distance, where the FINDA approach pays off
+SLOW_FINDA_OPTIONS = {
+    "finda_unload_length": "40",
+    "finda_load_speed": "20",
+    "finda_load_accel": "50",
+}
+
+
+def test_move_duration_estimates_match_the_simulation():
+    """The duration estimates of MMU3 match the trapezoidal move durations."""
+    from extras.mmu3 import get_homing_duration, get_move_duration
+
+    assert get_move_duration(100, 50, 1000) == pytest.approx(
+        move_duration(100, 50, 1000)
+    )
+    assert get_move_duration(1, 100, 100) == pytest.approx(move_duration(1, 100, 100))
+    assert get_homing_duration(0.5, 100, 100) == pytest.approx(
+        time_to_distance(0.5, 100, 100, 100)
+    )
+    assert get_homing_duration(50, 50, 1000) == pytest.approx(
+        time_to_distance(50, 100, 50, 1000)
+    )
+
+
+@pytest.mark.parametrize(
+    "enable_finda_approach,expected_approach", [("True", True), ("False", False)]
+)
+def test_finda_approach_speeds_up_the_finda_load(
+    tmp_path, enable_finda_approach, expected_approach
+):
+    """A parked tip is moved fast to just short of FINDA."""
+    sim = KlipperSimulation(
+        str(tmp_path),
+        options={
+            **SLOW_FINDA_OPTIONS,
+            "enable_finda_approach": enable_finda_approach,
+            "debug": "True",
+        },
+    )
+    sim.run_gcode("T0")
+    sim.run_gcode("T1")
+    assert sim.mmu3.parked_tips.get(0) == pytest.approx(-40.0)
+    assert sim.mmu3.is_finda_approach_faster(40.0) is expected_approach
+    result = sim.run_gcode("T0")
+    assert result.result is True
+    assert sim.path.tips[0] == sim.path.nozzle_position
+    # the tip is past FINDA now
+    assert sim.mmu3.parked_tips.get(0) is None
+    assert (
+        any("after the approach" in response for response in sim.gcode.responses)
+        is expected_approach
+    )
+
+
+def test_finda_approach_is_faster_than_homing(tmp_path):
+    """The tool change back to a parked slot takes less time."""
+    times = []
+    for enable_finda_approach in ("True", "False"):
+        state_dir = tmp_path / enable_finda_approach
+        state_dir.mkdir()
+        sim = KlipperSimulation(
+            str(state_dir),
+            options={
+                **SLOW_FINDA_OPTIONS,
+                "enable_finda_approach": enable_finda_approach,
+            },
+        )
+        sim.run_gcode("T0")
+        sim.run_gcode("T1")
+        times.append(sim.run_gcode("T0").simulated_time)
+    assert times[0] < times[1] - 0.5
+
+
+def test_finda_approach_falls_back_to_the_loop(tmp_path):
+    """The FINDA load loop is run if FINDA doesn't trigger where expected."""
+    sim = KlipperSimulation(
+        str(tmp_path), options={**SLOW_FINDA_OPTIONS, "debug": "True"}
+    )
+    sim.run_gcode("T0")
+    sim.run_gcode("T1")
+    # the filament has been pulled back by hand
+    sim.path.tips[0] -= 100
+    result = sim.run_gcode("T0")
+    assert result.result is True
+    assert sim.path.tips[0] == sim.path.nozzle_position
+    assert any("falling back" in response for response in sim.gcode.responses)
+
+
+def test_stock_config_skips_the_finda_approach(sim):
+    """Homing the short stock park distance is faster than the approach."""
+    sim.run_gcode("T0")
+    sim.run_gcode("T1")
+    assert sim.mmu3.parked_tips.get_distance_to_finda(0) == pytest.approx(5.0)
+    assert sim.mmu3.is_finda_approach_faster(5.0) is False
+
+
+def test_parked_tips_follow_the_filament(sim):
+    """The tracked tip positions match the simulated filament."""
+    sim.run_gcode("T0")
+    sim.run_gcode("T1")
+    sim.run_gcode("M702")
+    for slot in (0, 1):
+        assert sim.mmu3.parked_tips.get(slot) == pytest.approx(
+            sim.path.tips[slot] - sim.path.finda_position, abs=0.02
+        )
+    # the other slots have not been seen yet
+    assert sim.mmu3.parked_tips.get(2) is None
+    sim.run_gcode("UNLOCK_MMU")
+    assert sim.mmu3.parked_tips.to_list() == [None] * 5
+
+
+def test_parked_tips_are_persisted(tmp_path):
+    """The tip positions are restored from the state file."""
+    sim = KlipperSimulation(str(tmp_path))
+    sim.run_gcode("T0")
+    sim.run_gcode("T1")
+    sim.run_gcode("M702")
+    sim.mmu3.save_state(sim.mmu3.get_state())
+    restarted_sim = KlipperSimulation(str(tmp_path))
+    assert restarted_sim.mmu3.state_restored is True
+    assert restarted_sim.mmu3.parked_tips.to_list() == [-5.0, -5.0, None, None, None]
+
+
+def test_single_slot_preload_confirms_the_parked_tip(sim):
+    """An explicitly preloaded slot is loaded to FINDA even if it is parked."""
+    sim.run_gcode("T0")
+    sim.run_gcode("M702")
+    assert sim.mmu3.is_tip_parked(0) is True
+    # the filament was moved by hand, the tracked position is wrong
+    sim.path.tips[0] -= 20
+    result = sim.run_gcode("PRE_LOAD_FILAMENT_TO_FINDA VALUE=0")
+    assert result.result is True
+    assert result.stats["number_of_queries"] > 0
+    assert sim.mmu3.is_tip_parked(0) is True
+    assert sim.path.tips[0] == pytest.approx(sim.path.finda_position - 5, abs=0.02)
+
+
+def test_bulk_preload_skips_the_parked_tips(sim):
+    """The slots already parked behind FINDA are not loaded to FINDA again."""
+    sim.run_gcode("T0")
+    sim.run_gcode("M702")
+    sim.run_gcode("SELECT_TOOL VALUE=0")
+    result = sim.run_gcode("PRE_LOAD_FILAMENT_TO_FINDA")
+    assert result.result is True
+    assert "// MMU3: Preloaded 4 slots" in " ".join(sim.gcode.responses)
+    assert all(sim.mmu3.is_tip_parked(slot) for slot in range(5))
+
+
+def test_cut_confirms_the_known_tip_at_finda(sim):
+    """The cut in the MMU loads a known tip to FINDA with the fast approach."""
+    sim.run_gcode("T0")
+    sim.run_gcode("M702")
+    # the filament was moved by hand, the tracked position is wrong
+    sim.path.tips[0] -= 20
+    known_tip = sim.run_gcode("K0")
+    assert known_tip.result is True
+    # the cut piece is gone, the tip is parked again
+    assert sim.mmu3.is_tip_parked(0) is True
+    known_tip_position = sim.path.tips[0]
+    sim.run_gcode("UNLOCK_MMU")
+    sim.run_gcode("HOME_MMU")
+    unknown_tip = sim.run_gcode("K0")
+    assert unknown_tip.result is True
+    # both cuts start from the FINDA trigger point
+    assert sim.path.tips[0] == pytest.approx(known_tip_position, abs=0.02)
+    assert known_tip.simulated_time < unknown_tip.simulated_time
+
+
+def test_bulk_preload_sweeps_from_the_current_position(sim):
+    """The slots are preloaded in the direction of the shorter route."""
+    sim.run_gcode("HOME_MMU")
+    assert sim.mmu3.get_preload_order([0, 2, 4]) == [4, 2, 0]
+    sim.run_gcode("SELECT_TOOL VALUE=0")
+    assert sim.mmu3.get_preload_order([4, 2, 0]) == [0, 2, 4]
+    assert sim.mmu3.get_select_route_duration(
+        [0, 2, 4]
+    ) < sim.mmu3.get_select_route_duration([4, 2, 0])
+
+
+def test_bulk_preload_is_faster_than_the_slot_order(tmp_path):
+    """The bulk preload parks every slot and reports the time spent on them."""
+    sim = KlipperSimulation(str(tmp_path / "bulk"))
+    sim.run_gcode("HOME_MMU")
+    assert sim.mmu3.get_preload_order(list(range(5))) == [4, 3, 2, 1, 0]
+    result = sim.run_gcode("PRE_LOAD_FILAMENT_TO_FINDA")
+    assert result.result is True
+    assert all(sim.mmu3.is_tip_parked(slot) for slot in range(5))
+    assert any(
+        response.startswith("// MMU3: Preloaded 5 slots: T4 ")
+        for response in sim.gcode.responses
+    )
+    assert any(
+        response.startswith("// MMU3: PRE_LOAD_FILAMENT_TO_FINDA took")
+        for response in sim.gcode.responses
+    )
+    # nothing left to preload
+    assert sim.run_gcode("PRE_LOAD_FILAMENT_TO_FINDA").simulated_time == 0
+    assert "// MMU3: All slots are already parked behind FINDA" in sim.gcode.responses
+
+    # the same slots one by one in the slot order
+    slot_order_sim = KlipperSimulation(str(tmp_path / "slot_order"))
+    slot_order_sim.run_gcode("HOME_MMU")
+    slot_order_time = sum(
+        slot_order_sim.run_gcode(
+            f"PRE_LOAD_FILAMENT_TO_FINDA VALUE={slot}"
+        ).simulated_time
+        for slot in range(5)
+    )
+    assert result.simulated_time < slot_order_time - 1.0
+
+
+def test_tool_mapping_maps_the_tools_to_the_slots(tmp_path):
+    """T<n> loads the slot that the tool is mapped to."""
+    sim = KlipperSimulation(str(tmp_path), options={"tool_mapping": "2, 0, 1, 3, 4"})
+    assert sim.run_gcode("T0").result is True
+    assert sim.path.tips[2] == sim.path.nozzle_position
+    assert sim.mmu3.current_filament == 2
+    assert sim.run_gcode("T1").result is True
+    assert sim.path.tips[0] == sim.path.nozzle_position
+    assert sim.path.tips[2] < sim.path.finda_position
+
+
+def test_failed_mapped_tool_change_retries_the_same_tool(tmp_path):
+    """The error prompt and messages use the tool number, not the slot."""
+    sim = KlipperSimulation(str(tmp_path), options={"tool_mapping": "2, 0, 1, 3, 4"})
+    # no filament in slot 2 to load to FINDA
+    sim.path.tips[2] = -10000.0
+    assert not sim.run_gcode("T0").result
+    buttons = [
+        response
+        for response in sim.gcode.responses
+        if "prompt_button Retry" in response
+    ]
+    assert buttons == [
+        "// action:prompt_button Retry T0|PROMPT_CLOSE_AND_RUN_COMMAND COMMAND=T0|"
+    ]
+    assert "// action:prompt_text T0 failed!" in sim.gcode.responses
+
+
+def test_staging_reports_the_slot_of_the_next_tool(tmp_path):
+    """The lookahead reports the slot the next tool is mapped to."""
+    sim = KlipperSimulation(str(tmp_path), options={"tool_mapping": "2, 0, 1, 3, 4"})
+    sim.run_gcode("T0")
+    sim.mmu3.stage_next_tool(1, 10.0)
+    assert sim.mmu3.staged_tool == 0
+    assert sim.mmu3.get_status(0)["staged_tool"] == 0
+
+
+def test_ramming_profile_converts_absolute_extrusion():
+    """Absolute extruder moves are parsed as relative distances."""
+    ramming_profile = import_mmu3().RammingProfile
+    relative = ramming_profile.from_gcode(
+        "relative", "G91\nG1 E2 F600\nG1 E-5\nG4 P500\nG1 E1.5"
+    )
+    absolute = ramming_profile.from_gcode(
+        "absolute",
+        "M82\nG92 E10\nG1 E12 F600\nG1 E7 ; retract\nG4 P500\nG92 E0\nG1 E1.5",
+    )
+    assert absolute.steps == relative.steps
+    # G91 makes the extrusion relative, G90 restores the M82 absolute mode
+    mixed = ramming_profile.from_gcode(
+        "mixed", "M82\nG91\nG1 E2 F600\nG90\nG1 E-3\nM83\nG1 E1.5"
+    )
+    assert [step[1] for step in mixed.steps] == [2, -5, 1.5]
+
+
+def test_sensor_bowden_load_uses_the_switch_sensor_pin(tmp_path):
+    """The bowden load homes to the switch_pin of the filament switch sensor."""
+    config_path = tmp_path / "printer.cfg"
+    with open(os.path.join(REPO_PATH, "mmu3.cfg")) as f:
+        config = f.read()
+    config_path.write_text(
+        config + "\n[filament_switch_sensor my_filament_sensor]\nswitch_pin: !PC15\n"
+    )
+    sim = KlipperSimulation(
+        str(tmp_path),
+        config_path=str(config_path),
+        options={"enable_sensor_bowden_load": "True"},
+    )
+    assert sim.run_gcode("T0").result is True
+    assert sim.path.tips[0] > sim.path.gear_position
+    # the trigger position of the switch sensor was learned
+    assert len(sim.mmu3.bowden_calibration.samples["sensor_load"][0]) == 1
+
+    sim.run_gcode("M702")
+    sim.run_gcode("SELECT_TOOL VALUE=0")
+    sim.run_gcode("LOAD_FILAMENT_TO_FINDA")
+    sim.mmu3.pulley_stepper.homing_accel = 123.0
+    assert sim.run_gcode("LOAD_FILAMENT_FROM_FINDA_TO_EXTRUDER").result is True
+    assert len(sim.mmu3.bowden_calibration.samples["sensor_load"][0]) == 2
+    # the homing acceleration of the pulley is restored after the load
+    assert sim.mmu3.pulley_stepper.homing_accel == 123.0
+
+    # the runout pin is not used as an endstop without the sensor load
+    sim = KlipperSimulation(str(tmp_path / "disabled"), config_path=str(config_path))
+    assert sim.mmu3.filament_switch_sensor_endstop is None
+
+
+def test_sensor_bowden_load_requires_the_switch_sensor_section(tmp_path):
+    """The sensor bowden load can not be enabled without a switch_pin."""
+    with pytest.raises(configparser.Error, match="switch_pin"):
+        KlipperSimulation(
+            str(tmp_path), options={"enable_sensor_bowden_load": "True"}
+        )
+
+
+def test_status_is_rebuilt_after_a_reported_value_is_set(sim):
+    """The cached status dict is reused until a reported attribute is set."""
+    status = sim.mmu3.get_status(0)
+    assert sim.mmu3.get_status(0) is status
+    sim.run_gcode("T0")
+    status = sim.mmu3.get_status(0)
+    assert status["current_tool"] is None
+    assert status["current_filament"] == 0
+    assert status["number_of_material_changes"] == 1
+    assert sim.mmu3.get_status(0) is status
+    sim.mmu3.lookahead.next_tool = 1
+    assert sim.mmu3.get_status(0)["next_tool"] == 1
+
+
+def test_idler_moves_go_through_the_motion_coordinator(sim):
+    """Homing, selecting and unselecting move the idler with the coordinator."""
+    coordinator = sim.mmu3.motion_coordinator
+    sim.run_gcode("HOME_MMU")
+    moves = coordinator.number_of_coordinated_moves
+    sim.run_gcode("HOME_IDLER")
+    assert coordinator.number_of_coordinated_moves == moves + 3
+    sim.run_gcode("SELECT_TOOL VALUE=2")
+    sim.run_gcode("UNSELECT_TOOL")
+    assert coordinator.number_of_coordinated_moves == moves + 5
+    assert sim.idler_stepper.position == sim.mmu3.idler_positions[-1]
+
+
+def test_heater_moves_to_the_next_slot_temperature_during_the_unload(tmp_path):
+    """The heat up overlaps with the unload and the bowden load."""
+    sim = KlipperSimulation(
+        str(tmp_path / "slot_temperatures"),
+        options={"slot_temperatures": "215, 240, 0, 0, 0", "debug": "True"},
+    )
+    heater = sim.heaters.lookup_heater("extruder")
+    sim.run_gcode("T0")
+    result = sim.run_gcode("T1")
+    assert result.result is True
+    assert sim.path.tips[1] == sim.path.nozzle_position
+    assert heater.target_temp == 240
+    assert heater.get_current_temp() >= 239
+    assert "// MMU3: Heating to 240.0" in sim.gcode.responses
+    # the slot without a temperature leaves the heater alone
+    sim.run_gcode("T2")
+    assert heater.target_temp == 240
+
+    # the same tool change with the heater set after it
+    serial_sim = KlipperSimulation(str(tmp_path / "serial"))
+    serial_sim.run_gcode("T0")
+    serial_time = (
+        serial_sim.run_gcode("T1").simulated_time
+        + serial_sim.run_gcode("M109 S240").simulated_time
+    )
+    assert result.simulated_time < serial_time - 5.0
+
+
+def test_slot_temperature_command(sim):
+    """The slot temperatures can be changed at runtime."""
+    assert sim.run_gcode("MMU_SLOT_TEMPERATURE SLOT=3 TEMP=250").result is True
+    assert sim.mmu3.get_slot_temperature(3) == 250
+    assert "// MMU3: Slot 3: 250" in sim.gcode.responses
+    assert sim.run_gcode("MMU_SLOT_TEMPERATURE SLOT=3 TEMP=100").result is False
+    assert sim.run_gcode("MMU_SLOT_TEMPERATURE TEMP=220").result is False
+    assert sim.mmu3.get_slot_temperature(3) == 250
+
+
+def test_deferred_heating_loads_while_heating(tmp_path):
+    """The cold-safe load phases run while the nozzle heats up."""
+    sim = KlipperSimulation(
+        str(tmp_path / "deferred"),
+        extruder_temp=25.0,
+        options={"enable_deferred_heating": "True"},
+    )
+    sim.run_gcode("M104 S215")
+    result = sim.run_gcode("T0")
+    assert result.result is True
+    assert sim.is_printer_paused is False
+    assert sim.path.tips[0] == sim.path.nozzle_position
+    assert sim.heaters.lookup_heater("extruder").target_temp == 215
+
+    # the same print start waiting for the heater first
+    blocking_sim = KlipperSimulation(str(tmp_path / "blocking"), extruder_temp=25.0)
+    blocking_time = sum(
+        blocking_sim.run_gcode(command).simulated_time
+        for command in ("M109 S215", "T0")
+    )
+    assert result.simulated_time < blocking_time - 5.0
+
+
+def test_deferred_heating_turns_on_the_heater(tmp_path):
+    """A heater that is off is heated to extruder_eject_temp."""
+    sim = KlipperSimulation(
+        str(tmp_path),
+        extruder_temp=25.0,
+        options={"enable_deferred_heating": "True", "debug": "True"},
+    )
+    result = sim.run_gcode("T0")
+    assert result.result is True
+    assert sim.heaters.lookup_heater("extruder").target_temp == 200
+    responses = sim.gcode.responses
+    assert responses.index("// MMU3: Running phase bowden_load") < responses.index(
+        "// MMU3: Waiting for the heater to reach 200.0"
+    )
+
+
+def test_idle_stepper_disable_keeps_the_positions(sim):
+    """A tool change after the idle disable doesn't verify the selector."""
+    sim.mmu3.debug = True
+    sim.run_gcode("T0")
+    sim.run_gcode("G4 P5000")
+    assert sim.mmu3.number_of_stepper_disables == 1
+    responses = len(sim.gcode.responses)
+    result = sim.run_gcode("T1")
+    assert result.result is True
+    assert not any(
+        "Verifying selector position" in response
+        for response in sim.gcode.responses[responses:]
+    )
+    assert sim.mmu3.homing_confidence.needs_verification("selector") is False
+
+
+def test_idle_stepper_disable_waits_for_the_gcode_mutex(sim):
+    """The steppers are not disabled while a G-code command runs."""
+    sim.run_gcode("T0")
+    sim.gcode.mutex.locked = True
+    sim.idle(5.0)
+    assert sim.mmu3.steppers_enabled is True
+    sim.gcode.mutex.locked = False
+    sim.idle(5.0)
+    assert sim.mmu3.steppers_enabled is False
+    # the mutex is released after the disable
+    assert sim.gcode.mutex.test() is False
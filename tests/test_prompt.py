@@ -4,7 +4,7 @@
 import pytest
 
 # Local Imports
-from mainsail_prompts import Button, ButtonGroup, Color, FooterButton, Prompt
+from mainsail_prompts import Button, ButtonGroup, Color, FooterButton, Prompt, Text
 
 
 @pytest.mark.parametrize(
@@ -87,4 +87,68 @@ def test_to_gcode_returns_the_gcode_command(
     headline, widgets, expected
 ):
     prompt = Prompt(headline=headline, widgets=widgets)
-    assert prompt.to_gcode() == expected
\ No newline at end of file
+    assert prompt.to_gcode() == expected
+
+
+def test_to_actions_returns_the_action_payloads():
+    prompt = Prompt(
+        headline="Test Headline",
+        widgets=[
+            Text(text="test text"),
+            ButtonGroup(buttons=[Button(label="test button", gcode="test gcode")]),
+            FooterButton(label="test footer button", gcode=None, color=Color.Error),
+        ],
+    )
+    assert prompt.to_actions() == [
+        "action:prompt_begin Test Headline",
+        "action:prompt_text test text",
+        "action:prompt_button_group_start",
+        "action:prompt_button test button|test gcode|",
+        "action:prompt_button_group_end",
+        "action:prompt_footer_button test footer button||error",
+        "action:prompt_show",
+    ]
+
+
+def test_respond_sends_the_same_output_as_the_respond_commands():
+    prompt = Prompt(
+        headline="Test Headline",
+        widgets=[
+            Text(text="test text"),
+            ButtonGroup(buttons=[Button(label="test button", gcode="test gcode")]),
+        ],
+    )
+    responses = []
+    prompt.respond(responses.append)
+    # RESPOND TYPE=command MSG="..." responds with "// ..."
+    assert responses == [
+        line.replace('RESPOND TYPE=command MSG="', "// ")[:-1]
+        for line in prompt.to_gcode().splitlines()
+    ]
+
+
+def test_prompt_is_immutable():
+    prompt = Prompt(headline="Test Headline", widgets=[Text(text="test text")])
+    with pytest.raises(AttributeError) as cm:
+        prompt.headline = "Another Headline"
+
+    assert str(cm.value) == "Prompt is immutable"
+
+
+def test_equal_prompts_are_equal_and_have_the_same_hash():
+    prompt1 = Prompt(
+        headline="Test Headline",
+        widgets=[ButtonGroup(buttons=[Button(label="test button", gcode="G28")])],
+    )
+    prompt2 = Prompt(
+        headline="Test Headline",
+        widgets=[ButtonGroup(buttons=[Button(label="test button", gcode="G28")])],
+    )
+    assert prompt1 == prompt2
+    assert hash(prompt1) == hash(prompt2)
+    assert prompt1 != Prompt(headline="Test Headline")
+
+
+def test_to_gcode_is_memoized():
+    prompt = Prompt(headline="Test Headline", widgets=[Text(text="test text")])
+    assert prompt.to_gcode() is prompt.to_gcode()
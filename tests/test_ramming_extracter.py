@@ -0,0 +1,114 @@
+"""Tests for the ramming profile extracter."""
+
+# Standard Library Imports
+import json
+
+# Local Imports
+from klipper_sim import import_mmu3
+from scripts.ramming_extracter import (
+    build_library,
+    get_profile_id,
+    iter_ramming_blocks,
+    main,
+    to_macro,
+)
+
+TOOL_CHANGE = """\
+; CP TOOLCHANGE START
+; material : {material} -> PETG
+M220 S100
+; CP TOOLCHANGE UNLOAD
+G1 X20 Y10 E1.5 F{feedrate}
+G1 E-2
+SET_PRESSURE_ADVANCE ADVANCE=0
+G4 S0 ; dwell
+G1 X30 F3000
+; CP TOOLCHANGE WIPE
+G1 X40 E0.5
+T1
+; CP TOOLCHANGE END
+"""
+
+
+def get_gcode(*tool_changes):
+    return "G1 X10 E1 F1200\n" + "".join(
+        TOOL_CHANGE.format(material=material, feedrate=feedrate)
+        for material, feedrate in tool_changes
+    )
+
+
+def test_iter_ramming_blocks_normalizes_the_unload_moves():
+    """Only the unload block is kept, as extruder moves with a feedrate."""
+    blocks = list(iter_ramming_blocks(get_gcode(("PLA", 600)).splitlines()))
+    assert blocks == [
+        (
+            "PLA",
+            [
+                "G1 E1.5 F600",
+                "G1 E-2 F600",
+                "SET_PRESSURE_ADVANCE ADVANCE=0",
+                "G4 S0",
+            ],
+        )
+    ]
+
+
+def test_iter_ramming_blocks_defaults_the_material():
+    """A block without a material comment is the default material."""
+    gcode = get_gcode(("PLA", 600)).replace("; material : PLA -> PETG\n", "")
+    assert [material for material, _ in iter_ramming_blocks(gcode.splitlines())] == [
+        "default"
+    ]
+
+
+def test_build_library_dedupes_the_profiles_by_id():
+    """Identical blocks are stored once, the most used profile wins."""
+    blocks = list(
+        iter_ramming_blocks(
+            get_gcode(("PLA", 600), ("PLA", 900), ("PLA", 600)).splitlines()
+        )
+    )
+    library = build_library(blocks)
+    assert len(library["profiles"]) == 2
+    assert library["materials"] == {"PLA": get_profile_id(blocks[0][1])}
+    for profile_id, profile in library["profiles"].items():
+        assert get_profile_id(profile) == profile_id
+
+
+def test_build_library_merges_into_an_existing_library():
+    """The profiles are added, the materials of the new blocks are replaced."""
+    library = build_library(iter_ramming_blocks(get_gcode(("PLA", 600)).splitlines()))
+    pla_id = library["materials"]["PLA"]
+    merged = build_library(
+        iter_ramming_blocks(get_gcode(("PLA", 900), ("ASA", 600)).splitlines()),
+        json.loads(json.dumps(library)),
+    )
+    assert set(merged["profiles"]) == {pla_id, merged["materials"]["PLA"]}
+    assert merged["materials"]["PLA"] != pla_id
+    # the ASA block is identical to the old PLA one
+    assert merged["materials"]["ASA"] == pla_id
+
+
+def test_macro_is_a_native_ramming_profile():
+    """The printed macro body can be run natively by MMU3."""
+    _, profile = next(iter_ramming_blocks(get_gcode(("PLA", 600)).splitlines()))
+    ramming_profile = import_mmu3().RammingProfile.from_gcode("PLA", to_macro(profile))
+    assert ramming_profile.steps[:2] == [("move", 1.5, 10.0), ("move", -2.0, 10.0)]
+
+
+def test_main_merges_into_the_output_file(tmp_path, capsys):
+    """--merge keeps the profiles of the existing library file."""
+    gcode_path = tmp_path / "print.gcode"
+    library_path = tmp_path / "ramming.json"
+    gcode_path.write_text(get_gcode(("PLA", 600)))
+    assert main([str(gcode_path), "-o", str(library_path)]) == 0
+    gcode_path.write_text(get_gcode(("ASA", 900)))
+    assert main([str(gcode_path), "-o", str(library_path), "--merge"]) == 0
+    library = json.loads(library_path.read_text())
+    assert sorted(library["materials"]) == ["ASA", "PLA"]
+    assert len(library["profiles"]) == 2
+    assert capsys.readouterr().out.splitlines()[-1] == (
+        f"Wrote 2 profiles for 2 materials to {library_path}"
+    )
+    gcode_path.write_text("G1 X10 E1\n")
+    assert main([str(gcode_path)]) == 1
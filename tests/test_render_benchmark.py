@@ -0,0 +1,70 @@
+"""Check the rendering work of the memoized prompts."""
+
+# Local Imports
+from mainsail_prompts import Button, ButtonGroup, Color, FooterButton, Prompt, Text
+
+
+def build_prompt():
+    return Prompt(
+        headline="MMU Error",
+        widgets=[
+            Text(text="T0 => T1 failed!"),
+            ButtonGroup(
+                buttons=[
+                    Button(label="Unlock MMU", gcode="UNLOCK_MMU"),
+                    Button(label="Unload Tool", gcode="UT"),
+                ],
+            ),
+            ButtonGroup(
+                buttons=[
+                    Button(label="Home MMU", gcode="HOME_MMU"),
+                    Button(label="Retry T1", gcode="T1", color=Color.Primary),
+                ],
+            ),
+            FooterButton(label="Resume", gcode="RESUME"),
+        ],
+    )
+
+
+def count_iter_actions(monkeypatch):
+    calls = []
+    for cls in (Prompt, Text, Button, ButtonGroup, FooterButton):
+        iter_actions = cls.__dict__.get("iter_actions")
+        if iter_actions is None:
+            continue
+
+        def counting_iter_actions(self, iter_actions=iter_actions):
+            calls.append(type(self).__name__)
+            return iter_actions(self)
+
+        monkeypatch.setattr(cls, "iter_actions", counting_iter_actions)
+    return calls
+
+
+def test_memoized_prompt_renders_only_once(monkeypatch):
+    """A reused prompt renders its widgets once, a new prompt every time."""
+    number = 100
+    calls = count_iter_actions(monkeypatch)
+    prompt = build_prompt()
+    gcode = prompt.to_gcode()
+    rendered = len(calls)
+    assert rendered > 0
+    for _ in range(number):
+        assert prompt.to_gcode() == gcode
+    assert len(calls) == rendered
+
+    calls.clear()
+    for _ in range(number):
+        assert build_prompt().to_gcode() == gcode
+    assert len(calls) == number * rendered
+
+
+def test_to_color_uses_the_lookup_table(monkeypatch):
+    """Color.to_color doesn't iterate over the Color members."""
+
+    def fail_iter(cls):
+        raise AssertionError("Color members are iterated")
+
+    monkeypatch.setattr(type(Color), "__iter__", fail_iter)
+    assert Color.to_color("PrImArY") is Color.Primary
+    assert Color.to_color("warning") is Color.Warning
@@ -0,0 +1,55 @@
+"""Regression gate for the simulated tool change benchmark."""
+
+# Standard Library Imports
+import copy
+import json
+
+# Local Imports
+from tool_change_benchmark import (
+    BASELINE_PATH,
+    DETERMINISTIC_METRICS,
+    SCENARIOS,
+    compare,
+    run_benchmark,
+)
+
+
+def load_baseline():
+    with open(BASELINE_PATH) as f:
+        return json.load(f)
+
+
+def test_benchmark_has_no_regressions():
+    """The host independent metrics are not worse than the stored baseline."""
+    results = run_benchmark()
+    assert set(results["scenarios"]) == set(SCENARIOS)
+    for scenario in results["scenarios"].values():
+        assert all(record["ok"] for record in scenario["commands"])
+    assert compare(results, load_baseline(), DETERMINISTIC_METRICS) == []
+
+
+def test_compare_flags_regressions():
+    """Slower, chattier or failing commands are reported."""
+    baseline = load_baseline()
+    results = copy.deepcopy(baseline)
+    commands = results["scenarios"]["mmu3"]["commands"]
+    commands[1]["simulated_time"] *= 1.1
+    commands[2]["number_of_drains"] += 1
+    commands[3]["ok"] = False
+    results["scenarios"]["mmu3"]["total"]["cpu_time"] *= 3
+    regressions = compare(results, baseline)
+    assert len(regressions) == 4
+    assert regressions[0].startswith("mmu3 #1 T0: simulated_time")
+    assert regressions[1].startswith("mmu3 #2 T1: number_of_drains")
+    assert regressions[2] == "mmu3 #3 T4: failed"
+    assert regressions[3].startswith("mmu3 total: cpu_time")
+
+
+def test_compare_ignores_improvements():
+    """Faster commands are not regressions."""
+    baseline = load_baseline()
+    results = copy.deepcopy(baseline)
+    for record in results["scenarios"]["mmu3-12x"]["commands"]:
+        record["simulated_time"] /= 2
+        record["number_of_queries"] = 0
+    assert compare(results, baseline) == []
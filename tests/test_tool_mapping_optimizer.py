@@ -0,0 +1,129 @@
+"""Tests for the offline tool mapping optimizer."""
+
+# Standard Library Imports
+import collections
+import os
+
+# Third Party Imports
+import pytest
+
+# Local Imports
+from klipper_sim import REPO_PATH
+from scripts.tool_mapping_optimizer import (
+    MMUGeometry,
+    count_transitions,
+    get_mapping_cost,
+    iter_tool_changes,
+    main,
+    optimize_tool_mapping,
+)
+
+GCODE = """\
+G1 X10 E1
+T0
+G1 X20 E1
+T0 ; repeated, not a change
+T4 ; change to T4
+G1 X30 E1
+T0
+T4
+M104 T1 S215
+"""
+
+
+def get_change_duration(geometry, transitions, mapping):
+    matrix = geometry.get_matrix(geometry.get_change_duration)
+    return get_mapping_cost(mapping, transitions, matrix, geometry.park)
+
+
+def test_iter_tool_changes_skips_repeats_and_parameters():
+    """Only the T<n> commands that change the tool are extracted."""
+    assert list(iter_tool_changes(GCODE.splitlines())) == [0, 4, 0, 4]
+
+
+def test_count_transitions_starts_from_the_park_position():
+    """The first tool change moves from the park position."""
+    assert count_transitions([0, 4, 0, 4]) == collections.Counter(
+        {(None, 0): 1, (0, 4): 2, (4, 0): 1}
+    )
+
+
+def test_geometry_reads_the_mmu3_config():
+    """The positions and motion limits are read from the config file."""
+    geometry = MMUGeometry.from_config_file(os.path.join(REPO_PATH, "mmu3.cfg"))
+    assert geometry.number_of_tools == 5
+    assert geometry.tool_mapping == [0, 1, 2, 3, 4]
+    assert geometry.selector_positions[-1] == 0
+    assert geometry.idler_speed == 500
+    assert geometry.get_selector_travel(0, 4) == pytest.approx(56.5)
+    assert geometry.get_idler_travel(geometry.park, 0) == 80
+
+
+def test_tool_change_moves_the_idler_from_and_to_the_park_position():
+    """The idler leaves the park position to unload and parks after the load."""
+    geometry = MMUGeometry({})
+    park = geometry.park
+    # idler 85 -> 5 -> 65 -> 85, selector 73.5 -> 17
+    assert geometry.get_change_idler_travel(0, 4) == 80 + 60 + 20
+    assert geometry.get_change_duration(0, 4) == pytest.approx(
+        geometry.get_idler_duration(park, 0)
+        + geometry.get_select_duration(0, 4)
+        + geometry.get_idler_duration(4, park)
+    )
+    # nothing to unload before the first tool change
+    assert geometry.get_change_idler_travel(park, 0) == 80 + 80
+    # the park legs depend on the mapping
+    transitions = count_transitions([0, 1, 0, 1])
+    assert get_change_duration(
+        geometry, transitions, [3, 4, 0, 1, 2]
+    ) < get_change_duration(geometry, transitions, [0, 1, 2, 3, 4])
+
+
+def test_geometry_validates_the_tool_mapping():
+    """The tool mapping needs a slot for every tool."""
+    with pytest.raises(ValueError, match="tool_mapping needs 5 slots"):
+        MMUGeometry({"tool_mapping": "0, 1"})
+
+
+def test_optimizer_moves_the_alternating_tools_next_to_each_other():
+    """The exhaustive search puts the tools used together in adjacent slots."""
+    geometry = MMUGeometry({})
+    transitions = count_transitions([0, 4, 0, 4, 0, 4])
+    mapping = optimize_tool_mapping(geometry, transitions)
+    assert sorted(mapping) == list(range(5))
+    assert abs(mapping[0] - mapping[4]) == 1
+    assert get_change_duration(geometry, transitions, mapping) < get_change_duration(
+        geometry, transitions, geometry.tool_mapping
+    )
+
+
+def test_optimizer_keeps_an_optimal_mapping():
+    """The current mapping is kept if it can't be improved."""
+    geometry = MMUGeometry({"tool_mapping": "4, 3, 2, 1, 0"})
+    transitions = count_transitions([0, 1, 0, 1])
+    assert optimize_tool_mapping(geometry, transitions) == [4, 3, 2, 1, 0]
+
+
+def test_local_search_improves_the_12x_mapping():
+    """The local search is used when there are too many assignments."""
+    geometry = MMUGeometry.from_config_file(os.path.join(REPO_PATH, "mmu3-12x.cfg"))
+    tools = [0, 11, 1, 10, 2, 9, 3, 8, 4, 7, 5, 6] * 5
+    transitions = count_transitions(tools)
+    mapping = optimize_tool_mapping(geometry, transitions, restarts=5)
+    assert sorted(mapping) == list(range(12))
+    # the idler park moves of every tool change can not be avoided
+    assert get_change_duration(
+        geometry, transitions, mapping
+    ) < 0.75 * get_change_duration(geometry, transitions, geometry.tool_mapping)
+
+
+def test_main_prints_a_tool_mapping_line(tmp_path, capsys):
+    """The result is printed as a ready to paste config line."""
+    gcode_path = tmp_path / "print.gcode"
+    gcode_path.write_text(GCODE)
+    assert main([str(gcode_path), "-c", os.path.join(REPO_PATH, "mmu3.cfg")]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == "4 tool changes"
+    assert lines[-1].startswith("tool_mapping: ")
+    gcode_path.write_text("T7\n")
+    assert main([str(gcode_path), "-c", os.path.join(REPO_PATH, "mmu3.cfg")]) == 1
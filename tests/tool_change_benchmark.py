@@ -0,0 +1,307 @@
+"""Benchmark the MMU3 commands in the simulated printer.
+
+Every scenario loads MMU3 from a config file into a fresh simulated printer
+(see ``klipper_sim.py``) and runs a sequence of commands, with an idle gap
+between them as in a print. For every command the simulated mechanical time,
+the number of queue drains, the number of MCU queries and the host CPU time
+are recorded, and written as JSON::
+
+    python tests/tool_change_benchmark.py -o results.json
+
+The results can be compared against a baseline, the regressions are printed
+and the exit code is 1 if there are any::
+
+    python tests/tool_change_benchmark.py --compare tests/tool_change_baseline.json
+
+Use ``--update-baseline`` to rewrite the baseline with the new results.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+# the tests directory is not a package, make the harness and the extras
+# importable when this is run as a script
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+for path in (TESTS_PATH, os.path.dirname(TESTS_PATH)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from klipper_sim import REPO_PATH, KlipperSimulation  # noqa: E402
+
+RESULTS_VERSION = 1
+
+BASELINE_PATH = os.path.join(TESTS_PATH, "tool_change_baseline.json")
+
+# the idle time between the commands, long enough for the steppers to be
+# disabled after being idle like between the tool changes of a print
+IDLE_TIME = 5.0
+
+# the scenarios, the config file, the mmu3 option overrides and the commands
+SCENARIOS = {
+    "mmu3": {
+        "config": "mmu3.cfg",
+        "options": {},
+        "commands": ["HOME_MMU", "T0", "T1", "T4", "T0", "M702"],
+    },
+    "mmu3-12x": {
+        "config": "mmu3-12x.cfg",
+        "options": {},
+        "commands": ["HOME_MMU", "T0", "T1", "T11", "T0", "M702"],
+    },
+    "no_selector": {
+        "config": "mmu3.cfg",
+        "options": {"enable_no_selector_mode": "True"},
+        "commands": ["HOME_MMU", "T0", "T1", "T4", "T0", "M702"],
+    },
+}
+
+# the metrics and their allowed relative and absolute increase
+METRICS = {
+    "simulated_time": (0.01, 0.001),
+    "number_of_drains": (0.0, 0),
+    "number_of_queries": (0.0, 0),
+    "cpu_time": (0.5, 0.005),
+}
+
+# the metrics that don't depend on the host
+DETERMINISTIC_METRICS = ["simulated_time", "number_of_drains", "number_of_queries"]
+
+
+def run_scenario(name: str, repeat: int = 1) -> list[dict]:
+    """Run the commands of a scenario in a fresh simulated printer.
+
+    Args:
+        name (str): The scenario name.
+        repeat (int): The number of runs, the minimum CPU time is reported.
+
+    Returns:
+        list[dict]: The metrics of the commands.
+    """
+    scenario = SCENARIOS[name]
+    records = None
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as state_dir:
+            sim = KlipperSimulation(
+                state_dir,
+                config_path=os.path.join(REPO_PATH, scenario["config"]),
+                options=scenario["options"],
+            )
+            run_records = []
+            for i, command in enumerate(scenario["commands"]):
+                if i:
+                    sim.idle(IDLE_TIME)
+                result = sim.run_gcode(command)
+                run_records.append(
+                    {
+                        "command": command,
+                        "ok": result.result is not False,
+                        **{metric: result.stats[metric] for metric in METRICS},
+                    }
+                )
+        if records is None:
+            records = run_records
+            continue
+        for record, run_record in zip(records, run_records):
+            record["cpu_time"] = min(record["cpu_time"], run_record["cpu_time"])
+    return records
+
+
+def run_benchmark(names: None | list[str] = None, repeat: int = 1) -> dict:
+    """Run the given scenarios.
+
+    Args:
+        names (None | list[str]): The scenario names, default all of them.
+        repeat (int): The number of runs per scenario.
+
+    Returns:
+        dict: The results.
+    """
+    scenarios = {}
+    for name in names or SCENARIOS:
+        records = run_scenario(name, repeat)
+        scenarios[name] = {
+            "commands": records,
+            "total": {
+                metric: sum(record[metric] for record in records)
+                for metric in METRICS
+            },
+        }
+    return {"version": RESULTS_VERSION, "scenarios": scenarios}
+
+
+def is_regression(metric: str, value: float, baseline_value: float) -> bool:
+    """Check if the value of a metric is worse than its baseline value.
+
+    Args:
+        metric (str): The metric name.
+        value (float): The new value.
+        baseline_value (float): The baseline value.
+
+    Returns:
+        bool: True if the value exceeds the allowed increase.
+    """
+    relative, absolute = METRICS[metric]
+    return value > baseline_value * (1 + relative) + absolute
+
+
+def compare(
+    results: dict, baseline: dict, metrics: None | list[str] = None
+) -> list[str]:
+    """Compare the results against a baseline.
+
+    The per command values are compared for the deterministic metrics, only
+    the scenario totals are compared for the CPU time as the per command
+    values are too noisy.
+
+    Args:
+        results (dict): The new results.
+        baseline (dict): The baseline results.
+        metrics (None | list[str]): The metrics to compare, default all of
+            them.
+
+    Returns:
+        list[str]: The regressions.
+    """
+    metrics = metrics or list(METRICS)
+    regressions = []
+    for name, scenario in results["scenarios"].items():
+        baseline_scenario = baseline["scenarios"].get(name)
+        if baseline_scenario is None:
+            continue
+        baseline_commands = baseline_scenario["commands"]
+        for i, record in enumerate(scenario["commands"]):
+            if (
+                i >= len(baseline_commands)
+                or baseline_commands[i]["command"] != record["command"]
+            ):
+                break
+            baseline_record = baseline_commands[i]
+            if baseline_record["ok"] and not record["ok"]:
+                regressions.append(f"{name} #{i} {record['command']}: failed")
+            for metric in metrics:
+                if metric == "cpu_time":
+                    continue
+                if is_regression(metric, record[metric], baseline_record[metric]):
+                    regressions.append(
+                        f"{name} #{i} {record['command']}: {metric} "
+                        f"{baseline_record[metric]:g} -> {record[metric]:g}"
+                    )
+        if "cpu_time" in metrics and is_regression(
+            "cpu_time",
+            scenario["total"]["cpu_time"],
+            baseline_scenario["total"]["cpu_time"],
+        ):
+            regressions.append(
+                f"{name} total: cpu_time "
+                f"{baseline_scenario['total']['cpu_time']:g} -> "
+                f"{scenario['total']['cpu_time']:g}"
+            )
+    return regressions
+
+
+def format_results(results: dict) -> str:
+    """Format the results as a table.
+
+    Args:
+        results (dict): The results.
+
+    Returns:
+        str: The table.
+    """
+    lines = [
+        f"{'scenario':<12} {'command':<9} {'ok':<3} {'sim (s)':>9} "
+        f"{'drains':>7} {'queries':>8} {'cpu (ms)':>9}"
+    ]
+    for name, scenario in results["scenarios"].items():
+        for record in [
+            *scenario["commands"],
+            {"command": "total", "ok": True, **scenario["total"]},
+        ]:
+            lines.append(
+                f"{name:<12} {record['command']:<9} "
+                f"{'yes' if record['ok'] else 'no':<3} "
+                f"{record['simulated_time']:>9.3f} "
+                f"{record['number_of_drains']:>7d} "
+                f"{record['number_of_queries']:>8d} "
+                f"{record['cpu_time'] * 1000:>9.2f}"
+            )
+    return "\n".join(lines)
+
+
+def write_results(results: dict, path: str) -> None:
+    """Write the results as JSON.
+
+    Args:
+        results (dict): The results.
+        path (str): The file path.
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+        f.write("\n")
+    os.replace(temp_path, path)
+
+
+def main(argv: None | list[str] = None) -> int:
+    """Run the benchmark.
+
+    Args:
+        argv (None | list[str]): The command line arguments.
+
+    Returns:
+        int: The exit code, 1 if there are regressions.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "-s",
+        "--scenario",
+        action="append",
+        choices=list(SCENARIOS),
+        help="the scenarios to run, default all of them",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=5,
+        help="the number of runs per scenario, the minimum CPU time is kept",
+    )
+    parser.add_argument("-o", "--output", help="the results file to write")
+    parser.add_argument(
+        "-c", "--compare", metavar="BASELINE", help="the baseline file to compare to"
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help=f"write the results to {os.path.relpath(BASELINE_PATH, REPO_PATH)}",
+    )
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.scenario, max(1, args.repeat))
+    print(format_results(results))
+    if args.output:
+        write_results(results, args.output)
+    if args.update_baseline:
+        write_results(results, BASELINE_PATH)
+
+    if not args.compare:
+        return 0
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline)
+    if regressions:
+        print(f"\n{len(regressions)} regressions against {args.compare}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print(f"\nNo regressions against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())